@@ -1,40 +1,136 @@
-import pandas as pd
-from sklearn.ensemble import RandomForestClassifier
-from sklearn.model_selection import train_test_split
-from sklearn.preprocessing import OneHotEncoder
-from sklearn.pipeline import make_pipeline
-from sklearn.compose import ColumnTransformer
+import argparse
+import json
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
 import joblib
+import pandas as pd
+
+import features
+import flatforest
+import training
+
+
+def parse_windows(text):
+    return tuple(int(w) for w in text.split(',') if w.strip())
+
+
+def parse_depth(text):
+    return None if text.strip().lower() == 'none' else int(text)
+
+
+def train(args, configs, source, options, cache_dir):
+    """build (or load) the features, cross validate, then fit and save the chosen config on all the data"""
+    # parse and label each window set once, in parallel when there are several
+    window_sets = list(dict.fromkeys(tuple(c['windows']) for c in configs))
+    if len(window_sets) > 1 and (args.workers or os.cpu_count() or 1) > 1:
+        with ProcessPoolExecutor(max_workers=min(args.workers or os.cpu_count(), len(window_sets))) as pool:
+            paths = list(pool.map(training.build_features, [source] * len(window_sets), window_sets,
+                                  [options] * len(window_sets), [cache_dir] * len(window_sets)))
+    else:
+        paths = [training.build_features(source, w, options, cache_dir) for w in window_sets]
+    cache_paths = dict(zip(window_sets, paths))
+
+    if args.folds:
+        print(f"Evaluating {len(configs)} config(s), {args.folds} {args.cv} folds, {args.gap:g}s gap")
+        started = time.perf_counter()
+        try:
+            results = training.sweep(configs, cache_paths, args.folds, args.cv, int(args.gap * 1e6), args.workers)
+        except ValueError as e:
+            raise SystemExit(f"Cross validation failed: {e}")
+        print(f"Evaluated in {time.perf_counter() - started:.1f}s")
+        training.print_results(results, args.rate)
+        best = training.pick(results, args.select, args.max_us)
+        if args.report:
+            with open(args.report, 'w') as f:
+                json.dump({'cv': args.cv, 'folds': args.folds, 'gap_s': args.gap, 'select': args.select,
+                           'results': results, 'best': best}, f, indent=2)
+        print(f"Best by {args.select}: windows {best['windows']}, {best['trees']} trees, depth {best['depth']}")
+    else:
+        best = configs[0]
+    windows = tuple(best['windows'])
+
+    df = pd.read_pickle(cache_paths[windows])
+    df['stage'] = df['stage'].astype(str)
+    sample_hz = df.attrs.get('sample_hz')
+    print(f"Samples marked as failure: {(df['failure'] == 1).sum()} of {len(df)}")
+    if sample_hz:
+        print(f"Training data at {sample_hz:.1f}Hz, rolling windows {windows} samples = "
+              f"{', '.join(f'{w / sample_hz:g}s' for w in windows) or 'none'}")
+
+    print("Training model on all samples")
+    model = training.make_model(best['trees'], best['depth'], args.jobs)
+    started = time.perf_counter()
+    model.fit(df[features.model_features(windows)], df['failure'], **{training.FIT_WEIGHT: df['weight'].to_numpy()})
+    print(f"Trained in {time.perf_counter() - started:.1f}s")
+    model.steps[-1][1].set_params(n_jobs=1) # predictive_maintain.py scores small batches, threads only add overhead
+    model.rolling_windows = windows # predictive_maintain.py rebuilds the same features from this
+    model.sample_hz = sample_hz # and only from rows at this rate, the windows count samples
+    model.trained_at = int(time.time()) # model version recorded with each prediction
+
+    joblib.dump(model, 'failure_model.joblib')
+    # NumPy only copy for predictive_maintain.py, loads without pandas/sklearn
+    flatforest.export(model, 'failure_model.npz', windows, model.trained_at, sample_hz)
+    cost = training.inference_cost(model, windows, df)
+    print(f"Scoring cost {cost['us_per_sample']:.1f}us per sample with failure_model.npz "
+          f"({100 * args.rate * cost['us_per_sample'] / 1e6:.1f}% of a core at {args.rate:g}Hz), "
+          f"{cost['nodes']} nodes, {cost['model_kb']:.0f}KB")
+    print("Model trained and saved!")
 
-df = pd.read_csv('training_data.csv', delimiter=',', header=None, names=['timestamp', 'temp', 'pressure', 'amplitude', 'frequency', 'stage', 'unused'])
-print(f"Loaded {len(df)} samples")
-df = df.sort_values('timestamp').reset_index(drop=True)
-df['failure'] = 0
 
-LOOKBACK_US = 10 * 1_000_000  # 10 seconds in microseconds
 
-# Find where PartReplacement happens and mark prior rows
-for idx, row in df[df['stage'] == 'PartReplacement'].iterrows():
-    failure_time = row['timestamp']
-    early_window_start = failure_time - LOOKBACK_US
-    # Mark rows in the 10s window before failure
-    df.loc[(df['timestamp'] >= early_window_start) & (df['timestamp'] <= failure_time), 'failure'] = 1
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Train the failure prediction model")
+    parser.add_argument('csv', nargs='?', default='training_data.csv', help="HF training csv (or .hfb)")
+    parser.add_argument('--windows', default=','.join(str(w) for w in features.ROLLING_WINDOWS),
+                        help="comma separated rolling window sizes in samples, empty for raw features only")
+    parser.add_argument('--train-dir', help="stream every train_<ts>.csv in this dir instead of loading one csv")
+    parser.add_argument('--chunksize', type=int, default=200_000, help="rows per chunk read in --train-dir mode")
+    parser.add_argument('--max-memory-mb', type=int, default=512,
+                        help="approximate peak memory for --train-dir mode, sets the size of the training sample")
+    parser.add_argument('--trees', type=int, default=100, help="trees in the forest")
+    parser.add_argument('--depth', default='none', help="max tree depth, none for unlimited")
+    parser.add_argument('--jobs', type=int, default=-1, help="cores for building the final forest (-1 = all)")
+    parser.add_argument('--cv', choices=training.CV_METHODS, default='event',
+                        help="event/blocked: contiguous time folds, random: the old leaky shuffled split")
+    parser.add_argument('--folds', type=int, default=5, help="cross validation folds, 0 to skip evaluation")
+    parser.add_argument('--gap', type=float, default=training.GAP_US / 1e6,
+                        help="seconds of training rows left out on each side of a test fold")
+    parser.add_argument('--sweep', action='store_true', help="evaluate every combination of the --sweep-* lists")
+    parser.add_argument('--sweep-windows', default='50,200;100,400;50',
+                        help="window sets separated by ; (an empty set is raw features only)")
+    parser.add_argument('--sweep-trees', default='25,50,100')
+    parser.add_argument('--sweep-depth', default='none,12')
+    parser.add_argument('--workers', type=int, default=None, help="processes for the sweep (default all cores)")
+    parser.add_argument('--select', choices=training.METRICS, default='average_precision',
+                        help="metric the sweep picks the saved model by")
+    parser.add_argument('--max-us', type=float, default=None,
+                        help="only pick configs that score a sample in under this many microseconds")
+    parser.add_argument('--rate', type=float, default=100, help="sample rate the scoring cost is reported against")
+    parser.add_argument('--cache-dir', default=training.CACHE_DIR, help="feature cache, '' to parse every time")
+    parser.add_argument('--report', help="write every evaluated config as json here")
+    args = parser.parse_args(argv)
 
-num_failures = (df['failure'] == 1).sum()
-print(f"Samples marked as failure: {num_failures}")
-X = df[['temp', 'pressure', 'amplitude', 'frequency', 'stage']]
-y = df['failure']
+    windows = parse_windows(args.windows)
+    if args.sweep:
+        configs = training.grid([parse_windows(w) for w in args.sweep_windows.split(';')],
+                                [int(t) for t in args.sweep_trees.split(',')],
+                                [parse_depth(d) for d in args.sweep_depth.split(',')])
+    else:
+        configs = training.grid([windows], [args.trees], [parse_depth(args.depth)])
 
-X = X.dropna()
-y = y.loc[X.index]
+    source = args.train_dir or args.csv
+    options = {'chunksize': args.chunksize, 'max_memory_mb': args.max_memory_mb} if args.train_dir else {}
 
-preprocessor = ColumnTransformer(transformers=[('stage', OneHotEncoder(), ['stage'])], remainder='passthrough')
-X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
+    if args.cache_dir:
+        train(args, configs, source, options, args.cache_dir)
+    else:
+        with tempfile.TemporaryDirectory(prefix='features_') as d:
+            train(args, configs, source, options, d)
 
-print("Making pipeline")
-model = make_pipeline(preprocessor, RandomForestClassifier(n_estimators=100, random_state=42))
-print("Training model")
-model.fit(X_train, y_train)
 
-joblib.dump(model, 'failure_model.joblib')
-print("Model trained and saved!")
+# the sweep's process pools re-import this module under spawn/forkserver, so nothing runs on import
+if __name__ == "__main__":
+    main()
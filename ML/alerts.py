@@ -0,0 +1,205 @@
+"""
+Alert dispatcher for predictive_maintain.py
+
+send_email_alert used to run inside the scoring loop: a new SMTP connection, starttls and login for
+every alert, and nothing around it, so a slow or unreachable mail server stalled inference for the
+whole TCP timeout (or killed the loop). Now:
+  - raise_alert() only checks the cooldown and puts the alert on a bounded queue, it never blocks.
+    When the queue is full the alert is dropped and counted
+  - one worker thread sends them over a persistent SMTP connection, reconnecting when the server has
+    dropped it, and retries with exponential backoff
+  - cooldowns are per condition (e.g. 'failure_risk') and kept in alert_state.json, so a restart
+    doesn't resend an alert that just went out. An alert already queued for a condition is not queued again
+
+Usage (test against a local SMTP stand-in, e.g. `python3 -m aiosmtpd -n -l localhost:1025`):
+  python3 alerts.py --server localhost --port 1025 --no-tls
+"""
+
+import argparse
+import json
+import os
+import queue
+import smtplib
+import threading
+import time
+from email.mime.text import MIMEText
+
+STATE_FILE = 'alert_state.json'
+COOLDOWN = 5 * 60      # seconds between alerts for the same condition
+QUEUE_SIZE = 32
+RETRIES = 5
+BACKOFF = 2.0          # first retry delay in seconds, doubled each attempt
+BACKOFF_MAX = 60.0
+SMTP_TIMEOUT = 10.0
+
+
+class SmtpSender:
+    """
+    one SMTP connection kept open between alerts
+    - checked with NOOP before use and reopened if the server has closed it
+    - starttls/login only when configured, so a plain local test server works
+    """
+    def __init__(self, server, port, sender, to, password='', starttls=True, timeout=SMTP_TIMEOUT):
+        self.server = server
+        self.port = port
+        self.sender = sender
+        self.to = to
+        self.password = password
+        self.starttls = starttls
+        self.timeout = timeout
+        self.smtp = None
+
+    def connect(self):
+        self.close()
+        smtp = smtplib.SMTP(self.server, self.port, timeout=self.timeout)
+        try:
+            if self.starttls:
+                smtp.starttls()
+            if self.password:
+                smtp.login(self.sender, self.password)
+        except Exception:
+            smtp.close()
+            raise
+        self.smtp = smtp
+
+    def alive(self):
+        try:
+            return self.smtp is not None and self.smtp.noop()[0] == 250
+        except (smtplib.SMTPException, OSError):
+            return False
+
+    def send(self, subject, body):
+        if not self.alive():
+            self.connect()
+        msg = MIMEText(body)
+        msg['Subject'] = subject
+        msg['From'] = self.sender
+        msg['To'] = self.to
+        try:
+            self.smtp.sendmail(self.sender, [self.to], msg.as_string())
+        except (smtplib.SMTPServerDisconnected, OSError):
+            self.smtp = None # reconnect on the next attempt
+            raise
+
+    def close(self):
+        if self.smtp is not None:
+            try:
+                self.smtp.quit()
+            except (smtplib.SMTPException, OSError):
+                self.smtp.close()
+            self.smtp = None
+
+
+class AlertDispatcher:
+    """
+    raise_alert(condition, subject, body) from the scoring loop, a background thread does the sending
+    - sender is anything with send(subject, body) and close() (SmtpSender)
+    """
+    def __init__(self, sender, state_path=STATE_FILE, cooldown=COOLDOWN, queue_size=QUEUE_SIZE,
+                 retries=RETRIES, backoff=BACKOFF, backoff_max=BACKOFF_MAX):
+        self.sender = sender
+        self.state_path = state_path
+        self.cooldown = cooldown
+        self.retries = retries
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.lock = threading.Lock()
+        self.last_sent = self.load_state()  # condition -> unix time of the last alert that went out
+        self.pending = set()                # conditions with an alert queued or being sent
+        self.counts = dict.fromkeys(('raised', 'sent', 'failed', 'dropped', 'suppressed'), 0)
+        self.stopping = threading.Event()
+        self.worker = threading.Thread(target=self.run, name='alerts', daemon=True)
+        self.worker.start()
+
+    def load_state(self):
+        try:
+            with open(self.state_path) as f:
+                return {str(k): float(v) for k, v in json.load(f).items()}
+        except (OSError, ValueError, AttributeError):
+            return {}
+
+    def save_state(self):
+        tmp = self.state_path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.last_sent, f)
+        os.replace(tmp, self.state_path)
+
+    def raise_alert(self, condition, subject, body, now=None):
+        """queue an alert unless the condition is cooling down or already queued, never blocks"""
+        now = time.time() if now is None else now
+        with self.lock:
+            self.counts['raised'] += 1
+            if condition in self.pending or now - self.last_sent.get(condition, 0) < self.cooldown:
+                self.counts['suppressed'] += 1
+                return False
+            try:
+                self.queue.put_nowait((condition, subject, body, now))
+            except queue.Full:
+                self.counts['dropped'] += 1
+                return False
+            self.pending.add(condition)
+        return True
+
+    def run(self):
+        while not self.stopping.is_set() or not self.queue.empty():
+            try:
+                condition, subject, body, raised_at = self.queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            ok = self.deliver(subject, body)
+            with self.lock:
+                self.pending.discard(condition)
+                if ok:
+                    self.counts['sent'] += 1
+                    self.last_sent[condition] = raised_at
+                else:
+                    self.counts['failed'] += 1
+            if ok:
+                try:
+                    self.save_state()
+                except OSError as e:
+                    print(f"Alert state not saved: {e}")
+            self.queue.task_done()
+
+    def deliver(self, subject, body):
+        delay = self.backoff
+        for attempt in range(1, self.retries + 1):
+            try:
+                self.sender.send(subject, body)
+                print(f"Alert sent: {subject}")
+                return True
+            except Exception as e:
+                print(f"Alert attempt {attempt}/{self.retries} failed: {e}")
+            if attempt < self.retries and self.stopping.wait(delay):
+                break # shutting down, don't sit out the backoff
+            delay = min(delay * 2, self.backoff_max)
+        return False
+
+    def close(self, timeout=5.0):
+        """send what is queued (up to timeout seconds) and close the connection"""
+        self.stopping.set()
+        self.worker.join(timeout)
+        self.sender.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Send a test alert through the dispatcher")
+    parser.add_argument('--server', default='localhost')
+    parser.add_argument('--port', type=int, default=1025)
+    parser.add_argument('--sender', default='injection_mouldingmachine@company2.com')
+    parser.add_argument('--to', default='machineoperator@company.com')
+    parser.add_argument('--password', default='')
+    parser.add_argument('--no-tls', action='store_true', help="plain SMTP, for a local test server")
+    parser.add_argument('--state', default='alert_test_state.json')
+    parser.add_argument('--count', type=int, default=3, help="alerts raised, only the first gets past the cooldown")
+    args = parser.parse_args()
+
+    dispatcher = AlertDispatcher(SmtpSender(args.server, args.port, args.sender, args.to, args.password,
+                                            starttls=not args.no_tls), state_path=args.state)
+    for i in range(args.count):
+        start = time.perf_counter()
+        queued = dispatcher.raise_alert('test', "Predictive Maintenance Alert (test)", f"Test alert {i + 1}")
+        print(f"raise_alert {i + 1}: {'queued' if queued else 'suppressed'} in {(time.perf_counter() - start) * 1e6:.0f}us")
+    dispatcher.close(timeout=30)
+    print(dispatcher.counts)
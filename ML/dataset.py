@@ -0,0 +1,150 @@
+"""
+Out-of-core loading of the HF captures the C logger writes to train/train_<ts>.csv
+
+- files are read in fixed size chunks with explicit dtypes and a categorical stage column
+- the unused label column is never parsed
+- failure labels use the PartReplacement times of ALL files, so a 10s window that starts
+  in one file and fails in the next is still labelled
+- rolling features carry across chunk and file boundaries (features.OnlineFeatures)
+- binary .hfb captures (beaglebone/hfbin.py) are read the same way, sliced straight from a memmap
+"""
+
+import glob
+import os
+import re
+import sys
+import numpy as np
+import pandas as pd
+
+import features
+
+# hfbin.py lives with the logger tools in beaglebone/ (everything is flat in /home/debian on the BBB)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'beaglebone'))
+import hfbin
+
+STAGE_DTYPE = pd.CategoricalDtype(features.STAGES)
+DTYPES = {
+    'timestamp': np.int64,
+    'temp': np.float32,
+    'pressure': np.float32,
+    'amplitude': np.float32,
+    'frequency': np.float32,
+    'stage': STAGE_DTYPE,
+}
+USECOLS = list(DTYPES)  # everything but 'unused'
+
+
+def list_files(directory, prefix='train'):
+    """capture files (.csv or .hfb) in time order, using the unix time the logger puts in the name"""
+    files = glob.glob(os.path.join(directory, f'{prefix}_*.csv'))
+    files += glob.glob(os.path.join(directory, f'{prefix}_*{hfbin.EXT}'))
+
+    def file_ts(path):
+        m = re.search(r'_(\d+)\.\w+$', path)
+        return int(m.group(1)) if m else 0
+    return sorted(files, key=lambda p: (file_ts(p), p))
+
+
+def read_chunks(path, chunksize, usecols=USECOLS):
+    """iterate a logger csv or hfb file in chunks of at most chunksize rows"""
+    if path.endswith(hfbin.EXT):
+        return read_hfb_chunks(path, chunksize, usecols)
+    return pd.read_csv(path, header=None, names=features.COLUMNS, usecols=usecols,
+                       dtype={c: DTYPES[c] for c in usecols}, chunksize=chunksize)
+
+
+def read_hfb_chunks(path, chunksize, usecols=USECOLS):
+    """same frames as read_chunks gives for a csv, but no text parsing"""
+    records, stages = hfbin.read(path)
+    # file stage codes -> codes of STAGE_DTYPE, stages we don't know become NaN
+    lut = np.array([features.STAGES.index(s) if s in features.STAGES else -1 for s in stages] or [-1],
+                   dtype=np.int8)
+    for start in range(0, len(records), chunksize):
+        block = records[start:start + chunksize]
+        cols = {}
+        for c in usecols:
+            if c == 'stage':
+                cols[c] = pd.Categorical.from_codes(lut[block['stage']], dtype=STAGE_DTYPE)
+            else:
+                cols[c] = block[c].astype(DTYPES[c])
+        yield pd.DataFrame(cols, index=pd.RangeIndex(start, start + len(block)))
+
+
+def scan_failure_times(files, chunksize):
+    """first pass: sorted PartReplacement timestamps over every file (only 2 columns parsed)"""
+    times = []
+    for path in files:
+        for chunk in read_chunks(path, chunksize, usecols=['timestamp', 'stage']):
+            times.append(chunk.loc[chunk['stage'] == 'PartReplacement', 'timestamp'].to_numpy())
+    return np.sort(np.concatenate(times)) if times else np.empty(0, dtype=np.int64)
+
+
+def iter_labelled_chunks(files, chunksize, windows=features.ROLLING_WINDOWS, fail_times=None):
+    """yields chunks with the rolling features and the 'failure' label added"""
+    if fail_times is None:
+        fail_times = scan_failure_times(files, chunksize)
+    online = features.OnlineFeatures(windows)
+    for path in files:
+        for chunk in read_chunks(path, chunksize):
+            chunk = chunk.dropna()
+            chunk['stage'] = chunk['stage'].astype(str) # OnlineFeatures groups on plain stage names
+            chunk = online.transform(chunk)
+            chunk['stage'] = chunk['stage'].astype(STAGE_DTYPE)
+            chunk['failure'] = features.label_failures(chunk['timestamp'], fail_times)
+            yield chunk
+
+
+class StratifiedReservoir:
+    """
+    Uniform sample of a stream with a fixed row budget, split evenly between the failure classes
+    so the rare failure rows aren't drowned out (classes that don't fill their half keep everything).
+    The split changes the class balance, weight each row by weights() to fit and score as if on the
+    whole stream, so the probabilities (and the scoring.conf thresholds) match a model fitted on all rows.
+    """
+    def __init__(self, capacity, label='failure', classes=(0, 1), seed=42):
+        self.label = label
+        self.capacity = {c: max(1, capacity // len(classes)) for c in classes}
+        self.seen = {c: 0 for c in classes}
+        self.samples = {c: None for c in classes}
+        self.rng = np.random.default_rng(seed)
+
+    def add(self, chunk):
+        for c in self.capacity:
+            rows = chunk[chunk[self.label] == c]
+            if len(rows):
+                self._add_class(c, rows.reset_index(drop=True))
+
+    def _add_class(self, c, rows):
+        cap, seen, kept = self.capacity[c], self.seen[c], self.samples[c]
+        n_kept = 0 if kept is None else len(kept)
+        # fill the empty slots first
+        fill = min(cap - n_kept, len(rows))
+        if fill > 0:
+            head = rows.iloc[:fill]
+            kept = head.copy() if kept is None else pd.concat([kept, head], ignore_index=True)
+        # algorithm R for the rest: row number k (1 based) replaces a random slot with prob cap/k
+        rest = rows.iloc[fill:]
+        if len(rest):
+            k = seen + fill + np.arange(1, len(rest) + 1)
+            slot = (self.rng.random(len(rest)) * k).astype(np.int64)
+            take = np.flatnonzero(slot < cap)
+            # later rows win when two rows pick the same slot, same as doing it one by one
+            for col in kept.columns:
+                values = kept[col].to_numpy(copy=True)
+                values[slot[take]] = rest[col].to_numpy()[take]
+                kept[col] = pd.Series(values, dtype=kept[col].dtype)
+        self.samples[c] = kept
+        self.seen[c] = seen + len(rows)
+
+    def weights(self):
+        """{class: rows seen per row kept}"""
+        return {c: self.seen[c] / len(s) for c, s in self.samples.items() if s is not None and len(s)}
+
+    def frame(self):
+        parts = [s for s in self.samples.values() if s is not None]
+        return pd.concat(parts, ignore_index=True) if parts else pd.DataFrame()
+
+
+def bytes_per_row(chunk):
+    """in-memory size of one row of a feature chunk, for turning a memory cap into a row budget"""
+    return max(1, int(chunk.memory_usage(index=True, deep=True).sum() / max(len(chunk), 1)))
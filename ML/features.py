@@ -0,0 +1,138 @@
+"""
+Feature engineering shared by ML_trainer.py and predictive_maintain.py
+
+- failure labels: rows in the LOOKBACK_US window before a PartReplacement row
+- rolling per-stage stats (mean, std, slope) of amplitude/temp/pressure
+
+Rolling windows are counted in samples of the same stage, so a window carries across cycles
+(ie the Holding window keeps looking at the last N Holding samples while the machine is in another stage).
+This is what picks up the slow vibration drift the simulator adds before a part failure.
+Training and live inference call the same stage_rolling() so both see identical features.
+
+Because the windows count samples, the features only mean the same thing live when rows arrive at the
+rate the model was trained on (200 samples is 2s of 100Hz train/ data, but 50s of 4Hz logs/ rows).
+The trainer records that rate in the model, predictive_maintain.py only scores sources that match it.
+"""
+
+import collections
+import numpy as np
+
+# pandas is imported by the functions that use it, so the constants and labels (and flatforest.py,
+# history.py) load without it
+
+COLUMNS = ['timestamp', 'temp', 'pressure', 'amplitude', 'frequency', 'stage', 'unused']
+BASE_FEATURES = ['temp', 'pressure', 'amplitude', 'frequency', 'stage']
+STAGES = ['PreInjection', 'Injection', 'Holding', 'Cooling', 'Waiting', 'PartReplacement']
+
+LOOKBACK_US = 10 * 1_000_000  # 10 seconds in microseconds
+ROLLING_CHANNELS = ['amplitude', 'temp', 'pressure']
+ROLLING_WINDOWS = (50, 200)   # samples, 0.5s and 2s of a stage at 100Hz
+RATE_TOLERANCE = 0.25         # live rate within 25% of the training rate counts as the same
+
+
+def failure_times(df):
+    """sorted timestamps of every PartReplacement row"""
+    return np.sort(df.loc[df['stage'] == 'PartReplacement', 'timestamp'].to_numpy(dtype=np.int64))
+
+
+def label_failures(timestamps, fail_times, lookback_us=LOOKBACK_US):
+    """
+    1 for rows within lookback_us before (or at) a failure, else 0
+    - one searchsorted pass instead of a df.loc mask per failure event
+    - fail_times must be sorted, and can come from other files (see dataset.py)
+    """
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    fail_times = np.asarray(fail_times, dtype=np.int64)
+    labels = np.zeros(len(timestamps), dtype=np.int8)
+    if len(fail_times) == 0:
+        return labels
+    # next failure at or after each row
+    nxt = np.searchsorted(fail_times, timestamps, side='left')
+    has_next = nxt < len(fail_times)
+    gap = fail_times[nxt[has_next]] - timestamps[has_next]
+    labels[has_next] = (gap <= lookback_us).astype(np.int8)
+    return labels
+
+
+def sample_hz(timestamps):
+    """sample rate of time ordered timestamps (us), from the median step so gaps don't skew it, None below 2 rows"""
+    step = np.diff(np.asarray(timestamps, dtype=np.int64))
+    step = step[step > 0]
+    return 1e6 / float(np.median(step)) if len(step) else None
+
+
+def rate_matches(model_hz, hz, tolerance=RATE_TOLERANCE):
+    """True when rows at hz give the rolling features a model trained at model_hz expects"""
+    return abs(hz - model_hz) <= tolerance * model_hz
+
+
+def feature_columns(windows=ROLLING_WINDOWS, channels=ROLLING_CHANNELS):
+    """names of the rolling feature columns, in the order they are added"""
+    return [f"{c}_{stat}_{w}" for w in windows for c in channels for stat in ('mean', 'std', 'slope')]
+
+
+def model_features(windows=ROLLING_WINDOWS, channels=ROLLING_CHANNELS):
+    """full model input column list"""
+    return BASE_FEATURES + feature_columns(windows, channels)
+
+
+def stage_rolling(frame, windows=ROLLING_WINDOWS, channels=ROLLING_CHANNELS):
+    """
+    rolling stats over rows of ONE stage (in time order), returns a DataFrame of feature columns
+    - partial windows at the start are allowed, std/slope are 0 until there are 2 samples
+    - slope is per sample (least squares against the sample index)
+    """
+    import pandas as pd
+    out = {}
+    idx = pd.Series(np.arange(len(frame), dtype=np.float64), index=frame.index)
+    for w in windows:
+        idx_var = idx.rolling(w, min_periods=2).var()
+        for c in channels:
+            r = frame[c].astype(np.float64).rolling(w, min_periods=1)
+            out[f"{c}_mean_{w}"] = r.mean()
+            out[f"{c}_std_{w}"] = r.std().fillna(0.0)
+            out[f"{c}_slope_{w}"] = (r.cov(idx) / idx_var).fillna(0.0)
+    return pd.DataFrame(out, index=frame.index)[feature_columns(windows, channels)]
+
+
+def add_rolling_features(df, windows=ROLLING_WINDOWS, channels=ROLLING_CHANNELS):
+    """add rolling per-stage features to a time sorted frame (in place), returns df"""
+    if not windows:
+        return df
+    import pandas as pd
+    parts = [stage_rolling(g, windows, channels) for _, g in df.groupby('stage', sort=False)]
+    feats = pd.concat(parts).reindex(df.index)
+    for col in feats.columns:
+        df[col] = feats[col]
+    return df
+
+
+class OnlineFeatures:
+    """
+    Incremental version of add_rolling_features for live inference.
+    Keeps the last max(windows)-1 rows per stage, so each batch only computes over tail + new rows
+    and never re-reads the history.
+    """
+    def __init__(self, windows=ROLLING_WINDOWS, channels=ROLLING_CHANNELS):
+        self.windows = tuple(windows)
+        self.channels = list(channels)
+        keep = max(self.windows) - 1 if self.windows else 0
+        self.tails = collections.defaultdict(lambda: collections.deque(maxlen=keep))
+
+    def transform(self, df):
+        """df of new rows in time order -> df with the rolling feature columns added"""
+        df = df.reset_index(drop=True)
+        if not self.windows:
+            return df
+        import pandas as pd
+        parts = []
+        for stage, g in df.groupby('stage', sort=False):
+            tail = self.tails[stage]
+            hist = pd.DataFrame(list(tail), columns=self.channels)
+            frame = pd.concat([hist, g[self.channels]], ignore_index=True)
+            feats = stage_rolling(frame, self.windows, self.channels).iloc[len(hist):]
+            feats.index = g.index
+            parts.append(feats)
+            tail.extend(g[self.channels].itertuples(index=False, name=None))
+        feats = pd.concat(parts).reindex(df.index)
+        return pd.concat([df, feats], axis=1)
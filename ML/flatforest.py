@@ -0,0 +1,183 @@
+"""
+NumPy only export of the trained failure model, for fast startup and low memory inference on the BBB
+
+joblib.load of the sklearn pipeline means importing pandas and sklearn and unpickling 100 tree objects,
+which is slow from the SD card and takes a good part of the BBB's 512MB. ML_trainer.py also writes
+failure_model.npz:
+  - every tree's nodes concatenated into flat arrays (feature, threshold, left, right, leaf probability)
+    with child indices made global, so the whole forest is 5 arrays
+  - the stage one hot encoding as a table from stage code (features.STAGES index) to input column
+  - the numeric input column names, rolling windows, the sample rate they were counted at and model version
+
+FlatForest.predict_proba() walks every tree for a whole batch at once, one vectorized step per tree level,
+and gives the same probabilities as the pipeline (same float32 inputs, same float64 thresholds).
+FlatScorer adds a NumPy port of features.OnlineFeatures so predictive_maintain.py can run on NumPy alone.
+"""
+
+import collections
+import numpy as np
+
+from features import STAGES, ROLLING_CHANNELS, model_features
+
+FORMAT_VERSION = 1
+LEAF = -1
+
+
+def export(model, path, windows=(), version=0, sample_hz=None):
+    """flatten the fitted make_pipeline(ColumnTransformer(OneHotEncoder on stage), RandomForestClassifier)"""
+    ct, forest = model.steps[0][1], model.steps[-1][1]
+    names = model_features(windows)
+    encoder, numeric = None, []
+    for name, trans, cols in ct.transformers_:
+        if name == 'stage':
+            encoder = trans
+        elif name == 'remainder' and trans != 'drop':
+            # 'passthrough', or a one-to-one FunctionTransformer in newer sklearn
+            numeric = [names[i] if isinstance(i, (int, np.integer)) else i for i in cols]
+    categories = list(encoder.categories_[0])
+    # stage code -> one hot column, -1 for stages not seen in training (handle_unknown='ignore' gives all zeros)
+    stage_columns = np.array([categories.index(s) if s in categories else -1 for s in STAGES] + [-1], dtype=np.int32)
+
+    positive = list(forest.classes_).index(1) if 1 in forest.classes_ else None
+    feature, threshold, left, right, leaf_prob, roots = [], [], [], [], [], []
+    offset = 0
+    for est in forest.estimators_:
+        t = est.tree_
+        roots.append(offset)
+        is_leaf = t.children_left == LEAF
+        feature.append(np.where(is_leaf, LEAF, t.feature).astype(np.int32))
+        threshold.append(t.threshold.astype(np.float64))
+        left.append(np.where(is_leaf, LEAF, t.children_left + offset).astype(np.int32))
+        right.append(np.where(is_leaf, LEAF, t.children_right + offset).astype(np.int32))
+        value = t.value[:, 0, :]
+        prob = value / value.sum(axis=1, keepdims=True)  # counts or fractions depending on sklearn version
+        leaf_prob.append(prob[:, positive] if positive is not None else np.zeros(t.node_count))
+        offset += t.node_count
+
+    np.savez(path, format_version=FORMAT_VERSION, feature=np.concatenate(feature), threshold=np.concatenate(threshold),
+             left=np.concatenate(left), right=np.concatenate(right), leaf_prob=np.concatenate(leaf_prob),
+             roots=np.array(roots, dtype=np.int32), max_depth=max(e.tree_.max_depth for e in forest.estimators_),
+             n_categories=len(categories), stage_columns=stage_columns, numeric=np.array(numeric),
+             windows=np.array(windows, dtype=np.int64), version=version, sample_hz=sample_hz or 0.0)
+    return path
+
+
+class FlatForest:
+    """the exported forest, predict_proba(stage_codes, X_numeric) -> P(failure) per row"""
+    def __init__(self, path):
+        with np.load(path) as z:
+            if int(z['format_version']) != FORMAT_VERSION:
+                raise ValueError(f"{path}: unsupported format {int(z['format_version'])}")
+            self.feature = z['feature']
+            self.threshold = z['threshold']
+            self.left = z['left']
+            self.right = z['right']
+            self.leaf_prob = z['leaf_prob']
+            self.roots = z['roots']
+            self.max_depth = int(z['max_depth'])
+            self.n_categories = int(z['n_categories'])
+            self.stage_columns = z['stage_columns']
+            self.numeric = [str(c) for c in z['numeric']]
+            self.windows = tuple(int(w) for w in z['windows'])
+            self.version = int(z['version'])
+            # 0 (or missing, older exports) = unknown
+            self.sample_hz = float(z['sample_hz']) if 'sample_hz' in z.files else 0.0
+
+    def inputs(self, stage_codes, X_numeric):
+        """the pipeline's input matrix: one hot stage columns then the numeric columns, as float32 like sklearn"""
+        n = len(stage_codes)
+        X = np.zeros((n, self.n_categories + X_numeric.shape[1]), dtype=np.float32)
+        cols = self.stage_columns[np.asarray(stage_codes)]
+        known = cols >= 0
+        X[np.flatnonzero(known), cols[known]] = 1.0
+        X[:, self.n_categories:] = X_numeric
+        return X
+
+    def predict_proba(self, stage_codes, X_numeric):
+        X = self.inputs(stage_codes, X_numeric)
+        rows = np.arange(len(X))[:, None]
+        node = np.broadcast_to(self.roots, (len(X), len(self.roots))).copy()
+        for _ in range(self.max_depth):
+            feat = self.feature[node]
+            inner = feat >= 0
+            if not inner.any():
+                break
+            go_left = X[rows, np.where(inner, feat, 0)] <= self.threshold[node]
+            node = np.where(inner, np.where(go_left, self.left[node], self.right[node]), node)
+        return self.leaf_prob[node].mean(axis=1)
+
+
+def rolling_stats(values, start, w):
+    """
+    mean/std/slope of the trailing w values (partial windows allowed) for positions start.. of values,
+    matches features.stage_rolling (pandas rolling with min_periods, std and slope 0 below 2 samples)
+    """
+    x = values - values.mean()  # centred so the running sums stay small
+    k = np.arange(len(x), dtype=np.float64)
+    zero = np.zeros(1)
+    s1, s2 = np.concatenate([zero, np.cumsum(x)]), np.concatenate([zero, np.cumsum(x * x)])
+    sk = np.concatenate([zero, np.cumsum(k * x)])
+    end = np.arange(start, len(x)) + 1
+    begin = np.maximum(end - w, 0)
+    n = (end - begin).astype(np.float64)
+    sx, sxx, skx = s1[end] - s1[begin], s2[end] - s2[begin], sk[end] - sk[begin]
+    kbar = (begin + end - 1) / 2.0
+    mean = sx / n
+    with np.errstate(invalid='ignore', divide='ignore'):
+        var = np.maximum(sxx - n * mean * mean, 0.0) / (n - 1)
+        kvar = n * (n * n - 1) / 12.0  # sum of (k - kbar)^2 over n consecutive ints
+        slope = (skx - kbar * sx) / kvar
+    two = n >= 2
+    return mean + values.mean(), np.where(two, np.sqrt(var), 0.0), np.where(two, slope, 0.0)
+
+
+class FlatScorer:
+    """
+    failure probability for rows [timestamp, temp, pressure, amplitude, frequency, stage, label]
+    without pandas or sklearn, same interface as predictive_maintain.SklearnScorer
+    """
+    def __init__(self, path='failure_model.npz'):
+        self.forest = FlatForest(path)
+        self.windows = self.forest.windows
+        self.version = self.forest.version
+        self.sample_hz = self.forest.sample_hz or None
+        keep = max(self.windows) - 1 if self.windows else 0
+        self.tails = collections.defaultdict(lambda: collections.deque(maxlen=keep))
+        self.col = {c: i for i, c in enumerate(['temp', 'pressure', 'amplitude', 'frequency'])}
+
+    def reset(self):
+        """forget the rolling feature history, the next rows don't continue the previous ones"""
+        self.tails.clear()
+
+    def features(self, rows):
+        """stage codes and the numeric input matrix (columns in the exported order)"""
+        base = np.array([r[1:5] for r in rows], dtype=np.float64).reshape(len(rows), 4)
+        stages = [r[5] for r in rows]
+        codes = np.array([STAGES.index(s) if s in STAGES else len(STAGES) for s in stages])
+        cols = {c: base[:, i] for c, i in self.col.items()}
+        if self.windows:
+            for stage in dict.fromkeys(stages):
+                idx = np.flatnonzero(np.array(stages) == stage)
+                tail = self.tails[stage]
+                new = base[idx][:, [self.col[c] for c in ROLLING_CHANNELS]]
+                hist = np.array(tail, dtype=np.float64).reshape(len(tail), len(ROLLING_CHANNELS))
+                frame = np.vstack([hist, new])
+                for w in self.windows:
+                    for j, c in enumerate(ROLLING_CHANNELS):
+                        mean, std, slope = rolling_stats(frame[:, j], len(hist), w)
+                        for stat, v in (('mean', mean), ('std', std), ('slope', slope)):
+                            cols.setdefault(f"{c}_{stat}_{w}", np.zeros(len(rows)))[idx] = v
+                tail.extend(map(tuple, new))
+        X = np.column_stack([cols[c] for c in self.forest.numeric])
+        return codes, X
+
+    def prepare(self, rows):
+        """(codes, X) for predict, the scoring cost that isn't the forest itself"""
+        return self.features(rows)
+
+    def predict(self, prepared):
+        codes, X = prepared
+        return self.forest.predict_proba(codes, X)
+
+    def score(self, rows):
+        return self.predict(self.prepare(rows))
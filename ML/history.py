@@ -0,0 +1,152 @@
+"""
+Fixed size prediction history for predictive_maintain.py
+
+predict_result.txt used to grow by a line a second forever. The history is a ring file instead,
+with the same disk footprint however long it runs:
+  32 byte header   b'PHR1', version (u2), record size (u2), capacity (u4), 4 reserved, records written (u8),
+                   8 reserved
+  capacity records (timestamp f8 unix seconds, probability f4, model version u4, stage code u1)
+
+- append and latest are O(1) (one pwrite/pread), last(k) reads only the k records it returns
+- records are in time order around the ring, so a time range is two binary searches
+
+Usage:
+  python3 history.py --last 20
+  python3 history.py --since 2025-04-29T10:00 --until 2025-04-29T11:00 --csv > window.csv
+"""
+
+import argparse
+import os
+import struct
+import time
+from datetime import datetime
+
+import numpy as np
+
+from features import STAGES
+
+MAGIC = b'PHR1'
+VERSION = 1
+HEADER = struct.Struct('<4sHHI4xQ8x')
+RECORD_DTYPE = np.dtype([('timestamp', '<f8'), ('probability', '<f4'), ('model_version', '<u4'), ('stage', 'u1')])
+COUNT_OFFSET = 16
+COUNT = struct.Struct('<Q')
+DEFAULT_CAPACITY = 7 * 24 * 3600  # a week at one prediction a second, about 10MB
+NO_STAGE = 255
+
+
+class PredictionHistory:
+    """ring file of predictions, one writer (predictive_maintain.py) and any number of readers"""
+    def __init__(self, path='predict_history.bin', capacity=DEFAULT_CAPACITY, readonly=False):
+        self.path = path
+        if not os.path.exists(path):
+            if readonly:
+                raise FileNotFoundError(path)
+            self.create(path, capacity)
+        self.fd = os.open(path, os.O_RDONLY if readonly else os.O_RDWR)
+        magic, version, rec_size, self.capacity, _ = HEADER.unpack(os.pread(self.fd, HEADER.size, 0))
+        if magic != MAGIC or version != VERSION or rec_size != RECORD_DTYPE.itemsize:
+            raise ValueError(f"{path} is not a version {VERSION} prediction history")
+
+    @staticmethod
+    def create(path, capacity):
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, VERSION, RECORD_DTYPE.itemsize, capacity, 0))
+            f.truncate(HEADER.size + capacity * RECORD_DTYPE.itemsize)  # sparse until written
+        os.replace(tmp, path)
+
+    def count(self):
+        """records ever written (the ring holds the last `capacity` of them)"""
+        return COUNT.unpack(os.pread(self.fd, COUNT.size, COUNT_OFFSET))[0]
+
+    def append(self, probability, stage=None, model_version=0, timestamp=None):
+        rec = np.zeros(1, dtype=RECORD_DTYPE)
+        rec['timestamp'] = time.time() if timestamp is None else timestamp
+        rec['probability'] = probability
+        rec['model_version'] = model_version
+        rec['stage'] = STAGES.index(stage) if stage in STAGES else NO_STAGE
+        n = self.count()
+        os.pwrite(self.fd, rec.tobytes(), HEADER.size + (n % self.capacity) * RECORD_DTYPE.itemsize)
+        # count goes last, a reader never sees a slot that is half written
+        os.pwrite(self.fd, COUNT.pack(n + 1), COUNT_OFFSET)
+
+    def latest(self):
+        """newest record as a dict, None if empty"""
+        n = self.count()
+        if n == 0:
+            return None
+        return to_dicts(self._read((n - 1) % self.capacity, 1))[0]
+
+    def _read(self, slot, k):
+        """k records from slot on (not past the end of the ring) with one pread"""
+        size = RECORD_DTYPE.itemsize
+        return np.frombuffer(os.pread(self.fd, k * size, HEADER.size + slot * size), dtype=RECORD_DTYPE)
+
+    def _segments(self):
+        """the ring as at most two time ordered arrays, oldest first"""
+        n = self.count()
+        ring = np.memmap(self.path, dtype=RECORD_DTYPE, mode='r', offset=HEADER.size, shape=(self.capacity,))
+        if n <= self.capacity:
+            return [ring[:n]]
+        head = n % self.capacity
+        return [ring[head:], ring[:head]]
+
+    def last(self, k):
+        """the newest k records, oldest first, read straight from their slots (two preads when they wrap)"""
+        n = self.count()
+        k = min(k, n, self.capacity)
+        first = (n - k) % self.capacity
+        if first + k <= self.capacity:
+            return self._read(first, k).copy()
+        return np.concatenate([self._read(first, self.capacity - first), self._read(0, first + k - self.capacity)])
+
+    def range(self, start=None, end=None):
+        """records with start <= timestamp < end (unix seconds, None = open ended), oldest first"""
+        parts = []
+        for seg in self._segments():
+            ts = seg['timestamp']
+            lo = 0 if start is None else np.searchsorted(ts, start, side='left')
+            hi = len(seg) if end is None else np.searchsorted(ts, end, side='left')
+            parts.append(np.array(seg[lo:hi]))
+        return np.concatenate(parts) if parts else np.zeros(0, dtype=RECORD_DTYPE)
+
+    def close(self):
+        os.close(self.fd)
+
+
+def to_dicts(recs):
+    return [{'timestamp': float(r['timestamp']), 'probability': float(r['probability']),
+             'model_version': int(r['model_version']),
+             'stage': STAGES[r['stage']] if r['stage'] < len(STAGES) else None} for r in recs]
+
+
+def parse_time(value):
+    """unix seconds or an ISO date/time"""
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Query the prediction history")
+    parser.add_argument('--file', default='predict_history.bin')
+    parser.add_argument('--last', type=int, help="newest N predictions")
+    parser.add_argument('--since', type=parse_time, help="unix time or ISO time")
+    parser.add_argument('--until', type=parse_time, help="unix time or ISO time")
+    parser.add_argument('--csv', action='store_true', help="timestamp,probability,stage,model_version rows")
+    args = parser.parse_args()
+
+    hist = PredictionHistory(args.file, readonly=True)
+    recs = hist.last(args.last) if args.last else hist.range(args.since, args.until)
+    if args.csv:
+        print("timestamp,probability,stage,model_version")
+    for r in to_dicts(recs):
+        if args.csv:
+            print(f"{r['timestamp']:.3f},{r['probability']:.4f},{r['stage'] or ''},{r['model_version']}")
+        else:
+            when = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(r['timestamp']))
+            print(f"{when}  p={r['probability']:.2f}  {r['stage'] or '-':16s} model {r['model_version']}")
+    if not args.csv:
+        print(f"{len(recs)} of {min(hist.count(), hist.capacity)} predictions kept ({hist.count()} written)")
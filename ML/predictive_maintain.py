@@ -1,30 +1,168 @@
-import pandas as pd
-import joblib
-import smtplib
-from email.mime.text import MIMEText
+import argparse
+import collections
+import glob
+import os
+import statistics
+import sys
 import time
 
-model = joblib.load('failure_model.joblib')
+import alerts
+import features
+import history
+import scoring
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'beaglebone'))
+import metrics
+import status
 
 EMAIL_FROM = "injection_mouldingmachine@company2.com"
-EMAIL_PASSWORD = ""  
+EMAIL_PASSWORD = os.getenv('SMTP_PASSWORD', "")        # or fill in
 EMAIL_TO = "machineoperator@company.com"
-SMTP_SERVER = "smtp.gmail.com"
-SMTP_PORT = 587
+SMTP_SERVER = os.getenv('SMTP_SERVER', "smtp.gmail.com")
+SMTP_PORT = int(os.getenv('SMTP_PORT', 587))
+SMTP_STARTTLS = os.getenv('SMTP_STARTTLS', '1') != '0'  # 0 for a local test server (bench/pipeline.py)
+ALERT_COOLDOWN = float(os.getenv('ALERT_COOLDOWN', alerts.COOLDOWN))
+SCORING_FILE = 'scoring.conf'  # alarm method and rise/fall thresholds (scoring.py)
+ALERT_STATE_FILE = 'alert_state.json'  # per condition cooldowns, kept across restarts
+
+MODEL_FILE = 'failure_model.joblib'
+FLAT_MODEL_FILE = 'failure_model.npz'  # flatforest.py export, used when present
+
+# streaming mode settings
+COLUMNS = features.COLUMNS
+BATCH_MAX = 200        # max rows scored in one predict_proba call
+POLL_INTERVAL = 0.05   # seconds to wait when the csv has no new rows
+RATE_WINDOW = 64       # row intervals a source's live sample rate is measured over
+SOURCE_IDLE = 2.0      # seconds without new train/ rows before scoring logs/ instead
+
+RESULT_FILE = 'predict_result.txt'     # latest prediction only, the logger shows its first line
+HISTORY_FILE = 'predict_history.bin'   # fixed size ring of predictions, one a second (history.py)
+RECORD_INTERVAL = 1.0                  # seconds between history records and result file rewrites
+METRICS_FILE = 'predict_metrics.prom'  # Prometheus text file, rewritten every 10s (metrics.py)
+
+# one histogram per stage of a batch, so it shows where the time goes
+STAGE_SECONDS = {s: metrics.histogram('predict_stage_seconds', "seconds per batch spent in each stage", stage=s)
+                 for s in ('read', 'parse', 'features', 'predict', 'monitor', 'record', 'alert')}
+ROWS_SCORED = metrics.counter('predict_rows_total', "rows scored")
+BATCHES = metrics.counter('predict_batches_total', "scoring calls")
+LAG = metrics.gauge('predict_lag_seconds', "now minus the newest scored sample's timestamp, grows when scoring falls behind")
+RISK = metrics.gauge('predict_risk', "aggregated risk from scoring.py")
+ALARM = metrics.gauge('predict_alarm_active', "1 while the alarm is on")
+SMTP_SECONDS = metrics.histogram('alert_send_seconds', "seconds per SMTP send attempt")
+SMTP_ERRORS = metrics.counter('alert_send_errors_total', "failed SMTP send attempts")
+
+class SklearnScorer:
+    """the joblib pipeline, needs pandas and sklearn (FlatScorer in flatforest.py is the NumPy only one)"""
+    def __init__(self, path=MODEL_FILE):
+        import joblib
+        import pandas as pd
+        self.pd = pd
+        self.model = joblib.load(path)
+        # models trained before rolling features existed only use the raw columns
+        self.windows = getattr(self.model, 'rolling_windows', ())
+        self.online = features.OnlineFeatures(self.windows)
+        self.features = features.model_features(self.windows)
+        self.sample_hz = getattr(self.model, 'sample_hz', None)
+        # trainer stamps the model with its training time, older models fall back to the file time
+        self.version = getattr(self.model, 'trained_at', None) or int(os.path.getmtime(path))
+
+    def reset(self):
+        """forget the rolling feature history, the next rows don't continue the previous ones"""
+        self.online = features.OnlineFeatures(self.windows)
+
+    def prepare(self, rows):
+        """rows of COLUMNS -> the model's feature frame"""
+        return self.online.transform(self.pd.DataFrame(rows, columns=COLUMNS))[self.features]
+
+    def predict(self, X):
+        return self.model.predict_proba(X)[:, 1]
+
+    def score(self, rows):
+        """rows of COLUMNS -> failure probability per row"""
+        return self.predict(self.prepare(rows))
+
+
+def load_scorer(use_sklearn=False):
+    if not use_sklearn and os.path.exists(FLAT_MODEL_FILE):
+        import flatforest
+        print(f"Using {FLAT_MODEL_FILE} (NumPy only)")
+        return flatforest.FlatScorer(FLAT_MODEL_FILE)
+    print(f"Using {MODEL_FILE}")
+    return SklearnScorer(MODEL_FILE)
+
+scorer = None
 
-def send_email_alert(probability):
-    msg = MIMEText("Machine warning: Predicted failure risk = {probability:.2f}")
-    msg['Subject'] = "Predictive Maintenance Alert!"
-    msg['From'] = EMAIL_FROM
-    msg['To'] = EMAIL_TO
 
-    with smtplib.SMTP(SMTP_SERVER, SMTP_PORT) as server:
-        server.starttls()
-        server.login(EMAIL_FROM, EMAIL_PASSWORD)
-        server.sendmail(EMAIL_FROM, EMAIL_TO, msg.as_string())
-    print(" Alert email sent!")
+def score_rows(rows):
+    """scorer.score with the feature build (the DataFrame for sklearn) and the forest timed separately"""
+    with STAGE_SECONDS['features'].time():
+        X = scorer.prepare(rows)
+    with STAGE_SECONDS['predict'].time():
+        probs = scorer.predict(X)
+    ROWS_SCORED.inc(len(rows))
+    BATCHES.inc()
+    return probs
+
+
+class TimedSmtpSender(alerts.SmtpSender):
+    """SmtpSender with each attempt's time and failures in the metrics"""
+    def send(self, subject, body):
+        with SMTP_SECONDS.time():
+            try:
+                super().send(subject, body)
+            except Exception:
+                SMTP_ERRORS.inc()
+                raise
+
+
+dispatcher = None
+
+def send_email_alert(probability, ts_us=None):
+    """queue the alert for the background sender (alerts.py), returns straight away"""
+    global dispatcher
+    if dispatcher is None:
+        sender = TimedSmtpSender(SMTP_SERVER, SMTP_PORT, EMAIL_FROM, EMAIL_TO, EMAIL_PASSWORD,
+                                   starttls=SMTP_STARTTLS)
+        dispatcher = alerts.AlertDispatcher(sender, state_path=ALERT_STATE_FILE, cooldown=ALERT_COOLDOWN)
+    body = f"Machine warning: Predicted failure risk = {probability:.2f}"
+    if ts_us is not None:
+        body += f" (sample at {format_sample_time(ts_us)})"
+    return dispatcher.raise_alert('failure_risk', "Predictive Maintenance Alert!", body)
+
+
+@metrics.on_collect
+def alert_metrics():
+    if dispatcher is None:
+        return
+    with dispatcher.lock:
+        counts = dict(dispatcher.counts)
+    for outcome, n in counts.items():
+        metrics.counter('alerts_total', "alerts by outcome (alerts.py counts)", outcome=outcome).value = n
+    metrics.gauge('alert_queue_depth', "alerts waiting for the sender thread").set(dispatcher.queue.qsize())
+
+
+def format_sample_time(ts_us):
+    """local time with milliseconds, e.g. 2025-04-29 10:00:55.120"""
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(ts_us // 1_000_000)) + f".{ts_us % 1_000_000 // 1000:03d}"
+
+status_reader = None
 
 def get_live_data():
+    """latest row from the logger's status record, or from live_data with loggers that don't write one"""
+    global status_reader
+    status_reader = status_reader or status.open_status()
+    if status_reader:
+        rec = status_reader.read()
+        if rec is not None:
+            return {
+                'timestamp': rec['ts_us'],
+                'temp': rec['melt_temp'],
+                'pressure': rec['inj_press'],
+                'amplitude': rec['vib_amp'],
+                'frequency': rec['vib_freq'],
+                'stage': rec['stage'],
+                'failure_label': rec['failure_label']
+            }
     try:
         with open('live_data', 'r') as file: # open the continously updated data file
             lines = file.readlines()
@@ -48,25 +186,273 @@ def get_live_data():
         return None
 
 
-email_last_5 = 0
+prediction_history = None
+monitor = None  # scoring.RiskMonitor, set in __main__
+worst = None    # (probability, stage) of the highest prediction not recorded yet
+last_record = 0.0
+
+def handle_prediction(prob_failure, stage=None, ts_us=None, onset=None):
+    """
+    log the prediction and raise an alert when the alarm turns on (max 1 email per 5 min, see alerts.py)
+    - onset is (probability, ts_us) of the sample that turned the alarm on in this batch, the alert
+      reports that sample. An alarm that turned on and off within the batch still alerts
+    - while the alarm stays on the alert is raised again with the newest sample (ts_us), the cooldown
+      turns that into a reminder every ALERT_COOLDOWN
+    - --stream calls this up to 20 times a second, the history and result file get the highest
+      prediction once per RECORD_INTERVAL, so the SD card sees the same writes in both modes and the
+      history ring still holds a week
+    """
+    global prediction_history, worst, last_record
 
-while True:
-    data = get_live_data()
-    df = pd.DataFrame([data])
-    prob_failure = model.predict_proba(df)[0][1] 
-    print(f"Prediction: Failure probability = {prob_failure:.2f}")
+    with STAGE_SECONDS['record'].time():
+        if worst is None or prob_failure > worst[0]:
+            worst = (prob_failure, stage)
+        now = time.monotonic()
+        if now - last_record >= RECORD_INTERVAL:
+            prob, worst_stage = worst
+            prediction_history = prediction_history or history.PredictionHistory(HISTORY_FILE)
+            prediction_history.append(prob, worst_stage, scorer.version)
 
-    # write to file the current timestamp and the current prob
-    with open('predict_result.txt', 'a') as f:
-        timestamp = time.strftime('%Y-%m-%d %H:%M:%S')
-        f.write(f"{timestamp}, - Current failure probability: {prob_failure:.2f}\n")
+            # replace the file with the current timestamp and the current prob, renamed into place
+            # so the logger's fgets always gets a whole line, and it is the newest one
+            timestamp = time.strftime('%Y-%m-%d %H:%M:%S')
+            with open(RESULT_FILE + '.tmp', 'w') as f:
+                f.write(f"{timestamp}, - Current failure probability: {prob:.2f}\n")
+            os.replace(RESULT_FILE + '.tmp', RESULT_FILE)
+            worst, last_record = None, now
 
+    RISK.set(monitor.value)
+    ALARM.set(int(monitor.active))
+    if ts_us is not None:
+        LAG.set(time.time() - ts_us / 1e6)
+    if onset is not None:
+        with STAGE_SECONDS['alert'].time():
+            queued = send_email_alert(*onset)
+        print(f"Alarm on at sample {format_sample_time(onset[1])}"
+              f"{'' if queued else ', alert held back by the cooldown'}")
+    elif monitor.active:
+        with STAGE_SECONDS['alert'].time():
+            send_email_alert(prob_failure, ts_us)
 
-    if prob_failure > 0.50:
-        current_time = time.time()
-        if current_time - email_last_5 >= 5*60:  # max 1 email per 5 min
-            send_email_alert(prob_failure)
-            email_last_5 = current_time
-        print("Waiting for cooldown before sending next alert...")
+def rate_ok(hz, model=None):
+    """
+    True when rows arriving at hz give the rolling features the model (default the loaded scorer) was trained on
+    - the windows count samples, so 200 samples of 4Hz logs/ rows would be 50s instead of 2s
+    - models without rolling features, or without a recorded rate (older models), score anything
+    """
+    model = model or scorer
+    if not model.windows or not model.sample_hz:
+        return True
+    return hz is not None and features.rate_matches(model.sample_hz, hz)
 
-    time.sleep(1) 
\ No newline at end of file
+
+def run_polling():
+    """original mode: score the latest row (status record, or live_data) once a second"""
+    if not rate_ok(1.0):
+        raise SystemExit(f"The model's rolling windows {scorer.windows} count samples at {scorer.sample_hz:g}Hz, "
+                         f"polling scores one row a second. Run with --stream, or train with --windows ''")
+    while True:
+        with STAGE_SECONDS['read'].time():
+            data = get_live_data()
+        if data is None:
+            time.sleep(1)
+            continue
+        row = [data['timestamp'], data['temp'], data['pressure'], data['amplitude'], data['frequency'],
+               data['stage'], data['failure_label']]
+        prob_failure = float(score_rows([row])[0])
+        with STAGE_SECONDS['monitor'].time():
+            event = monitor.update(prob_failure, data['stage'], data['timestamp'])
+        print(f"Prediction: Failure probability = {prob_failure:.2f} (risk {monitor.value:.2f})")
+        handle_prediction(prob_failure, data['stage'], data['timestamp'],
+                          (prob_failure, data['timestamp']) if event == 'on' else None)
+        time.sleep(1)
+
+
+class CsvTail:
+    """
+    Follows the newest csv in a logger dir (train/ or logs/) as it grows.
+    - only complete lines are returned, a half written row stays buffered until its newline arrives
+    - when the logger rotates to a newer file the old one is drained first, then we switch
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        self.path = None
+        self.fp = None
+        self.partial = ''
+
+    def newest_file(self):
+        files = glob.glob(os.path.join(self.directory, '*.csv'))
+        return max(files, key=os.path.getmtime) if files else None
+
+    def open(self, path, from_end):
+        if self.fp:
+            self.fp.close()
+        self.path = path
+        self.fp = open(path, 'r')
+        self.partial = ''
+        if from_end:
+            self.fp.seek(0, os.SEEK_END) # don't score the backlog on startup
+
+    def skip_to_end(self):
+        """drop everything written so far, for a tail left unread while the other source was scored"""
+        newest = self.newest_file()
+        if newest is not None:
+            self.open(newest, from_end=True)
+
+    def read_lines(self, max_lines):
+        newest = self.newest_file()
+        if newest is None:
+            return []
+        if self.fp is None:
+            self.open(newest, from_end=True)
+
+        lines = self.drain(max_lines)
+        if not lines and newest != self.path:
+            # current file is drained and the logger rotated, start the new one from the top
+            self.open(newest, from_end=False)
+            lines = self.drain(max_lines)
+        return lines
+
+    def drain(self, max_lines):
+        lines = []
+        while len(lines) < max_lines:
+            line = self.fp.readline()
+            if not line:
+                break
+            if not line.endswith('\n'):
+                self.partial += line # row still being written
+                break
+            lines.append(self.partial + line)
+            self.partial = ''
+        return lines
+
+
+class RateMeter:
+    """live sample rate of one source, the median of its last RATE_WINDOW row intervals"""
+    def __init__(self):
+        self.steps = collections.deque(maxlen=RATE_WINDOW)
+        self.last = None
+
+    def update(self, timestamps):
+        for ts in timestamps:
+            if self.last is not None and ts > self.last:
+                self.steps.append(ts - self.last)
+            self.last = ts
+
+    @property
+    def hz(self):
+        return 1e6 / statistics.median(self.steps) if self.steps else None
+
+
+def parse_rows(lines):
+    """csv lines -> list of rows, bad rows are dropped"""
+    rows = []
+    for line in lines:
+        values = line.strip().split(',')
+        if len(values) != len(COLUMNS):
+            continue
+        try:
+            rows.append([int(values[0]), float(values[1]), float(values[2]),
+                         float(values[3]), float(values[4]), values[5], int(values[6])])
+        except ValueError:
+            continue
+    return rows
+
+
+def run_streaming():
+    """
+    Score every sample the logger writes instead of one per second.
+    - tails train/ while HF capture is on (full hiRateHz rows), otherwise logs/ (LF rows). logs/ takes over
+      once train/ has been quiet for SOURCE_IDLE, from its end (rows written while train/ was scored are
+      stale), and the rolling features start over on every switch so the two rates never mix
+    - rows are scored in micro batches with one vectorized predict_proba call
+    - rolling features come from features.OnlineFeatures, the same code the trainer uses
+      (or its NumPy port in flatforest.py)
+    - every sample's probability goes through the RiskMonitor, which decides when to alert
+    - rows from a source that doesn't come at the model's training rate are not scored (see rate_ok)
+    """
+    tails = {d: CsvTail(d) for d in ('train', 'logs')}
+    meters = {d: RateMeter() for d in tails}
+    skipping = set()
+    active = 'train'
+    train_seen = time.monotonic()
+
+    while True:
+        # train/ has the full rate data, only fall back to logs/ when capture has stopped
+        with STAGE_SECONDS['read'].time():
+            source = 'train'
+            lines = tails['train'].read_lines(BATCH_MAX)
+            if lines:
+                train_seen = time.monotonic()
+            elif time.monotonic() - train_seen >= SOURCE_IDLE:
+                source = 'logs'
+            if source != active:
+                print(f"Scoring {source}/ rows")
+                active = source
+                scorer.reset()
+                meters[source] = RateMeter()
+                skipping.discard(source)
+                if source == 'logs':
+                    tails['logs'].skip_to_end()
+            if source == 'logs':
+                lines = tails['logs'].read_lines(BATCH_MAX)
+        if not lines:
+            time.sleep(POLL_INTERVAL)
+            continue
+        with STAGE_SECONDS['parse'].time():
+            rows = parse_rows(lines)
+        if not rows:
+            continue
+        meter = meters[source]
+        meter.update(r[0] for r in rows)
+        if not rate_ok(meter.hz):
+            if meter.hz is not None and source not in skipping:
+                print(f"{source}/ rows at {meter.hz:.1f}Hz, the model's rolling windows count samples at "
+                      f"{scorer.sample_hz:g}Hz, not scoring them")
+                skipping.add(source)
+            continue
+        skipping.discard(source)
+
+        probs = score_rows(rows)
+
+        with STAGE_SECONDS['monitor'].time():
+            onset = None
+            for row, p in zip(rows, probs):
+                if monitor.update(p, row[5], row[0]) == 'on' and onset is None:
+                    onset = (float(p), row[0])
+
+        # log the worst sample of the batch so a short spike isn't missed
+        prob_failure = float(probs.max())
+        stage = rows[-1][5]
+        print(f"Prediction: {len(rows)} rows, max failure probability = {prob_failure:.2f}, risk {monitor.value:.2f} "
+              f"(stage={stage})")
+        handle_prediction(prob_failure, stage, rows[-1][0], onset)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Predictive maintenance model and notifier")
+    parser.add_argument('--stream', action='store_true',
+                        help="tail the logger csv files and score every row instead of polling the latest row")
+    parser.add_argument('--sklearn', action='store_true',
+                        help=f"use {MODEL_FILE} even when {FLAT_MODEL_FILE} is present")
+    parser.add_argument('--scoring', default=SCORING_FILE, help="alarm config (scoring.py), defaults if missing")
+    parser.add_argument('--metrics-file', default=METRICS_FILE, help="Prometheus text file, '' for none")
+    parser.add_argument('--metrics-port', type=int, help="also serve /metrics and /profile on localhost:PORT")
+    args = parser.parse_args()
+
+    scorer = load_scorer(args.sklearn)
+    if scorer.windows and not scorer.sample_hz:
+        print(f"Model has no recorded sample rate, its rolling windows {scorer.windows} assume the rows "
+              f"come at the training rate. Retrain to have it checked")
+    monitor = scoring.RiskMonitor(scoring.load_config(args.scoring))
+    print(f"Alarm: {monitor.config['method']}, on at {monitor.rise}, off below {monitor.fall}")
+    exporter = metrics.start('predictive_maintain', args.metrics_file, args.metrics_port)
+    try:
+        if args.stream:
+            run_streaming()
+        else:
+            run_polling()
+    finally:
+        if dispatcher:
+            dispatcher.close()
+        exporter.close()
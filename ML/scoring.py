@@ -0,0 +1,294 @@
+"""
+Alarm stage between the model's per-sample probabilities and the alerts
+
+A single `prob > 0.5` sample is too noisy (vibration noise gives one-off spikes) and, at one sample
+a second, can miss a short pre-failure window completely. RiskMonitor takes every scored sample and
+aggregates them into a risk value, then applies hysteresis: the alarm turns on when the value reaches
+`rise` and only turns off once it drops below `fall`.
+
+Aggregators (`method` in scoring.conf), all O(1) per sample:
+  sample      the raw probability, the old behaviour
+  ewma        exponentially weighted mean with time constant ewma_tau seconds (uses the sample
+              timestamps, so it means the same at any sample rate)
+  kofn        fraction of the last kofn_n samples over kofn_threshold, e.g. rise 0.25 with n 20 is 5-of-20
+  cycle_max   max probability over the current machine cycle (from one cycle_start stage to the next)
+              and the previous one, so a short spike holds for a full cycle
+Samples in ignore_stages (PartReplacement: the failure has already happened) are skipped.
+
+scoring.conf is `key = value` lines, # comments, missing keys keep their defaults. rise and fall
+are on the method's own scale and depend on the model, so re-check them with --replay after retraining.
+
+Usage (evaluate configs against labelled captures, the old single sample > 0.5 rule is the first row):
+  python3 scoring.py --replay train/
+  python3 scoring.py --replay training_data.csv --config scoring.conf --config kofn.conf --horizon 30
+  python3 scoring.py --replay train/ --set method=cycle_max --set rise=0.6 --set fall=0.5
+"""
+
+import argparse
+import collections
+import math
+import os
+
+import numpy as np
+
+from features import LOOKBACK_US
+
+CONFIG_FILE = 'scoring.conf'
+METHODS = ('sample', 'ewma', 'kofn', 'cycle_max')
+DEFAULTS = {
+    'method': 'ewma',
+    'rise': 0.15,
+    'fall': 0.1,
+    'ewma_tau': 1.0,
+    'kofn_n': 200,
+    'kofn_threshold': 0.2,
+    'cycle_start': 'PreInjection',
+    'ignore_stages': 'PartReplacement',
+}
+
+
+def set_option(config, line, where):
+    """apply one `key = value` line to config"""
+    key, sep, value = (part.strip() for part in line.partition('='))
+    if not sep or key not in DEFAULTS:
+        raise ValueError(f"{where}: expected one of {', '.join(DEFAULTS)} = value")
+    config[key] = type(DEFAULTS[key])(value)
+
+
+def load_config(path=CONFIG_FILE, overrides=()):
+    """DEFAULTS updated from the file (values converted to the default's type) then overrides"""
+    config = dict(DEFAULTS)
+    if os.path.exists(path):
+        with open(path) as f:
+            for n, line in enumerate(f, 1):
+                line = line.split('#', 1)[0].strip()
+                if line:
+                    set_option(config, line, f"{path}:{n}")
+    for line in overrides:
+        set_option(config, line, line)
+    if config['method'] not in METHODS:
+        raise ValueError(f"{path}: method must be one of {', '.join(METHODS)}")
+    if config['fall'] > config['rise']:
+        raise ValueError(f"{path}: fall must not be above rise")
+    return config
+
+
+class Ewma:
+    """exponentially weighted mean, decay by elapsed time so gaps and rate changes are handled"""
+    def __init__(self, tau):
+        self.tau_us = tau * 1e6
+        self.value = 0.0
+        self.last_ts = None
+
+    def update(self, p, stage, ts_us):
+        # starts from 0, so one high sample at startup doesn't count as a full time constant of them
+        dt = ts_us - self.last_ts if self.last_ts is not None else 0
+        alpha = 1.0 - math.exp(-max(dt, 0) / self.tau_us) if self.tau_us > 0 else 1.0
+        self.value += alpha * (p - self.value)
+        self.last_ts = ts_us
+        return self.value
+
+
+class KofN:
+    """fraction of the last n samples over threshold, a running count over a ring"""
+    def __init__(self, n, threshold):
+        self.ring = collections.deque(maxlen=n)
+        self.threshold = threshold
+        self.over = 0
+
+    def update(self, p, stage, ts_us):
+        if len(self.ring) == self.ring.maxlen:
+            self.over -= self.ring[0]
+        hit = int(p > self.threshold)
+        self.ring.append(hit)
+        self.over += hit
+        return self.over / self.ring.maxlen
+
+
+class CycleMax:
+    """max over the current cycle and the one before it"""
+    def __init__(self, cycle_start):
+        self.cycle_start = cycle_start
+        self.current = 0.0
+        self.previous = 0.0
+        self.last_stage = None
+
+    def update(self, p, stage, ts_us):
+        if stage == self.cycle_start and self.last_stage != self.cycle_start:
+            self.previous, self.current = self.current, 0.0
+        self.last_stage = stage
+        self.current = max(self.current, p)
+        return max(self.current, self.previous)
+
+
+class Sample:
+    def update(self, p, stage, ts_us):
+        return p
+
+
+def make_aggregator(config):
+    method = config['method']
+    if method == 'ewma':
+        return Ewma(config['ewma_tau'])
+    if method == 'kofn':
+        return KofN(config['kofn_n'], config['kofn_threshold'])
+    if method == 'cycle_max':
+        return CycleMax(config['cycle_start'])
+    return Sample()
+
+
+class RiskMonitor:
+    """
+    update(p, stage, ts_us) per scored sample -> 'on' / 'off' when the alarm changes, else None
+    - value is the aggregated risk, active the alarm state
+    """
+    def __init__(self, config=None):
+        self.config = dict(DEFAULTS) if config is None else config
+        self.aggregator = make_aggregator(self.config)
+        self.rise = self.config['rise']
+        self.fall = self.config['fall']
+        self.ignore = {s.strip() for s in self.config['ignore_stages'].split(',') if s.strip()}
+        self.value = 0.0
+        self.active = False
+
+    def update(self, p, stage, ts_us):
+        if stage in self.ignore:
+            return None
+        self.value = self.aggregator.update(float(p), stage, ts_us)
+        if not self.active and self.value >= self.rise:
+            self.active = True
+            return 'on'
+        if self.active and self.value < self.fall:
+            self.active = False
+            return 'off'
+        return None
+
+    def update_batch(self, probs, stages, timestamps):
+        """every sample of a scored batch in order, returns [(ts_us, 'on'/'off')]"""
+        events = []
+        for p, stage, ts in zip(probs, stages, timestamps):
+            event = self.update(p, stage, ts)
+            if event:
+                events.append((ts, event))
+        return events
+
+
+def alarm_intervals(events):
+    """[(on, off)] from a monitor's (ts_us, 'on'/'off') events, an alarm still on at the end never goes off"""
+    intervals, on = [], None
+    for t, event in events:
+        if event == 'on' and on is None:
+            on = t
+        elif event == 'off' and on is not None:
+            intervals.append((on, t))
+            on = None
+    if on is not None:
+        intervals.append((on, np.iinfo(np.int64).max))
+    return np.asarray(intervals, dtype=np.int64).reshape(-1, 2)
+
+
+def evaluate(events, failures, horizon_us, duration_us):
+    """
+    a monitor's alarm events against failure times (both unix us, sorted)
+    - an alarm is a true alert if a failure follows its onset within horizon_us, or happens while it is on
+    - a failure is caught if an alarm went on within horizon_us before it or was still on at it,
+      lead time is from the earliest such onset
+    """
+    alarms = alarm_intervals(events)
+    on, off = alarms[:, 0], alarms[:, 1]
+    failures = np.asarray(failures, dtype=np.int64)
+    # first failure after each onset: within the horizon, or before the alarm went off
+    nxt = np.searchsorted(failures, on, side='right')
+    has_next = nxt < len(failures)
+    first = failures[nxt[has_next]]
+    true_alerts = int(np.sum((first - on[has_next] <= horizon_us) | (first < off[has_next])))
+    leads = []
+    for f in failures:
+        hit = on[(on < f) & ((on >= f - horizon_us) | (off > f))]
+        if len(hit):
+            leads.append((f - hit[0]) / 1e6)
+    hours = duration_us / 3.6e9
+    return {
+        'alerts': len(on),
+        'true_alerts': true_alerts,
+        'precision': true_alerts / len(on) if len(on) else float('nan'),
+        'failures': len(failures),
+        'caught': len(leads),
+        'recall': len(leads) / len(failures) if len(failures) else float('nan'),
+        'lead_median_s': float(np.median(leads)) if leads else float('nan'),
+        'lead_min_s': float(np.min(leads)) if leads else float('nan'),
+        'false_per_hour': (len(on) - true_alerts) / hours if hours else float('nan'),
+    }
+
+
+def replay(path, configs, horizon_us, use_sklearn=False, chunksize=50_000):
+    """
+    score a labelled capture (train/ dir or one csv) once, feed every sample through a RiskMonitor per
+    config, returns {name: evaluate() result}
+    - failures are the first row of each PartReplacement run
+    - rows are scored the way predictive_maintain.py --stream would: the rolling features start over
+      after a gap longer than SOURCE_IDLE (capture was off between files), and rows that don't come at
+      the model's training rate (rate_ok) are not scored. Their failures still count, as misses
+    """
+    import dataset
+    import predictive_maintain
+
+    files = dataset.list_files(path) if os.path.isdir(path) else [path]
+    scorer = predictive_maintain.load_scorer(use_sklearn)
+    monitors = {name: RiskMonitor(c) for name, c in configs.items()}
+    events = {name: [] for name in configs}
+    failures, last_stage, first_ts, last_ts = [], None, None, None
+    meter = None
+    for f in files:
+        for chunk in dataset.read_chunks(f, chunksize):
+            chunk = chunk.dropna()
+            if chunk.empty:
+                continue
+            chunk['stage'] = chunk['stage'].astype(str)
+            chunk['unused'] = 0
+            ts, stages = chunk['timestamp'].to_numpy(), chunk['stage'].tolist()
+            if last_ts is None or ts[0] - last_ts > predictive_maintain.SOURCE_IDLE * 1e6:
+                scorer.reset()
+                meter = predictive_maintain.RateMeter()
+            meter.update(ts.tolist())
+            if predictive_maintain.rate_ok(meter.hz, scorer):
+                probs = scorer.score(chunk[predictive_maintain.COLUMNS].values.tolist())
+                for name, m in monitors.items():
+                    events[name].extend(m.update_batch(probs, stages, ts))
+            for t, s in zip(ts, stages):
+                if s == 'PartReplacement' and last_stage != 'PartReplacement':
+                    failures.append(int(t))
+                last_stage = s
+            first_ts = int(ts[0]) if first_ts is None else first_ts
+            last_ts = int(ts[-1])
+    duration = (last_ts - first_ts) if first_ts is not None else 0
+    return {name: evaluate(events[name], failures, horizon_us, duration) for name in configs}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Evaluate alarm configs against labelled captures")
+    parser.add_argument('--replay', required=True, help="train/ dir or a capture csv")
+    parser.add_argument('--config', action='append', help=f"config file to evaluate, repeatable (default {CONFIG_FILE})")
+    parser.add_argument('--set', action='append', default=[], metavar='KEY=VALUE', help="override for every config")
+    parser.add_argument('--horizon', type=float, default=LOOKBACK_US / 1e6,
+                        help="seconds before a failure an alert counts as a true alert")
+    parser.add_argument('--sklearn', action='store_true', help="score with failure_model.joblib")
+    args = parser.parse_args()
+
+    configs = {'sample>0.5': dict(DEFAULTS, method='sample', rise=0.5, fall=0.5)}
+    for path in args.config or [CONFIG_FILE]:
+        if args.config and not os.path.exists(path):
+            parser.error(f"{path} not found")
+        try:
+            c = load_config(path, args.set)
+        except ValueError as e:
+            parser.error(str(e))
+        configs[f"{os.path.basename(path)}:{c['method']}"] = c
+    results = replay(args.replay, configs, int(args.horizon * 1e6), args.sklearn)
+    width = max(len(name) for name in results)
+    print(f"{'config':{width}s} {'alerts':>6s} {'true':>5s} {'prec':>5s} {'caught':>9s} {'recall':>6s} "
+          f"{'lead med':>8s} {'lead min':>8s} {'false/h':>7s}")
+    for name, r in results.items():
+        print(f"{name:{width}s} {r['alerts']:6d} {r['true_alerts']:5d} {r['precision']:5.2f} "
+              f"{r['caught']:4d}/{r['failures']:<4d} {r['recall']:6.2f} {r['lead_median_s']:7.1f}s "
+              f"{r['lead_min_s']:7.1f}s {r['false_per_hour']:7.1f}")
@@ -0,0 +1,144 @@
+"""
+python -m pytest ML/test_alerts.py
+"""
+
+import os
+import socket
+import sys
+import threading
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.join(HERE, '..', 'bench'))
+import alerts
+from standins import SmtpSink
+
+
+class StubSender:
+    """records what it sends, fails the first `failures` attempts, waits for `release` when given one"""
+    def __init__(self, failures=0, release=None):
+        self.failures = failures
+        self.release = release
+        self.attempts = []   # (monotonic time, subject) of every send() call
+        self.sent = []
+        self.closed = False
+
+    def send(self, subject, body):
+        self.attempts.append((time.monotonic(), subject))
+        if self.release is not None:
+            self.release.wait()
+        if len(self.attempts) <= self.failures:
+            raise OSError("connection refused")
+        self.sent.append(subject)
+
+    def close(self):
+        self.closed = True
+
+
+def test_raise_alert_never_blocks_on_a_full_queue(tmp_path):
+    release = threading.Event()
+    sender = StubSender(release=release)
+    dispatcher = alerts.AlertDispatcher(sender, str(tmp_path / 'state.json'), queue_size=2)
+    try:
+        assert dispatcher.raise_alert('a', 'a', '')
+        while not sender.attempts:  # the worker has taken 'a' and hangs in send()
+            time.sleep(0.001)
+        assert dispatcher.raise_alert('b', 'b', '')
+        assert dispatcher.raise_alert('c', 'c', '')
+        for condition in 'defg':
+            start = time.perf_counter()
+            assert not dispatcher.raise_alert(condition, condition, '')
+            assert time.perf_counter() - start < 0.05
+        assert dispatcher.counts['dropped'] == 4
+        # a queued condition isn't queued twice
+        assert not dispatcher.raise_alert('b', 'b', '')
+        assert dispatcher.counts['suppressed'] == 1
+    finally:
+        release.set()
+        dispatcher.close()
+    assert sender.sent == ['a', 'b', 'c']
+    assert sender.closed
+
+
+def test_delivery_retries_with_backoff(tmp_path):
+    sender = StubSender(failures=2)
+    dispatcher = alerts.AlertDispatcher(sender, str(tmp_path / 'state.json'), retries=4, backoff=0.05)
+    assert dispatcher.raise_alert('failure_risk', 'risk', '')
+    dispatcher.queue.join()  # close() would cut the backoff short
+    dispatcher.close()
+    assert len(sender.attempts) == 3
+    assert sender.sent == ['risk']
+    assert dispatcher.counts['sent'] == 1 and dispatcher.counts['failed'] == 0
+    times = [t for t, _ in sender.attempts]
+    assert times[1] - times[0] >= 0.05
+    assert times[2] - times[1] >= 0.1  # doubled
+
+    # a server that never answers uses up the retries, and nothing is recorded for the cooldown
+    sender = StubSender(failures=10)
+    dispatcher = alerts.AlertDispatcher(sender, str(tmp_path / 'failing.json'), retries=3, backoff=0.01)
+    dispatcher.raise_alert('failure_risk', 'risk', '')
+    dispatcher.queue.join()
+    dispatcher.close()
+    assert len(sender.attempts) == 3
+    assert dispatcher.counts['failed'] == 1
+    assert not os.path.exists(tmp_path / 'failing.json')
+
+
+class CountingSender(alerts.SmtpSender):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.connects = 0
+
+    def connect(self):
+        self.connects += 1
+        super().connect()
+
+
+def test_smtp_connection_is_reused():
+    sink = SmtpSink()
+    sender = CountingSender(sink.host, sink.port, 'machine@example.com', 'operator@example.com', starttls=False)
+    try:
+        for i in range(3):
+            sender.send(f"alert {i}", "body")
+        assert sender.connects == 1
+        assert len(sink.events) == 3
+        assert 'Subject: alert 2' in sink.events[-1][1]
+
+        # a connection the server has dropped is reopened on the next send
+        sender.smtp.sock.shutdown(socket.SHUT_RDWR)
+        sender.send("alert 3", "body")
+        assert sender.connects == 2
+        assert len(sink.events) == 4
+    finally:
+        sender.close()
+        sink.close()
+
+
+def test_cooldown_survives_a_restart(tmp_path):
+    state = str(tmp_path / 'state.json')
+    sender = StubSender()
+    dispatcher = alerts.AlertDispatcher(sender, state, cooldown=300)
+    assert dispatcher.raise_alert('failure_risk', 'risk', '', now=1000.0)
+    dispatcher.close()
+    assert sender.sent == ['risk']
+
+    # a new process with the same state file holds the alert until the cooldown is over
+    sender = StubSender()
+    dispatcher = alerts.AlertDispatcher(sender, state, cooldown=300)
+    try:
+        assert dispatcher.last_sent == {'failure_risk': 1000.0}
+        assert not dispatcher.raise_alert('failure_risk', 'risk', '', now=1200.0)
+        assert dispatcher.counts['suppressed'] == 1
+        assert dispatcher.raise_alert('other', 'other', '', now=1200.0)
+        assert dispatcher.raise_alert('failure_risk', 'risk', '', now=1300.0)
+    finally:
+        dispatcher.close()
+    assert sorted(sender.sent) == ['other', 'risk']
+
+    # a missing or corrupt state file starts with no cooldowns
+    with open(state, 'w') as f:
+        f.write('{not json')
+    dispatcher = alerts.AlertDispatcher(StubSender(), state)
+    dispatcher.close()
+    assert dispatcher.last_sent == {}
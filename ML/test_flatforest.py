@@ -0,0 +1,78 @@
+"""
+python -m pytest ML/test_flatforest.py
+"""
+
+import os
+import sys
+
+import joblib
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.join(HERE, '..', 'data_simulator'))
+import flatforest
+import offline
+import predictive_maintain
+import training
+
+WINDOWS = (5, 40)
+BATCHES = (1, 2, 3, 7, 50, 200, 13)  # single rows while the windows fill, then --stream sized batches
+
+
+def rows_of(path):
+    with open(path) as f:
+        return predictive_maintain.parse_rows(f)
+
+
+def test_flat_scorer_matches_the_pipeline(tmp_path):
+    train_csv, live_csv = str(tmp_path / 'train.csv'), str(tmp_path / 'live.csv')
+    offline.generate_file(train_csv, 240, seed=1)
+    offline.generate_file(live_csv, 30, seed=2)
+
+    df = training.load_single_csv(train_csv, WINDOWS)
+    model = training.make_model(trees=8, depth=10, n_jobs=1)
+    model.fit(df[training.features.model_features(WINDOWS)], df['failure'])
+    model.rolling_windows = WINDOWS
+    model.sample_hz = df.attrs['sample_hz']
+    model.trained_at = 1
+    joblib.dump(model, tmp_path / 'model.joblib')
+    flatforest.export(model, tmp_path / 'model.npz', WINDOWS, 1, model.sample_hz)
+
+    sk = predictive_maintain.SklearnScorer(str(tmp_path / 'model.joblib'))
+    flat = flatforest.FlatScorer(str(tmp_path / 'model.npz'))
+    assert flat.windows == sk.windows == WINDOWS
+    assert flat.sample_hz == sk.sample_hz
+
+    rows = rows_of(live_csv)
+    stages = {r[5] for r in rows}
+    assert len(stages) >= 5  # the live rows go through the machine cycle, so every stage's window is used
+    start, i, compared = 0, 0, 0
+    while start < len(rows):
+        batch = rows[start:start + BATCHES[min(i, len(BATCHES) - 1)]]
+        expected = sk.score(batch)
+        got = flat.score(batch)
+        assert np.allclose(got, expected), f"batch at row {start}"
+        start += len(batch)
+        compared += len(batch)
+        i += 1
+    assert compared == len(rows)
+
+    # after a reset both start from empty windows again
+    sk.reset()
+    flat.reset()
+    assert np.allclose(flat.score(rows[:100]), sk.score(rows[:100]))
+
+
+def test_forest_matches_predict_proba(tmp_path):
+    """the forest alone, on the pipeline's own feature frame"""
+    csv = str(tmp_path / 'train.csv')
+    offline.generate_file(csv, 120, seed=3)
+    df = training.load_single_csv(csv, ())
+    X = df[training.features.model_features(())]
+    model = training.make_model(trees=5, depth=None, n_jobs=1)
+    model.fit(X, df['failure'])
+    forest = flatforest.FlatForest(flatforest.export(model, str(tmp_path / 'raw.npz')))
+    codes = np.array([training.features.STAGES.index(s) for s in df['stage']])
+    numeric = X[forest.numeric].to_numpy(dtype=np.float64)
+    assert np.allclose(forest.predict_proba(codes, numeric), model.predict_proba(X)[:, 1])
@@ -0,0 +1,51 @@
+"""
+python -m pytest ML/test_history.py
+"""
+
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import history
+
+CAPACITY = 10
+
+
+def filled(tmp_path, n):
+    hist = history.PredictionHistory(str(tmp_path / 'history.bin'), capacity=CAPACITY)
+    for i in range(n):
+        hist.append(i / 100, 'Injection', model_version=1, timestamp=1745973055.0 + i)
+    return hist
+
+
+def test_last_before_and_after_the_ring_wraps(tmp_path):
+    hist = filled(tmp_path, 0)
+    assert len(hist.last(5)) == 0
+    for n in range(1, 3 * CAPACITY + 1):
+        hist.append(n / 100, 'Holding', timestamp=1745973055.0 + n)
+        everything = np.concatenate(hist._segments())
+        for k in (0, 1, 3, CAPACITY - 1, CAPACITY, CAPACITY + 5):
+            recs = hist.last(k)
+            assert recs.tolist() == everything[len(everything) - min(k, len(everything)):].tolist(), (n, k)
+        assert hist.last(1)['timestamp'][0] == 1745973055.0 + n
+    hist.close()
+
+
+def test_last_reads_only_what_it_returns(tmp_path, monkeypatch):
+    hist = filled(tmp_path, CAPACITY + 4)  # newest 4 at the start of the ring, the 6 before them at the end
+    reads = []
+    pread = os.pread
+
+    def counting(fd, size, offset):
+        reads.append(size)
+        return pread(fd, size, offset)
+
+    monkeypatch.setattr(history.os, 'pread', counting)
+    recs = hist.last(6)
+    assert recs['timestamp'].tolist() == [1745973055.0 + i for i in range(8, 14)]
+    size = history.RECORD_DTYPE.itemsize
+    assert reads == [history.COUNT.size, 2 * size, 4 * size]
+    recs['probability'] = 0  # a copy, not a view of the read buffer
+    hist.close()
@@ -0,0 +1,89 @@
+"""
+python -m pytest ML/test_scoring.py
+"""
+
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import scoring
+
+
+def monitor(method, **options):
+    return scoring.RiskMonitor(dict(scoring.DEFAULTS, method=method, **options))
+
+
+def events_of(mon, probs, stages=None, timestamps=None):
+    stages = ['Injection'] * len(probs) if stages is None else stages
+    timestamps = range(len(probs)) if timestamps is None else timestamps
+    return mon.update_batch(probs, stages, timestamps)
+
+
+def test_sample_hysteresis():
+    mon = monitor('sample', rise=0.15, fall=0.1)
+    probs = [0.1, 0.15, 0.12, 0.1, 0.09, 0.14, 0.5, 0.0]
+    # on at rise, held while between fall and rise, off below fall
+    assert events_of(mon, probs) == [(1, 'on'), (4, 'off'), (6, 'on'), (7, 'off')]
+
+
+def test_ewma_follows_time_not_samples():
+    mon = monitor('ewma', ewma_tau=1.0, rise=0.15, fall=0.1)
+    # a step to 1 for a second at 100Hz, then back to 0: 1 - e^-t reaches 0.15 at t = 0.163s,
+    # then 0.628 at 0.99s decays below 0.1 after another ln(6.28) = 1.84s
+    ts = [i * 10_000 for i in range(400)]
+    probs = [1.0] * 100 + [0.0] * 300
+    assert events_of(mon, probs, timestamps=ts) == [(170_000, 'on'), (2_830_000, 'off')]
+
+    # the same step at 10Hz goes on at the first sample after 0.163s
+    mon = monitor('ewma', ewma_tau=1.0, rise=0.15, fall=0.1)
+    assert events_of(mon, [1.0] * 10, timestamps=[i * 100_000 for i in range(10)]) == [(200_000, 'on')]
+
+    # one high sample after a long gap is not a second of them, and a gap decays the value
+    mon = monitor('ewma', ewma_tau=1.0, rise=0.15, fall=0.1)
+    assert events_of(mon, [1.0], timestamps=[0]) == []
+    assert events_of(mon, [1.0, 0.0], timestamps=[2_000_000, 12_000_000]) == [(2_000_000, 'on'), (12_000_000, 'off')]
+
+
+def test_kofn_counts_the_last_n():
+    mon = monitor('kofn', kofn_n=4, kofn_threshold=0.5, rise=0.5, fall=0.25)
+    probs = [0.9, 0.1, 0.9, 0.5, 0.1, 0.1, 0.1, 0.9, 0.9]  # 0.5 is not over the threshold
+    fractions = []
+    for t, p in enumerate(probs):
+        mon.update(p, 'Injection', t)
+        fractions.append(mon.value)
+    assert fractions == [0.25, 0.25, 0.5, 0.5, 0.25, 0.25, 0.0, 0.25, 0.5]
+    mon = monitor('kofn', kofn_n=4, kofn_threshold=0.5, rise=0.5, fall=0.25)
+    assert events_of(mon, probs) == [(2, 'on'), (6, 'off'), (8, 'on')]
+
+
+def test_cycle_max_holds_for_a_cycle():
+    mon = monitor('cycle_max', cycle_start='PreInjection', rise=0.15, fall=0.1)
+    cycle = ['PreInjection', 'Injection', 'Holding', 'Cooling', 'Waiting']
+    stages = cycle + cycle + ['PreInjection', 'PreInjection'] + cycle[1:]
+    probs = [0.05, 0.3, 0.0, 0.0, 0.0,     # spike in the first cycle
+             0.0, 0.05, 0.0, 0.0, 0.0,     # held through the next one
+             0.0, 0.0, 0.0, 0.0, 0.0, 0.0]  # dropped when the third starts (only once for repeated PreInjection)
+    assert events_of(mon, probs, stages) == [(1, 'on'), (10, 'off')]
+    assert mon.value == 0.05
+
+
+def test_ignored_stages_are_skipped():
+    mon = monitor('sample')
+    stages = ['Injection', 'PartReplacement', 'PartReplacement', 'PreInjection']
+    assert events_of(mon, [0.0, 1.0, 1.0, 0.0], stages) == []
+    assert mon.value == 0.0
+    assert events_of(monitor('sample', ignore_stages=''), [0.0, 1.0, 1.0, 0.0], stages) == [(1, 'on'), (3, 'off')]
+    mon = monitor('sample', ignore_stages='PartReplacement, Waiting')
+    assert mon.update(1.0, 'Waiting', 0) is None and not mon.active
+
+
+def test_alarm_intervals_and_evaluate():
+    events = [(10, 'on'), (20, 'off'), (50, 'on')]
+    intervals = scoring.alarm_intervals(events)
+    assert intervals.tolist() == [[10, 20], [50, np.iinfo(np.int64).max]]
+    # 25 follows the first onset within the horizon, 200 happens while the second alarm is still on
+    result = scoring.evaluate(events, [25, 200], horizon_us=30, duration_us=3_600_000_000)
+    assert (result['alerts'], result['true_alerts'], result['caught']) == (2, 2, 2)
+    assert result['lead_min_s'] == 15 / 1e6 and result['false_per_hour'] == 0
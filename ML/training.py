@@ -0,0 +1,316 @@
+"""
+Time-aware evaluation, parameter sweep and feature cache for ML_trainer.py
+
+A random train_test_split of 100Hz data puts each test row's neighbours (10ms away, same drift, same
+rolling windows) in the training set, so the score mostly measures memory. Here the data is split in time:
+  event    k contiguous folds with the same number of failures each, boundaries just after a
+           PartReplacement, so a failure and its whole run-up are in one fold (the default)
+  blocked  k contiguous folds with the same number of rows
+  random   the old shuffled split, only to compare against
+and training rows within `gap` of a test fold are left out (the label lookback and the rolling windows
+both reach across a boundary).
+
+- a --train-dir sample keeps as many failure rows as normal ones, each row carries the weight that gives
+  back the stream's class balance, and every fit and metric uses it
+- parsed and labelled feature frames are cached in .feature_cache/, keyed by the input files (path, size,
+  mtime), the windows, the loading options and the source of features.py/dataset.py, so a repeated run
+  or a sweep over trees and depths never parses the captures again
+- a sweep runs one config per process (forests with n_jobs=1 inside), a single fit uses every core
+- every config reports the cost of scoring it with FlatScorer, the NumPy path predictive_maintain.py uses
+  on the BBB, in batches the size --stream scores, next to its accuracy. It is timed on this machine
+  (compare configs with it, the BBB is several times slower) and inside the sweep worker, so keep
+  --workers at or below the core count when the timings matter
+"""
+
+import hashlib
+import itertools
+import json
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from sklearn.compose import ColumnTransformer
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.metrics import average_precision_score, f1_score, precision_score, recall_score, roc_auc_score
+from sklearn.model_selection import train_test_split
+from sklearn.pipeline import make_pipeline
+from sklearn.preprocessing import OneHotEncoder
+
+import dataset
+import features
+import flatforest
+
+CACHE_DIR = '.feature_cache'
+CV_METHODS = ('event', 'blocked', 'random')
+GAP_US = 60 * 1_000_000   # purge around a test fold, > LOOKBACK_US plus a 200 sample window across cycles
+BATCH_ROWS = 200          # predictive_maintain.BATCH_MAX, rows per scoring call when timing inference
+COST_ROWS = 20_000        # rows scored when timing inference
+FIT_WEIGHT = 'randomforestclassifier__sample_weight'  # make_pipeline names the forest step after its class
+METRICS = ('precision', 'recall', 'f1', 'roc_auc', 'average_precision', 'event_recall')
+
+
+def load_single_csv(path, windows):
+    """original mode: the whole csv (or .hfb) in memory"""
+    if path.endswith(dataset.hfbin.EXT):
+        df = pd.concat(dataset.read_hfb_chunks(path, 1_000_000))
+        df['stage'] = df['stage'].astype(str)
+    else:
+        df = pd.read_csv(path, delimiter=',', header=None, names=features.COLUMNS)
+    print(f"Loaded {len(df)} samples from {path}")
+    df = df.sort_values('timestamp', kind='stable').reset_index(drop=True)
+    df.attrs['sample_hz'] = features.sample_hz(df['timestamp'])
+
+    # mark rows in the 10s window before each PartReplacement
+    df['failure'] = features.label_failures(df['timestamp'], features.failure_times(df))
+    df['weight'] = 1.0
+
+    print(f"Computing rolling features {windows}")
+    features.add_rolling_features(df, windows)
+    return df
+
+
+def load_train_dir(directory, windows, chunksize=200_000, max_memory_mb=512):
+    """
+    stream every capture file in chunks and keep a stratified reservoir sample
+    - the sample gets about half the memory budget, the rest covers the chunk being read and the
+      copy the forest makes while fitting
+    """
+    files = dataset.list_files(directory)
+    if not files:
+        raise SystemExit(f"No train_*.csv files in {directory}")
+    print(f"Scanning {len(files)} files for failures")
+    fail_times = dataset.scan_failure_times(files, chunksize)
+    print(f"Found {len(fail_times)} PartReplacement rows")
+
+    budget = max_memory_mb * 1024 * 1024
+    reservoir = None
+    total = 0
+    rates = []
+    for chunk in dataset.iter_labelled_chunks(files, chunksize, windows, fail_times):
+        if reservoir is None:
+            row_bytes = dataset.bytes_per_row(chunk)
+            capacity = (budget - chunksize * row_bytes) // (2 * row_bytes)
+            if capacity <= 0:
+                raise SystemExit("--max-memory-mb too small for --chunksize, lower the chunk size")
+            print(f"Sampling up to {capacity} rows ({row_bytes} B/row)")
+            reservoir = dataset.StratifiedReservoir(capacity)
+        reservoir.add(chunk)
+        total += len(chunk)
+        # measured on the full chunks, the sample's timestamps are too sparse for it
+        rates.append(features.sample_hz(chunk['timestamp']))
+    df = reservoir.frame().sort_values('timestamp', kind='stable').reset_index(drop=True)
+    rates = [r for r in rates if r]
+    df.attrs['sample_hz'] = float(np.median(rates)) if rates else None
+    weights = reservoir.weights()
+    df['weight'] = df['failure'].map(weights).astype(np.float64)
+    print(f"Streamed {total} samples, training on a sample of {len(df)} "
+          f"(row weights {', '.join(f'{c}: {w:.1f}' for c, w in sorted(weights.items()))})")
+    return df
+
+
+def source_files(source):
+    """the capture files a --train-dir or single file source reads"""
+    return dataset.list_files(source) if os.path.isdir(source) else [source]
+
+
+def cache_key(source, windows, options):
+    """hash of everything the feature frame depends on"""
+    h = hashlib.sha1()
+    for path in source_files(source):
+        st = os.stat(path)
+        h.update(f"{os.path.abspath(path)}:{st.st_size}:{st.st_mtime_ns}\n".encode())
+    here = os.path.dirname(os.path.abspath(__file__))
+    for module in ('features.py', 'dataset.py', 'training.py'):
+        with open(os.path.join(here, module), 'rb') as f:
+            h.update(f.read())
+    h.update(json.dumps([list(windows), options], sort_keys=True).encode())
+    return h.hexdigest()[:16]
+
+
+def build_features(source, windows, options, cache_dir=CACHE_DIR):
+    """path of the cached feature frame for these windows, parsing the captures only on a miss"""
+    path = os.path.join(cache_dir, f"features_{cache_key(source, windows, options)}.pkl")
+    if os.path.exists(path):
+        print(f"Features {windows}: cached {path}")
+        return path
+    started = time.perf_counter()
+    if os.path.isdir(source):
+        df = load_train_dir(source, windows, options['chunksize'], options['max_memory_mb'])
+    else:
+        df = load_single_csv(source, windows)
+    hz = df.attrs.get('sample_hz')
+    df = df[['timestamp', 'failure', 'weight'] + features.model_features(windows)].dropna()
+    df.attrs['sample_hz'] = hz  # the model records it, rolling windows count samples at this rate
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    df.to_pickle(tmp)
+    os.replace(tmp, path)
+    print(f"Features {windows}: {len(df)} rows in {time.perf_counter() - started:.1f}s, cached {path}")
+    return path
+
+
+def failure_events(timestamps, labels, lookback_us=features.LOOKBACK_US):
+    """
+    one time per failure, the last row of each run of failure labels
+    - from the labels rather than PartReplacement rows, a --train-dir sample may have dropped those
+    """
+    t = np.sort(np.asarray(timestamps, dtype=np.int64)[np.asarray(labels) == 1])
+    if len(t) == 0:
+        return t
+    return t[np.concatenate([np.diff(t) > lookback_us, [True]])]
+
+
+def time_folds(timestamps, events, k=5, method='event', gap_us=GAP_US, seed=42):
+    """
+    [(train index, test index)] over rows with these timestamps, see the module docstring
+    - events are the failure times (failure_events), event folds need at least k of them
+    """
+    ts = np.asarray(timestamps, dtype=np.int64)
+    idx = np.arange(len(ts))
+    if method == 'random':
+        return [train_test_split(idx, test_size=1 / k, random_state=seed + i) for i in range(k)]
+    order = np.argsort(ts, kind='stable')
+    if method == 'blocked':
+        bounds = [ts[order[min(len(ts) - 1, len(ts) * j // k)]] for j in range(1, k)]
+    elif method == 'event':
+        if len(events) < k:
+            raise ValueError(f"{len(events)} failures, event folds need at least {k} (use fewer folds or blocked)")
+        # fold j ends just after its last failure
+        bounds = [events[len(events) * j // k - 1] + 1 for j in range(1, k)]
+    else:
+        raise ValueError(f"cv must be one of {', '.join(CV_METHODS)}")
+    fold = np.searchsorted(np.asarray(bounds, dtype=np.int64), ts, side='right')
+    folds = []
+    for j in range(k):
+        test = idx[fold == j]
+        if len(test) == 0:
+            continue
+        lo, hi = ts[test].min() - gap_us, ts[test].max() + gap_us
+        train = idx[(fold != j) & ((ts < lo) | (ts > hi))]
+        folds.append((train, test))
+    return folds
+
+
+def event_recall(timestamps, y_true, y_pred, events):
+    """fraction of failures with at least one positive prediction in their labelled run-up"""
+    pos = np.flatnonzero(np.asarray(y_true) == 1)
+    if len(pos) == 0 or len(events) == 0:
+        return float('nan')
+    owner = np.searchsorted(events, np.asarray(timestamps)[pos], side='left')
+    caught = pd.Series(np.asarray(y_pred)[pos]).groupby(owner).max()
+    return float(caught.mean())
+
+
+def score_fold(y, p, timestamps, events, weight=None, threshold=0.5):
+    pred = (p > threshold).astype(np.int8)
+    two_classes = len(np.unique(y)) == 2
+    return {
+        'precision': precision_score(y, pred, sample_weight=weight, zero_division=0),
+        'recall': recall_score(y, pred, sample_weight=weight, zero_division=0),
+        'f1': f1_score(y, pred, sample_weight=weight, zero_division=0),
+        'roc_auc': roc_auc_score(y, p, sample_weight=weight) if two_classes else float('nan'),
+        'average_precision': average_precision_score(y, p, sample_weight=weight) if two_classes else float('nan'),
+        'event_recall': event_recall(timestamps, y, pred, events),
+    }
+
+
+def make_model(trees=100, depth=None, n_jobs=-1, seed=42):
+    preprocessor = ColumnTransformer(transformers=[('stage', OneHotEncoder(handle_unknown='ignore'), ['stage'])],
+                                     remainder='passthrough')
+    return make_pipeline(preprocessor, RandomForestClassifier(n_estimators=trees, max_depth=depth, n_jobs=n_jobs,
+                                                              random_state=seed))
+
+
+def inference_cost(model, windows, df, rows=COST_ROWS, batch=BATCH_ROWS):
+    """
+    FlatScorer us per sample over `rows` time ordered rows in `batch` sized calls (rolling features
+    included), plus the exported model's size and node count
+    """
+    sample = df.iloc[:rows]
+    raw = list(zip(sample['timestamp'].tolist(), sample['temp'].tolist(), sample['pressure'].tolist(),
+                   sample['amplitude'].tolist(), sample['frequency'].tolist(),
+                   sample['stage'].astype(str).tolist(), [0] * len(sample)))
+    with tempfile.TemporaryDirectory() as d:
+        path = flatforest.export(model, os.path.join(d, 'model.npz'), windows)
+        size = os.path.getsize(path)
+        scorer = flatforest.FlatScorer(path)
+        started = time.perf_counter()
+        for i in range(0, len(raw), batch):
+            scorer.score(raw[i:i + batch])
+        elapsed = time.perf_counter() - started
+    return {'us_per_sample': elapsed * 1e6 / max(len(raw), 1), 'model_kb': size / 1024,
+            'nodes': int(sum(e.tree_.node_count for e in model.steps[-1][1].estimators_))}
+
+
+def evaluate(config, cache_path, folds=5, cv='event', gap_us=GAP_US, n_jobs=1):
+    """
+    cross validate one config on a cached feature frame, returns config + mean/std of METRICS,
+    fit seconds per fold and the inference cost of the last fold's model
+    """
+    windows = tuple(config['windows'])
+    df = pd.read_pickle(cache_path)
+    df['stage'] = df['stage'].astype(str)
+    X = df[features.model_features(windows)]
+    y = df['failure'].to_numpy()
+    w = df['weight'].to_numpy()
+    ts = df['timestamp'].to_numpy()
+    events = failure_events(ts, y)
+
+    scores, fit_seconds, model = [], [], None
+    for train, test in time_folds(ts, events, folds, cv, gap_us):
+        if len(np.unique(y[train])) < 2:
+            continue  # a fold without failures in its training rows can't fit a classifier
+        model = make_model(config['trees'], config['depth'], n_jobs)
+        started = time.perf_counter()
+        model.fit(X.iloc[train], y[train], **{FIT_WEIGHT: w[train]})
+        fit_seconds.append(time.perf_counter() - started)
+        p = model.predict_proba(X.iloc[test])[:, 1]
+        scores.append(score_fold(y[test], p, ts[test], events, w[test]))
+    if model is None:
+        raise ValueError("no fold had both classes to train on")
+
+    result = dict(config, windows=list(windows), folds=len(scores), fit_s=float(np.mean(fit_seconds)))
+    for m in METRICS:
+        values = np.array([s[m] for s in scores], dtype=np.float64)
+        result[m] = float(np.nanmean(values)) if np.any(~np.isnan(values)) else float('nan')
+        result[m + '_std'] = float(np.nanstd(values)) if np.any(~np.isnan(values)) else float('nan')
+    result.update(inference_cost(model, windows, df))
+    return result
+
+
+def sweep(configs, cache_paths, folds, cv, gap_us, workers=None):
+    """evaluate every config, one per process (n_jobs=1 forests), or in this process with all cores for one"""
+    if len(configs) == 1:
+        c = configs[0]
+        return [evaluate(c, cache_paths[tuple(c['windows'])], folds, cv, gap_us, n_jobs=-1)]
+    workers = min(workers or os.cpu_count() or 1, len(configs))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(evaluate, c, cache_paths[tuple(c['windows'])], folds, cv, gap_us)
+                   for c in configs]
+        return [f.result() for f in futures]
+
+
+def grid(windows_sets, trees, depths):
+    return [{'windows': list(w), 'trees': t, 'depth': d} for w, t, d in itertools.product(windows_sets, trees, depths)]
+
+
+def pick(results, metric='average_precision', max_us=None):
+    """best result by metric among those cheap enough to score, ties go to the cheaper one"""
+    ok = [r for r in results if max_us is None or r['us_per_sample'] <= max_us]
+    if not ok:
+        raise SystemExit(f"no config scores under {max_us}us per sample, raise --max-us")
+    return max(ok, key=lambda r: (np.nan_to_num(r[metric], nan=-1.0), -r['us_per_sample']))
+
+
+def print_results(results, rate):
+    print(f"\n{'windows':12s} {'trees':>5s} {'depth':>5s} {'prec':>5s} {'recall':>6s} {'f1':>5s} {'auc':>5s} "
+          f"{'ap':>5s} {'events':>6s} {'fit s':>6s} {'us/row':>7s} {f'cpu@{rate:g}Hz':>10s} {'model':>8s}")
+    for r in results:
+        windows = ','.join(str(w) for w in r['windows']) or 'raw'
+        print(f"{windows:12s} {r['trees']:5d} {str(r['depth']):>5s} {r['precision']:5.2f} {r['recall']:6.2f} "
+              f"{r['f1']:5.2f} {r['roc_auc']:5.2f} {r['average_precision']:5.2f} {r['event_recall']:6.2f} "
+              f"{r['fit_s']:6.1f} {r['us_per_sample']:7.1f} {100 * rate * r['us_per_sample'] / 1e6:9.1f}% "
+              f"{r['model_kb']:7.0f}K")
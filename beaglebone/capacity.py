@@ -0,0 +1,461 @@
+"""
+Capacity planner: SD, upload and monthly volume projections from measured rows instead of guesses
+
+live_data's estimates multiply the configured rates by sizeof(LogRow), the C struct, which is not
+what ends up on disk or on the SIM: a csv row is ~55 bytes of text, PartReplacement rows are shorter,
+gzip/zstd shrink it several times, and the logger doesn't always achieve hiRateHz. This reads real
+captures (logs/ and train/ csv or .hfb) in one streaming pass, or a synthetic sample from the offline
+simulator when there are none yet, and measures:
+- bytes per row and achieved rows/s, per dir and per machine stage
+- compression ratio with the codec `upload.py --segment` would use (zstd if installed, else gzip)
+then projects, for the config.txt rates (or --hi-rate/--lo-rate what-ifs):
+- how long the dir caps and --sd-free-mb hold when uploads stop
+- upload time per cron run and backlog for --uplink KB/s (default: the median of upload_stats.csv)
+- monthly S3 and SIM volume for --capture-hours of HF a day
+and suggests config.txt values (--write-config to save them).
+
+Usage:
+  python3 capacity.py                                   # scan logs/ and train/, project with config.txt
+  python3 capacity.py --uplink 32 --cron 300 --capture-hours 2 --sd-free-mb 2000
+  python3 capacity.py --synthetic 600                   # no captures yet, 10 min of simulator rows
+  python3 capacity.py --form segment --sim-mb-month 1000 --write-config config.suggested.txt
+"""
+
+import argparse
+import glob
+import io
+import os
+import statistics
+import sys
+import zlib
+
+import numpy as np
+
+import storage
+from logger_config import KEYS, read_capture, read_config
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+DEFAULT_CONFIG = {'hiRateHz': 100, 'loRateHz': 4, 'maxLogFileKB': 15, 'maxLogDirKB': 9500, 'maxTrainDirKB': 10000,
+                  'captureSeconds': 0, 'captureEnabled': 0}
+MAX_GAP = 15.0             # seconds, a longer step between rows is capture off or the logger down, not logging time
+HFB_ROW_BYTES = 25         # hfbin.RECORD_DTYPE.itemsize, without importing numpy-heavy hfbin for csv scans
+MONTH = 30 * 86400
+S3_FREE_BYTES = 5 * 1024 ** 3  # the S3 free tier live_data uses
+FORMS = ('csv', 'binary', 'segment')
+CHUNK_ROWS = 50_000
+STATS_FILE = 'upload_stats.csv'  # same as upload.py
+FROZEN_STAGES = ('PartReplacement',)  # the server stops updating the timestamp, the logger records one row
+
+
+def make_compressor():
+    """streaming compressor for the codec segment.pack() picks, level for level"""
+    if zstandard:
+        return 'zstd', zstandard.ZstdCompressor(level=10).compressobj()
+    return 'gzip', zlib.compressobj(9, zlib.DEFLATED, 31)
+
+
+class DirStats:
+    """
+    running totals for one dir, fed in batches
+    - the time from one row to the next counts towards the first row's stage, so a PartReplacement
+      (frozen timestamps, then a 10s jump) gets its real duration
+    """
+    def __init__(self, name, max_gap=MAX_GAP):
+        self.name = name
+        self.max_gap = max_gap
+        self.files = self.rows = self.bytes = self.compressed = 0
+        self.seconds = 0.0
+        self.codec = None
+        self.stage_names = []
+        self.stage_codes = {}
+        self.stage_rows = np.zeros(0, dtype=np.int64)
+        self.stage_bytes = np.zeros(0, dtype=np.int64)
+        self.stage_seconds = np.zeros(0)
+        self.last_ts = self.last_code = None
+
+    def code(self, stage):
+        if stage not in self.stage_codes:
+            self.stage_codes[stage] = len(self.stage_names)
+            self.stage_names.append(stage)
+            self.stage_rows = np.append(self.stage_rows, 0)
+            self.stage_bytes = np.append(self.stage_bytes, 0)
+            self.stage_seconds = np.append(self.stage_seconds, 0.0)
+        return self.stage_codes[stage]
+
+    def add_rows(self, ts, stages, sizes):
+        """ts (us), stage names and on-disk bytes of consecutive rows"""
+        if not len(ts):
+            return
+        ts = np.asarray(ts, dtype=np.int64)
+        codes = np.array([self.code(s) for s in stages], dtype=np.int64)
+        sizes = np.asarray(sizes, dtype=np.int64)
+        prev_ts = np.concatenate([[ts[0] if self.last_ts is None else self.last_ts], ts[:-1]])
+        owner = np.concatenate([[codes[0] if self.last_code is None else self.last_code], codes[:-1]])
+        step = (ts - prev_ts) / 1e6
+        step[(step < 0) | (step > self.max_gap)] = 0.0
+        n = len(self.stage_names)
+        self.stage_rows += np.bincount(codes, minlength=n)
+        self.stage_bytes += np.bincount(codes, weights=sizes, minlength=n).astype(np.int64)
+        self.stage_seconds += np.bincount(owner, weights=step, minlength=n)
+        self.rows += len(ts)
+        self.bytes += int(sizes.sum())
+        self.seconds += float(step.sum())
+        self.last_ts, self.last_code = int(ts[-1]), int(codes[-1])
+
+    def add_compressed(self, n, codec):
+        self.compressed += n
+        self.codec = codec
+
+    @property
+    def row_bytes(self):
+        return self.bytes / self.rows if self.rows else 0.0
+
+    @property
+    def rate(self):
+        """rows/s while the machine is producing, frozen stages left out"""
+        live = [i for i, s in enumerate(self.stage_names) if s not in FROZEN_STAGES]
+        seconds = float(self.stage_seconds[live].sum())
+        return float(self.stage_rows[live].sum()) / seconds if seconds else 0.0
+
+    @property
+    def ratio(self):
+        """compressed / original"""
+        return self.compressed / self.bytes if self.bytes and self.compressed else 1.0
+
+
+def scan_csv(path, stats, compress=True):
+    """one pass over a logger csv, compressing as it goes; malformed lines (a torn last row) are skipped"""
+    codec, comp = make_compressor() if compress else (None, None)
+    out = 0
+    with open(path, 'rb') as f:
+        while True:
+            lines = f.readlines(CHUNK_ROWS * 64)
+            if not lines:
+                break
+            if comp:
+                out += len(comp.compress(b''.join(lines)))
+            ts, stages, sizes = [], [], []
+            for line in lines:
+                fields = line.split(b',', 6)
+                try:
+                    t = int(fields[0])
+                    stage = fields[5].decode()
+                except (ValueError, IndexError, UnicodeDecodeError):
+                    continue
+                ts.append(t)
+                stages.append(stage)
+                sizes.append(len(line))
+            stats.add_rows(ts, stages, sizes)
+    if comp:
+        stats.add_compressed(out + len(comp.flush()), codec)
+    stats.files += 1
+
+
+def scan_hfb(path, stats, compress=True):
+    import hfbin
+    records, names = hfbin.read(path)
+    size = os.path.getsize(path)
+    for i in range(0, len(records), CHUNK_ROWS):
+        chunk = records[i:i + CHUNK_ROWS]
+        stages = [names[c] if c < len(names) else '?' for c in chunk['stage'].tolist()]
+        stats.add_rows(chunk['timestamp'], stages, np.full(len(chunk), hfbin.RECORD_DTYPE.itemsize))
+    stats.bytes += size - len(records) * hfbin.RECORD_DTYPE.itemsize  # header
+    if compress:
+        codec, comp = make_compressor()
+        out = 0
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                out += len(comp.compress(block))
+        stats.add_compressed(out + len(comp.flush()), codec)
+    stats.files += 1
+
+
+def scan_dir(directory, compress=True, max_gap=MAX_GAP):
+    """every capture in the dir, oldest first (the logger's file names carry their start time)"""
+    stats = DirStats(directory, max_gap)
+    files = glob.glob(os.path.join(directory, '*.csv')) + glob.glob(os.path.join(directory, '*.hfb'))
+    for path in sorted(files, key=lambda p: (storage.file_ts(os.path.basename(p)), p)):
+        if path.endswith('.hfb'):
+            scan_hfb(path, stats, compress)
+        else:
+            scan_csv(path, stats, compress)
+    return stats
+
+
+def synthetic(seconds, cfg, seed=1, compress=True, max_gap=MAX_GAP):
+    """(logs, train) stats for `seconds` of offline simulator rows, decimated to loRateHz/hiRateHz the way
+    the collector does it (by sample timestamp)"""
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data_simulator'))
+    import offline
+
+    result = []
+    for name, key in (('logs', 'loRateHz'), ('train', 'hiRateHz')):
+        stats = DirStats(name, max_gap)
+        codec, comp = make_compressor() if compress else (None, None)
+        out = 0
+        period = 1e6 / cfg[key]
+        last_slot = None
+        for batch in offline.generate(seconds, rate=max(cfg['hiRateHz'], cfg['loRateHz']), seed=seed):
+            slot = batch['timestamp_us'] // period
+            keep = np.ones(len(slot), dtype=bool)
+            keep[1:] = slot[1:] != slot[:-1]
+            if last_slot is not None and len(slot):
+                keep[0] = slot[0] != last_slot
+            last_slot = slot[-1] if len(slot) else last_slot
+            batch = {k: v[keep] if isinstance(v, np.ndarray) else v for k, v in batch.items()}
+            buf = io.StringIO()
+            offline.write_csv_rows(buf, batch)
+            text = buf.getvalue().encode()
+            if comp:
+                out += len(comp.compress(text))
+            lines = text.splitlines(keepends=True)
+            stages = np.array(offline.STAGES)[batch['stage']].tolist()
+            stats.add_rows(batch['timestamp_us'], stages, [len(line) for line in lines])
+        if comp:
+            stats.add_compressed(out + len(comp.flush()), codec)
+        stats.files = 1
+        result.append(stats)
+    return tuple(result)
+
+
+def measured_uplink(path=STATS_FILE):
+    """median bytes/s of the upload runs in upload_stats.csv, None without any"""
+    rates = []
+    try:
+        with open(path) as f:
+            next(f, None)
+            for line in f:
+                try:
+                    rates.append(float(line.rstrip().split(',')[5]))
+                except (ValueError, IndexError):
+                    continue
+    except OSError:
+        return None
+    rates = [r for r in rates if r > 0]
+    return statistics.median(rates) if rates else None
+
+
+def upload_bytes_per_row(stats, form):
+    """what one logged row costs on the uplink for an upload.py mode"""
+    if form == 'binary':
+        return HFB_ROW_BYTES
+    if form == 'segment':
+        return stats.row_bytes * stats.ratio
+    return stats.row_bytes
+
+
+def project(logs, train, cfg, args):
+    """every projection as a flat dict of plain numbers, None where an input is missing"""
+    lf_disk = cfg['loRateHz'] * logs.row_bytes                # bytes/s written to logs/
+    hf_disk = cfg['hiRateHz'] * train.row_bytes               # bytes/s written to train/ while capturing
+    lf_up = cfg['loRateHz'] * upload_bytes_per_row(logs, args.form)
+    hf_up = cfg['hiRateHz'] * upload_bytes_per_row(train, args.form)
+    duty = args.capture_hours / 24
+    overhead = 1 + args.overhead / 100
+    p = {
+        'lf_disk_bps': lf_disk, 'hf_disk_bps': hf_disk, 'lf_up_bps': lf_up, 'hf_up_bps': hf_up,
+        'log_cap_s': cfg['maxLogDirKB'] * 1024 / lf_disk if lf_disk else None,
+        'train_cap_s': cfg['maxTrainDirKB'] * 1024 / hf_disk if hf_disk else None,
+        # LF files only reach upload.py once rotated, train files when the capture is turned off
+        'log_file_close_s': cfg['maxLogFileKB'] * 1024 / lf_disk if lf_disk else None,
+        'month_up_bytes': (lf_up + hf_up * duty) * MONTH,
+        'month_sim_bytes': (lf_up + hf_up * duty) * MONTH * overhead,
+        'day_disk_bytes': (lf_disk + hf_disk * duty) * 86400,
+    }
+    p['s3_free_months'] = S3_FREE_BYTES / p['month_up_bytes'] if p['month_up_bytes'] else None
+    if args.sd_free_mb:
+        sd = args.sd_free_mb * 1024 * 1024
+        p['sd_lf_hours'] = sd / lf_disk / 3600 if lf_disk else None
+        p['sd_all_hours'] = sd / (lf_disk + hf_disk) / 3600 if lf_disk + hf_disk else None
+    if args.what_if_hours:
+        p['what_if_bytes'] = (lf_disk + hf_disk) * args.what_if_hours * 3600
+        p['what_if_up_bytes'] = (lf_up + hf_up) * args.what_if_hours * 3600
+    uplink = args.uplink * 1024 if args.uplink else measured_uplink()
+    p['uplink_bps'] = uplink
+    if uplink:
+        for name, rate in (('lf', lf_up), ('capture', lf_up + hf_up)):
+            util = rate * overhead / uplink
+            p[f'{name}_util'] = util
+            p[f'{name}_run_s'] = rate * args.cron * overhead / uplink
+            # backlog grows by (rate - uplink) every second the uplink can't keep up
+            p[f'{name}_backlog_bph'] = max(0.0, rate * overhead - uplink) * 3600 / overhead
+        # the buffer peaks at a period's worth of data plus whatever arrives while it is sent
+        p['max_cron_s'] = (cfg['maxLogDirKB'] * 1024 / (lf_disk * (1 + p['lf_util']))
+                           if lf_disk and p['lf_util'] < 1 else None)
+    return p
+
+
+def suggest(logs, train, cfg, args):
+    """config.txt values from the measurements, with a reason per changed key"""
+    new, why = dict(cfg), {}
+    if train.seconds and train.rate < cfg['hiRateHz'] * 0.95:
+        new['hiRateHz'] = max(1, int(train.rate))
+        why['hiRateHz'] = f"train/ only achieved {train.rate:.1f} rows/s"
+    if args.sim_mb_month and logs.row_bytes:
+        budget = args.sim_mb_month * 1024 * 1024 / (1 + args.overhead / 100)
+        hf_month = cfg['hiRateHz'] * upload_bytes_per_row(train, args.form) * args.capture_hours / 24 * MONTH
+        lo = int((budget - hf_month) / (upload_bytes_per_row(logs, args.form) * MONTH))
+        if lo < 1:
+            why['loRateHz'] = f"HF capture alone is over the {args.sim_mb_month:g}MB budget, cut --capture-hours"
+        elif lo != cfg['loRateHz']:
+            new['loRateHz'] = min(lo, new['hiRateHz'])
+            why['loRateHz'] = f"most the {args.sim_mb_month:g}MB/month SIM budget allows"
+    lf_disk = new['loRateHz'] * logs.row_bytes
+    hf_disk = new['hiRateHz'] * train.row_bytes
+    if lf_disk:
+        # a file must close at least once per cron run or its rows wait a whole extra period
+        file_kb = max(1, int(lf_disk * args.cron / 1024))
+        if file_kb < cfg['maxLogFileKB']:
+            new['maxLogFileKB'] = file_kb
+            why['maxLogFileKB'] = f"closes a file every {args.cron:g}s cron period"
+        new['maxLogDirKB'] = int(lf_disk * args.outage_hours * 3600 * 1.2 / 1024) + 1
+        why['maxLogDirKB'] = f"{args.outage_hours:g}h of LF without uploads, +20%"
+    if hf_disk and args.capture_hours:
+        new['maxTrainDirKB'] = int(hf_disk * min(args.capture_hours, args.outage_hours) * 3600 * 1.2 / 1024) + 1
+        why['maxTrainDirKB'] = f"{min(args.capture_hours, args.outage_hours):g}h of HF capture, +20%"
+    if args.sd_free_mb:
+        total = new['maxLogDirKB'] + new['maxTrainDirKB']
+        limit = args.sd_free_mb * 1024 * 0.8
+        if total > limit:
+            for key in ('maxLogDirKB', 'maxTrainDirKB'):
+                new[key] = int(new[key] * limit / total)
+                why[key] = why.get(key, '') + f", scaled to fit 80% of {args.sd_free_mb:g}MB SD"
+    return new, why
+
+
+def write_config(path, cfg):
+    """config.txt layout, one value per line in KEYS order (no comments, bbb_logger reads it with fscanf)"""
+    with open(path, 'w') as f:
+        for key in KEYS:
+            f.write(f"{cfg.get(key, DEFAULT_CONFIG[key])}\n")
+
+
+def human(n):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if abs(n) < 1024 or unit == 'GB':
+            return f"{n:.1f}{unit}" if unit != 'B' else f"{n:.0f}B"
+        n /= 1024
+
+
+def duration(s):
+    if s is None:
+        return '-'
+    if s >= 2 * 86400:
+        return f"{s / 86400:.1f} days"
+    if s >= 2 * 3600:
+        return f"{s / 3600:.1f}h"
+    return f"{s / 60:.1f} min" if s >= 120 else f"{s:.0f}s"
+
+
+def print_stats(stats, configured_hz):
+    if not stats.rows:
+        print(f"{stats.name}: no rows")
+        return
+    codec = f", {stats.codec} to {stats.ratio:.2f}x size" if stats.codec else ""
+    print(f"{stats.name}: {stats.files} files, {stats.rows} rows, {human(stats.bytes)} over {duration(stats.seconds)}")
+    print(f"  {stats.row_bytes:.1f} B/row{codec}, {stats.rate:.1f} rows/s achieved ({configured_hz} configured)")
+    for i, stage in enumerate(stats.stage_names):
+        rows, secs = int(stats.stage_rows[i]), float(stats.stage_seconds[i])
+        rate = f"{rows / secs:8.1f} rows/s" if secs else f"{'-':>8s} rows/s"
+        print(f"    {stage:16s} {rows:9d} rows {stats.stage_bytes[i] / rows:6.1f} B/row {rate} "
+              f"{100 * secs / stats.seconds if stats.seconds else 0:5.1f}% of time")
+
+
+def print_report(p, cfg, args):
+    print(f"\nProjection: hiRateHz {cfg['hiRateHz']}, loRateHz {cfg['loRateHz']}, uploads as {args.form}, "
+          f"{args.capture_hours:g}h HF capture a day")
+    print(f"  written to SD  LF {human(p['lf_disk_bps'])}/s, HF {human(p['hf_disk_bps'])}/s while capturing, "
+          f"{human(p['day_disk_bytes'])}/day")
+    print(f"  uploaded       LF {human(p['lf_up_bps'])}/s, HF {human(p['hf_up_bps'])}/s while capturing")
+    print(f"  without uploads logs/ reaches maxLogDirKB in {duration(p['log_cap_s'])}, "
+          f"train/ reaches maxTrainDirKB in {duration(p['train_cap_s'])} of capture")
+    print(f"  a log file closes every {duration(p['log_file_close_s'])} (maxLogFileKB {cfg['maxLogFileKB']})")
+    if 'sd_lf_hours' in p:
+        print(f"  {args.sd_free_mb:g}MB SD holds {duration(p['sd_lf_hours'] * 3600)} of LF, "
+              f"{duration(p['sd_all_hours'] * 3600)} of LF + HF")
+    if 'what_if_bytes' in p:
+        print(f"  {args.what_if_hours:g}h of HF capture: {human(p['what_if_bytes'])} on SD, "
+              f"{human(p['what_if_up_bytes'])} to upload")
+    if p['uplink_bps']:
+        source = 'given' if args.uplink else 'median of upload_stats.csv'
+        print(f"  uplink {human(p['uplink_bps'])}/s ({source}), cron every {args.cron:g}s:")
+        for name, label in (('lf', 'LF only'), ('capture', 'capturing')):
+            state = (f"backlog grows {human(p[f'{name}_backlog_bph'])}/h" if p[f'{name}_util'] >= 1
+                     else f"{p[f'{name}_run_s']:.1f}s upload per run")
+            print(f"    {label:10s} {100 * p[f'{name}_util']:6.1f}% of the uplink, {state}")
+        if p['max_cron_s']:
+            print(f"    longest cron period before logs/ hits its cap: {duration(p['max_cron_s'])}")
+        if 'what_if_up_bytes' in p:
+            print(f"    the {args.what_if_hours:g}h capture takes "
+                  f"{duration(p['what_if_up_bytes'] * (1 + args.overhead / 100) / p['uplink_bps'])} to upload")
+    else:
+        print("  no --uplink and no upload_stats.csv, skipping upload projections")
+    print(f"  per month      {human(p['month_up_bytes'])} to S3, {human(p['month_sim_bytes'])} on the SIM "
+          f"(+{args.overhead:g}% protocol overhead)")
+    if p['s3_free_months']:
+        print(f"  the 5GB S3 free tier lasts {p['s3_free_months']:.1f} months")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure captures and project storage, upload and monthly volume")
+    parser.add_argument('--logs', default='logs', help="LF capture dir")
+    parser.add_argument('--train', default='train', help="HF capture dir")
+    parser.add_argument('--synthetic', type=float, metavar='SECONDS',
+                        help="measure this much offline simulator data instead of the dirs")
+    parser.add_argument('--config', default='config.txt')
+    parser.add_argument('--hi-rate', type=int, help="what-if hiRateHz (default config.txt)")
+    parser.add_argument('--lo-rate', type=int, help="what-if loRateHz (default config.txt)")
+    parser.add_argument('--form', choices=FORMS, default='csv',
+                        help="how upload.py sends files: csv, binary (--binary) or segment (--segment)")
+    parser.add_argument('--capture-hours', type=float, default=None,
+                        help="hours of HF capture a day (default 24 if capture is on, else 0)")
+    parser.add_argument('--uplink', type=float, help="uplink KB/s (default the median of upload_stats.csv)")
+    parser.add_argument('--cron', type=float, default=300, help="seconds between upload runs")
+    parser.add_argument('--overhead', type=float, default=5, help="TCP/TLS/HTTP overhead on the SIM, percent")
+    parser.add_argument('--sd-free-mb', type=float, help="free space on the SD card")
+    parser.add_argument('--what-if-hours', type=float, help="size and upload time of an HF capture this long")
+    parser.add_argument('--outage-hours', type=float, default=24, help="uplink outage the dir caps should ride out")
+    parser.add_argument('--sim-mb-month', type=float, help="SIM data budget, sets the suggested loRateHz")
+    parser.add_argument('--no-compress', action='store_true', help="skip measuring the compression ratio")
+    parser.add_argument('--write-config', metavar='PATH', help="write the suggested config.txt here")
+    args = parser.parse_args()
+
+    cfg = dict(DEFAULT_CONFIG, **(read_config(args.config) or {}))
+    cfg['hiRateHz'] = args.hi_rate or cfg['hiRateHz']
+    cfg['loRateHz'] = args.lo_rate or cfg['loRateHz']
+    if args.capture_hours is None:
+        args.capture_hours = 24.0 if read_capture() else 0.0
+    compress = not args.no_compress
+
+    if args.synthetic:
+        logs, train = synthetic(args.synthetic, cfg, compress=compress)
+    else:
+        logs = scan_dir(args.logs, compress)
+        train = scan_dir(args.train, compress)
+        if not logs.rows and not train.rows:
+            parser.error(f"no rows in {args.logs}/ or {args.train}/, use --synthetic SECONDS")
+    print_stats(logs, cfg['loRateHz'])
+    print_stats(train, cfg['hiRateHz'])
+    # a dir without captures is sized from the other one, rows are the same format at a different rate
+    for missing, other in ((logs, train), (train, logs)):
+        if not missing.rows:
+            print(f"  using {other.name}'s row size and compression for {missing.name}")
+            missing.bytes, missing.rows, missing.compressed, missing.codec = (other.bytes, other.rows,
+                                                                             other.compressed, other.codec)
+
+    p = project(logs, train, cfg, args)
+    print_report(p, cfg, args)
+
+    new, why = suggest(logs, train, cfg, args)
+    print("\nSuggested config.txt:")
+    for key in KEYS[:5]:
+        note = f"  ({why[key]})" if key in why else ""
+        mark = '*' if new[key] != cfg[key] else ' '
+        print(f" {mark}{key:14s} {new[key]:8d}{note}")
+    if args.write_config:
+        write_config(args.write_config, new)
+        print(f"wrote {args.write_config}")
@@ -0,0 +1,27 @@
+"""
+OPC-UA subscription collector, a Python alternative to bbb_logger
+
+bbb_logger (c_src/opc.c) reads the 6 variables with 6 synchronous round trips per sample, which caps
+it well under the link's capacity. This collector creates one monitored item on the machine's
+Snapshot variable (see data_simulator/injection_moulding.py) and lets the server push every
+reading in batches, one publish response per publishing interval, so at 100Hz and 100ms there is
+one round trip per 10 samples. Servers without Snapshot fall back to monitoring the 6 variables.
+
+Writes the same layout as bbb_logger, in the current dir:
+- logs/log_<ts>.csv    LF rows (loRateHz), rotated at maxLogFileKB
+- train/train_<ts>.csv HF rows (hiRateHz) while the capture file is 1
+- row format ts_us,temp,pressure,amplitude,frequency,stage,0
+- status, the latest row and counters (status.py), in place of live_data
+
+Usage (from the dir holding config.txt and capture):
+  python3 -m collector <ip of opcua server> --publish-ms 100 --queue-size 1000
+"""
+
+import os
+import sys
+
+# logger_config.py, storage.py and status.py live next to the package
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from .subscriber import SnapshotHandler, FieldHandler, CountingSubscription, subscribe
+from .writer import LogWriter, format_row
@@ -0,0 +1,110 @@
+import argparse
+import queue
+import signal
+import sys
+import time
+
+from opcua import Client
+
+from logger_config import read_config, read_capture
+from status import StatusWriter
+from .subscriber import subscribe
+from .writer import LogWriter
+
+running = True
+
+
+def on_term(sig, frame):
+    global running
+    running = False
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python3 -m collector",
+                                     description="Log OPC-UA data with a monitored-item subscription")
+    parser.add_argument('server', help="ip of the opcua server")
+    parser.add_argument('--machine', default="InjectionMouldingMachine", help="machine object to log")
+    parser.add_argument('--publish-ms', type=float, default=100, help="publishing interval (ms)")
+    parser.add_argument('--sampling-ms', type=float, default=0, help="sampling interval (ms), 0 = every change")
+    parser.add_argument('--queue-size', type=int, default=1000, help="server side queue per monitored item")
+    parser.add_argument('--config', default='config.txt', help="logger config file")
+    parser.add_argument('--report', type=float, default=10, help="seconds between rate reports")
+    args = parser.parse_args()
+
+    cfg = read_config(args.config)
+    if cfg is None:
+        print(f"Failed to read {args.config}")
+        return 1
+    signal.signal(signal.SIGINT, on_term)
+    signal.signal(signal.SIGTERM, on_term)
+
+    client = Client(f"opc.tcp://{args.server}:4840/freeopcua/server/")
+    client.connect()
+    rows = queue.Queue()
+    writer = LogWriter(cfg)
+    status = StatusWriter()
+    sub, handler = subscribe(client, rows, args.machine, args.publish_ms, args.sampling_ms, args.queue_size)
+    print(f"Subscribed to {args.machine}: publish {args.publish_ms:g}ms, sampling {args.sampling_ms:g}ms, "
+          f"queue {args.queue_size}")
+
+    received = rate_rows = 0
+    read_hz = 0.0
+    last_cfg = last_report = time.monotonic()
+    report_rows, report_publishes = 0, 0
+    try:
+        while running:
+            try:
+                batch = [rows.get(timeout=0.5)]
+            except queue.Empty:
+                batch = []
+            while True:
+                try:
+                    batch.append(rows.get_nowait())
+                except queue.Empty:
+                    break
+
+            now = time.monotonic()
+            if now - last_cfg >= 1.0:
+                # config is re-read every second
+                read_hz = (received - rate_rows) / (now - last_cfg)
+                rate_rows = received
+                cfg = read_config(args.config)
+                if cfg is None:
+                    print(f"{args.config} missing, ending program.")
+                    break
+                writer.cfg = cfg
+                last_cfg = now
+            writer.set_capture(read_capture())
+            if batch:
+                writer.write(batch)
+                received += len(batch)
+                # latest row for predictive_maintain.py and status.py, same record as bbb_logger's
+                ts_us, temp, pressure, amplitude, frequency, stage, label = batch[-1]
+                status.update(ts_us=ts_us, melt_temp=temp, inj_press=pressure, vib_amp=amplitude,
+                              vib_freq=frequency, stage=stage, failure_label=label, rows_read=received,
+                              read_errors=handler.gaps, lf_rows=writer.lf_rows, hf_rows=writer.hf_rows,
+                              read_hz=read_hz, capture=int(writer.train_fp is not None),
+                              hi_rate_hz=cfg['hiRateHz'], lo_rate_hz=cfg['loRateHz'],
+                              max_log_file_kb=cfg['maxLogFileKB'], max_log_dir_kb=cfg['maxLogDirKB'],
+                              max_train_dir_kb=cfg['maxTrainDirKB'])
+
+            if now - last_report >= args.report:
+                elapsed = now - last_report
+                n, p = received - report_rows, sub.publishes - report_publishes
+                print(f"{n / elapsed:.1f} samples/s in {p / elapsed:.1f} publishes/s "
+                      f"({n / max(p, 1):.1f} samples per round trip), {handler.gaps} dropped, "
+                      f"lf {writer.lf_rows} hf {writer.hf_rows} rows")
+                report_rows, report_publishes, last_report = received, sub.publishes, now
+    finally:
+        writer.close()
+        status.close()
+        try:
+            sub.delete()
+            client.disconnect()
+        except Exception as e:
+            print(f"disconnect failed: {e}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
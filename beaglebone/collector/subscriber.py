@@ -0,0 +1,107 @@
+"""
+Monitored-item subscription that turns data change notifications into logger rows
+
+Notifications arrive on the opcua client's receive thread, the handlers only decode and put rows on
+a queue.Queue, writing is done by the main thread (see __main__.py).
+"""
+
+from opcua import ua
+from opcua.common.subscription import Subscription
+
+# same as SNAPSHOT_FIELDS / SNAPSHOT_STAGES in data_simulator/injection_moulding.py
+SNAPSHOT_FIELDS = ["Sequence", "Timestamp", "MeltTemp", "InjectionPressure", "VibrationAmplitude",
+                   "VibrationFrequency", "StageCode"]
+STAGES = ["PreInjection", "Injection", "Holding", "Cooling", "Waiting", "PartReplacement"]
+VARIABLES = ["MeltTemp", "InjectionPressure", "VibrationAmplitude", "VibrationFrequency", "Stage", "Timestamp"]
+
+
+class SnapshotHandler:
+    """
+    one row per Snapshot notification, always consistent
+    - gaps counts readings the Sequence skipped (server queue overflowed, raise --queue-size)
+    """
+    def __init__(self, rows):
+        self.rows = rows
+        self.last_seq = None
+        self.gaps = 0
+
+    def datachange_notification(self, node, val, data):
+        seq = int(val[0])
+        if self.last_seq is not None and seq > self.last_seq + 1:
+            self.gaps += seq - self.last_seq - 1
+        self.last_seq = seq
+        # (ts_us, temp, pressure, amplitude, frequency, stage, failure label)
+        self.rows.put((int(val[1] * 1e6), val[2], val[3], val[4], val[5], STAGES[int(val[6])], 0))
+
+
+class FieldHandler:
+    """
+    fallback for servers without Snapshot, a row is emitted on every Timestamp change using the
+    latest value of the other variables (can tear like bbb_logger's reads)
+    """
+    def __init__(self, rows, nodes):
+        self.rows = rows
+        self.names = {node.nodeid: name for name, node in nodes.items()}
+        self.latest = {name: 0.0 for name in VARIABLES}
+        self.latest["Stage"] = ""
+        self.gaps = 0
+
+    def datachange_notification(self, node, val, data):
+        name = self.names.get(node.nodeid)
+        self.latest[name] = val
+        if name == "Timestamp":
+            v = self.latest
+            self.rows.put((int(val * 1e6), v["MeltTemp"], v["InjectionPressure"], v["VibrationAmplitude"],
+                           v["VibrationFrequency"], v["Stage"], 0))
+
+
+class CountingSubscription(Subscription):
+    """Subscription that counts publish responses (= round trips) and notifications"""
+    def __init__(self, server, params, handler):
+        self.publishes = 0
+        super().__init__(server, params, handler)
+
+    def publish_callback(self, publishresult):
+        self.publishes += 1
+        super().publish_callback(publishresult)
+
+
+def find_machine(client, name):
+    for child in client.get_objects_node().get_children():
+        if child.get_display_name().Text == name:
+            return child
+    raise LookupError(f"no {name} object on the server")
+
+
+def subscribe(client, rows, machine="InjectionMouldingMachine", publish_ms=100, sampling_ms=0, queue_size=1000):
+    """
+    subscribe to one machine, rows go onto the `rows` queue, returns (subscription, handler)
+    - publish_ms: how often the server sends a batch
+    - sampling_ms: requested sampling interval, 0 = every change
+    - queue_size: notifications the server keeps per item between publishes, needs to be at least
+      rate * publish_ms / 1000 or readings are dropped
+    """
+    children = {c.get_display_name().Text: c for c in find_machine(client, machine).get_children()}
+    if "Snapshot" in children:
+        handler = SnapshotHandler(rows)
+        nodes = [children["Snapshot"]]
+    else:
+        print("server has no Snapshot variable, monitoring the individual variables")
+        handler = FieldHandler(rows, {name: children[name] for name in VARIABLES})
+        # Timestamp last so it follows the other values in each publish
+        nodes = [children[name] for name in VARIABLES]
+
+    params = ua.CreateSubscriptionParameters()
+    params.RequestedPublishingInterval = publish_ms
+    params.RequestedLifetimeCount = 10000
+    params.RequestedMaxKeepAliveCount = 3000
+    params.MaxNotificationsPerPublish = 0 # no limit
+    params.PublishingEnabled = True
+    params.Priority = 0
+    sub = CountingSubscription(client.uaclient, params, handler)
+    handles = sub.subscribe_data_change(nodes, queuesize=queue_size)
+    if sampling_ms != publish_ms:
+        # python-opcua requests the publishing interval as the sampling interval, set ours instead
+        for handle in handles:
+            sub.modify_monitored_item(handle, sampling_ms, queue_size)
+    return sub, handler
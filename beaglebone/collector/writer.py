@@ -0,0 +1,88 @@
+"""
+Writes rows in bbb_logger's logs/ and train/ layout
+"""
+
+import os
+import time
+
+import storage
+
+ROW_FORMAT = "%d,%.2f,%.2f,%.2f,%.2f,%s,%u\n"
+
+
+def format_row(row):
+    return ROW_FORMAT % row
+
+
+class LogWriter:
+    """
+    - LF: one row per 1/loRateHz of sample time into logs/, rotated at maxLogFileKB
+    - HF: one row per 1/hiRateHz of sample time into train/ while capturing (no size cap, same as bbb_logger)
+    Decimation is by the sample timestamps rather than by counting reads, so it gives the configured
+    rates whatever rate the server publishes at.
+    Closed files go into the storage index and the dir caps are enforced on every rotation.
+    """
+    def __init__(self, cfg, base="."):
+        self.base = base
+        self.cfg = cfg
+        for d in ("logs", "train"):
+            os.makedirs(os.path.join(base, d), exist_ok=True)
+        self.log_fp = self.rotate("logs", "log")
+        self.train_fp = None
+        self.lf_slot = self.hf_slot = None
+        self.lf_rows = self.hf_rows = 0
+
+    def rotate(self, directory, prefix):
+        """open a new <dir>/<prefix>_<ts>.csv, never reusing a name within the same second"""
+        ts = int(time.time())
+        while os.path.exists(os.path.join(self.base, directory, f"{prefix}_{ts}.csv")):
+            ts += 1
+        return open(os.path.join(self.base, directory, f"{prefix}_{ts}.csv"), "w")
+
+    def closed(self, fp):
+        fp.close()
+        directory = os.path.dirname(fp.name)
+        storage.get_index(directory).add(fp.name)
+        storage.enforce_cap(directory, self.cfg)
+
+    def set_capture(self, cap):
+        if cap and not self.train_fp:
+            self.train_fp = self.rotate("train", "train")
+            print("Started train capture, writing to train folder.")
+        elif not cap and self.train_fp:
+            self.closed(self.train_fp)
+            self.train_fp = None
+            print("Stopped train capture")
+
+    def write(self, rows):
+        """write a batch, one flush per file per batch"""
+        lf_period = 1e6 / self.cfg["loRateHz"]
+        hf_period = 1e6 / self.cfg["hiRateHz"]
+        lf, hf = [], []
+        for row in rows:
+            slot = int(row[0] // lf_period)
+            if slot != self.lf_slot:
+                self.lf_slot = slot
+                lf.append(format_row(row))
+            if self.train_fp:
+                slot = int(row[0] // hf_period)
+                if slot != self.hf_slot:
+                    self.hf_slot = slot
+                    hf.append(format_row(row))
+        if lf:
+            self.log_fp.write("".join(lf))
+            self.log_fp.flush()
+            self.lf_rows += len(lf)
+            if self.log_fp.tell() // 1024 >= self.cfg["maxLogFileKB"]:
+                self.closed(self.log_fp)
+                self.log_fp = self.rotate("logs", "log")
+                print(f"Rotated LOG file as size reached {self.cfg['maxLogFileKB']}KB")
+        if hf:
+            self.train_fp.write("".join(hf))
+            self.train_fp.flush()
+            self.hf_rows += len(hf)
+
+    def close(self):
+        self.closed(self.log_fp)
+        if self.train_fp:
+            self.closed(self.train_fp)
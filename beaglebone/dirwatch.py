@@ -0,0 +1,74 @@
+"""
+Minimal inotify wrapper (ctypes, no extra packages on the BBB) for picking up finished logger files
+
+Only close-after-write and rename-into events are watched:
+- the logger closes a csv when it rotates, so IN_CLOSE_WRITE means the file is complete
+- hfbin.py and segment.py write a .tmp and os.replace() it, which shows up as IN_MOVED_TO
+"""
+
+import ctypes
+import ctypes.util
+import os
+import struct
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_Q_OVERFLOW = 0x00004000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+
+EVENT = struct.Struct('iIII')  # wd, mask, cookie, name length
+
+
+class DirWatcher:
+    """
+    watches dirs for finished files, fd can be handed to select/asyncio add_reader
+    read_events() returns (paths, overflowed), on overflow the caller should rescan the dirs
+    """
+    def __init__(self, dirs):
+        libc_name = ctypes.util.find_library('c')
+        self.libc = ctypes.CDLL(libc_name, use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.wds = {}
+        for d in dirs:
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(d), IN_CLOSE_WRITE | IN_MOVED_TO)
+            if wd < 0:
+                err = ctypes.get_errno()
+                self.close()
+                raise OSError(err, f"inotify_add_watch {d} failed")
+            self.wds[wd] = d
+
+    def read_events(self):
+        paths = []
+        overflowed = False
+        while True:
+            try:
+                buf = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            pos = 0
+            while pos + EVENT.size <= len(buf):
+                wd, mask, _cookie, length = EVENT.unpack_from(buf, pos)
+                name = buf[pos + EVENT.size:pos + EVENT.size + length].rstrip(b'\0')
+                pos += EVENT.size + length
+                if mask & IN_Q_OVERFLOW:
+                    overflowed = True
+                elif name and wd in self.wds:
+                    paths.append(os.path.join(self.wds[wd], os.fsdecode(name)))
+        return paths, overflowed
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+def open_watcher(dirs):
+    """DirWatcher, or None where inotify isn't available (the caller falls back to polling)"""
+    try:
+        return DirWatcher(dirs)
+    except (OSError, AttributeError, TypeError) as e:
+        print(f"inotify unavailable ({e}), falling back to polling")
+        return None
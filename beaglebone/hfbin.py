@@ -0,0 +1,154 @@
+"""
+Fixed width binary format for HF/LF captures (.hfb)
+
+The CSV rows the logger writes are ~55 bytes of text each and have to be parsed back float by float.
+The same row in this format is 25 bytes and loads with np.memmap / np.fromfile without any parsing.
+
+Layout (little-endian):
+  header, 128 bytes
+    4s   magic b'HFB1'
+    u16  format version
+    u16  record size (25)
+    u8   number of stage names
+    7x   reserved
+    112s stage names, ',' separated and NUL padded, the u8 stage code indexes this list
+  records, 25 bytes each, no padding
+    u64  timestamp (us)
+    f32  temp, pressure, amplitude, frequency
+    u8   stage code
+
+The logger's last csv column (failure label, always 0) is not stored.
+
+Usage:
+  python hfbin.py train/train_1745973055.csv            # writes train/train_1745973055.hfb
+  python hfbin.py --dir train --delete                   # convert every closed csv in train/
+"""
+
+import argparse
+import csv
+import glob
+import os
+import struct
+import numpy as np
+
+MAGIC = b'HFB1'
+VERSION = 1
+HEADER = struct.Struct('<4sHHB7x112s')
+HEADER_SIZE = HEADER.size  # 128
+
+RECORD_DTYPE = np.dtype([
+    ('timestamp', '<u8'),
+    ('temp', '<f4'),
+    ('pressure', '<f4'),
+    ('amplitude', '<f4'),
+    ('frequency', '<f4'),
+    ('stage', 'u1'),
+])
+STAGES = ['PreInjection', 'Injection', 'Holding', 'Cooling', 'Waiting', 'PartReplacement']
+EXT = '.hfb'
+
+
+def pack_header(stages=STAGES):
+    table = ','.join(stages).encode('ascii')
+    if len(table) > 112 or len(stages) > 255:
+        raise ValueError("stage table does not fit in the header")
+    return HEADER.pack(MAGIC, VERSION, RECORD_DTYPE.itemsize, len(stages), table)
+
+
+def unpack_header(buf):
+    magic, version, record_size, n_stages, table = HEADER.unpack(buf[:HEADER_SIZE])
+    if magic != MAGIC:
+        raise ValueError("not an hfb file")
+    if version != VERSION or record_size != RECORD_DTYPE.itemsize:
+        raise ValueError(f"unsupported hfb version {version} / record size {record_size}")
+    stages = table.rstrip(b'\0').decode('ascii').split(',') if n_stages else []
+    return stages
+
+
+def read(path, mmap=True):
+    """(records, stage names), records is a zero copy memmap unless mmap=False"""
+    with open(path, 'rb') as f:
+        stages = unpack_header(f.read(HEADER_SIZE))
+        if not mmap:
+            return np.fromfile(f, dtype=RECORD_DTYPE), stages
+    n = (os.path.getsize(path) - HEADER_SIZE) // RECORD_DTYPE.itemsize
+    if n == 0:
+        return np.zeros(0, dtype=RECORD_DTYPE), stages
+    return np.memmap(path, dtype=RECORD_DTYPE, mode='r', offset=HEADER_SIZE, shape=(n,)), stages
+
+
+def write(path, records, stages=STAGES):
+    """write a structured array of RECORD_DTYPE, via a temp file so readers never see half a file"""
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(pack_header(stages))
+        np.asarray(records, dtype=RECORD_DTYPE).tofile(f)
+    os.replace(tmp, path)
+
+
+def records_from_rows(rows, stages=STAGES):
+    """logger csv rows (lists of strings) -> records, unknown stages are added to the stage list"""
+    codes = {s: i for i, s in enumerate(stages)}
+    rec = np.zeros(len(rows), dtype=RECORD_DTYPE)
+    for i, r in enumerate(rows):
+        stage = r[5]
+        if stage not in codes:
+            codes[stage] = len(stages)
+            stages.append(stage)
+        rec[i] = (int(r[0]), float(r[1]), float(r[2]), float(r[3]), float(r[4]), codes[stage])
+    return rec
+
+
+def convert_csv(src, dst=None, chunk_rows=50_000):
+    """convert one logger csv to hfb, returns the output path"""
+    dst = dst or os.path.splitext(src)[0] + EXT
+    stages = list(STAGES)
+    tmp = dst + '.tmp'
+    parts = []
+    with open(src, newline='') as f:
+        rows = []
+        for r in csv.reader(f):
+            if len(r) < 6:
+                continue # partial last line
+            rows.append(r)
+            if len(rows) >= chunk_rows:
+                parts.append(records_from_rows(rows, stages))
+                rows = []
+        parts.append(records_from_rows(rows, stages))
+    # the header needs the final stage table so it is written after all rows are parsed
+    with open(tmp, 'wb') as out:
+        out.write(pack_header(stages))
+        for p in parts:
+            p.tofile(out)
+    os.replace(tmp, dst)
+    return dst
+
+
+def to_csv_lines(records, stages):
+    """records -> csv text in the logger's row format (for tools that only speak csv)"""
+    for r in records:
+        yield (f"{int(r['timestamp'])},{r['temp']:.2f},{r['pressure']:.2f},{r['amplitude']:.2f},"
+               f"{r['frequency']:.2f},{stages[r['stage']]},0\n")
+
+
+def closed_csv_files(directory):
+    """every csv in the dir except the newest, which the logger may still be writing"""
+    files = sorted(glob.glob(os.path.join(directory, '*.csv')), key=os.path.getmtime)
+    return files[:-1]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert logger csv files to the binary hfb format")
+    parser.add_argument('csv', nargs='*', help="csv files to convert")
+    parser.add_argument('--dir', help="convert every closed csv in this dir (skips the newest file)")
+    parser.add_argument('--delete', action='store_true', help="remove each csv once it is converted")
+    args = parser.parse_args()
+
+    files = list(args.csv)
+    if args.dir:
+        files += closed_csv_files(args.dir)
+    for src in files:
+        dst = convert_csv(src)
+        print(f"{src} ({os.path.getsize(src)} B) -> {dst} ({os.path.getsize(dst)} B)")
+        if args.delete:
+            os.remove(src)
@@ -0,0 +1,25 @@
+"""
+The logger's config.txt, shared by the Python tools (upload.py, collector)
+
+One int per line, same order as the Config struct in c_src/main.c.
+"""
+
+KEYS = ['hiRateHz', 'loRateHz', 'maxLogFileKB', 'maxLogDirKB', 'maxTrainDirKB', 'captureSeconds', 'captureEnabled']
+
+
+def read_config(path='config.txt'):
+    """{key: int}, None if missing or malformed"""
+    try:
+        with open(path) as f:
+            return dict(zip(KEYS, (int(line.split()[0]) for line in f if line.strip())))
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def read_capture(path='capture'):
+    """the capture flag file (0 or 1), missing counts as off"""
+    try:
+        with open(path) as f:
+            return int(f.read().split()[0]) != 0
+    except (OSError, ValueError, IndexError):
+        return False
@@ -0,0 +1,383 @@
+"""
+Counters, gauges and latency histograms for the Python services, exported in the Prometheus text format
+
+predictive_maintain.py and upload.py only printed, so there was no way to tell whether inference was
+falling behind or where the time went. Metrics here are plain objects created once at import time, so
+the hot path is an attribute update under a lock (~0.5us, ~1.5us for a timed block), no name lookups:
+  ROWS = metrics.counter('predict_rows_total', "rows scored")
+  ROWS.inc(len(rows))
+  with metrics.histogram('predict_stage_seconds', "time per stage", stage='read').time():
+      ...
+Export, both optional and from one background thread:
+- a text file rewritten atomically every `interval` seconds, for node_exporter's textfile collector
+  or just `cat` (a cron run of upload.py writes it once at exit)
+- a local HTTP endpoint, GET /metrics (and /profile, below)
+
+Sampling profiler, switched on and off at runtime without a restart:
+  kill -USR2 <pid>        # start, again to stop and write profile_<name>_<pid>_<time>.folded
+  curl localhost:<port>/profile?seconds=10
+It samples every thread's stack on a CPU-time timer (SIGPROF, 100Hz, so an idle process costs nothing)
+and writes folded stacks, one `frame;frame;frame count` line each, for flamegraph.pl or speedscope.
+
+Usage (print the current metrics of a running service):
+  cat predict_metrics.prom
+  python3 metrics.py --port 9101
+"""
+
+import argparse
+import bisect
+import collections
+import os
+import resource
+import signal
+import sys
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+# seconds, 100us to a minute, covers a NumPy batch as well as an SMTP send or a multipart upload
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+EXPORT_INTERVAL = 10     # seconds between text file writes
+PROFILE_HZ = 100
+PROFILE_SIGNAL = signal.SIGUSR2
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in labels)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(labels, escaped)) + '}'
+
+
+def format_value(v):
+    if v == float('inf'):
+        return '+Inf'
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, labels=()):
+        self.labels = labels
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, n=1):
+        with self.lock:
+            self.value += n
+
+    def samples(self, name):
+        return [(name, self.labels, self.value)]
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def set(self, v):
+        self.value = v  # a single store, no lock needed
+
+    def dec(self, n=1):
+        self.inc(-n)
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, labels=(), buckets=LATENCY_BUCKETS):
+        self.labels = labels
+        self.bounds = tuple(buckets)
+        self.counts = [0] * (len(self.bounds) + 1)  # last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def observe(self, v):
+        i = bisect.bisect_left(self.bounds, v)
+        with self.lock:
+            self.counts[i] += 1
+            self.sum += v
+            self.count += 1
+
+    def time(self):
+        """context manager observing the seconds spent in its block (also when it raises)"""
+        return Timer(self)
+
+    def samples(self, name):
+        with self.lock:
+            counts, total, count = list(self.counts), self.sum, self.count
+        out, cumulative = [], 0
+        for bound, n in zip(self.bounds + (float('inf'),), counts):
+            cumulative += n
+            out.append((name + '_bucket', self.labels + (('le', format_value(float(bound))),), cumulative))
+        out.append((name + '_sum', self.labels, total))
+        out.append((name + '_count', self.labels, count))
+        return out
+
+
+class Timer:
+    __slots__ = ('histogram', 'start')
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start)
+        return False
+
+
+class Registry:
+    """
+    every metric by (name, labels), created on first use and returned as-is after that
+    - on_collect callbacks run before each render, for values that are cheaper to read than to track
+      (queue depths, dir usage, another object's counts)
+    """
+    def __init__(self):
+        self.metrics = {}
+        self.help = {}
+        self.callbacks = []
+        self.lock = threading.Lock()
+
+    def get(self, cls, name, help, labels, **kwargs):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            metric = self.metrics.get(key)
+            if metric is None:
+                metric = self.metrics[key] = cls(key[1], **kwargs)
+                self.help.setdefault(name, (cls.kind, help))
+            elif type(metric) is not cls:
+                raise ValueError(f"{name} is already a {metric.kind}")
+        return metric
+
+    def counter(self, name, help='', **labels):
+        return self.get(Counter, name, help, labels)
+
+    def gauge(self, name, help='', **labels):
+        return self.get(Gauge, name, help, labels)
+
+    def histogram(self, name, help='', buckets=LATENCY_BUCKETS, **labels):
+        return self.get(Histogram, name, help, labels, buckets=buckets)
+
+    def on_collect(self, fn):
+        self.callbacks.append(fn)
+        return fn
+
+    def render(self):
+        """the Prometheus text exposition format"""
+        for fn in self.callbacks:
+            try:
+                fn()
+            except Exception as e:
+                print(f"Metrics callback {getattr(fn, '__name__', fn)} failed: {e}")
+        with self.lock:
+            by_name = collections.defaultdict(list)
+            for (name, _), metric in self.metrics.items():
+                by_name[name].append(metric)
+            help = dict(self.help)
+        lines = []
+        for name in sorted(by_name):
+            kind, text = help[name]
+            lines.append(f"# HELP {name} {text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for metric in by_name[name]:
+                for sample, labels, value in metric.samples(name):
+                    lines.append(f"{sample}{format_labels(labels)} {format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+    def write_textfile(self, path):
+        """rendered to a temp file and renamed into place, a reader never sees half of it"""
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, 'w') as f:
+            f.write(self.render())
+        os.replace(tmp, path)
+
+
+REGISTRY = Registry()
+counter = REGISTRY.counter
+gauge = REGISTRY.gauge
+histogram = REGISTRY.histogram
+on_collect = REGISTRY.on_collect
+render = REGISTRY.render
+write_textfile = REGISTRY.write_textfile
+
+PROCESS_CPU = counter('process_cpu_seconds_total', "user + system CPU seconds of this process")
+PROCESS_RSS = gauge('process_max_resident_memory_bytes', "peak resident memory of this process")
+PROCESS_START = gauge('process_start_time_seconds', "unix time this process started")
+PROCESS_START.set(time.time())
+
+
+@on_collect
+def process_usage():
+    ru = resource.getrusage(resource.RUSAGE_SELF)
+    PROCESS_CPU.value = ru.ru_utime + ru.ru_stime  # the kernel's count, not incremented here
+    PROCESS_RSS.set(ru.ru_maxrss * 1024)  # KB on Linux
+
+
+class Profiler:
+    """
+    sampling profiler on a CPU-time timer, see the module docstring
+    - install() must run on the main thread (signal handlers), start/stop can be called from any thread
+    """
+    def __init__(self, name, hz=PROFILE_HZ, out_dir='.'):
+        self.name = name
+        self.interval = 1.0 / hz
+        self.out_dir = out_dir
+        self.stacks = collections.Counter()
+        self.running = False
+        self.started = None
+        self.lock = threading.Lock()
+
+    def install(self, toggle_signal=PROFILE_SIGNAL):
+        signal.signal(signal.SIGPROF, self.sample)
+        if toggle_signal is not None:
+            signal.signal(toggle_signal, lambda signum, frame: self.toggle())
+        return self
+
+    def sample(self, signum, frame):
+        frames = sys._current_frames()
+        frames[threading.main_thread().ident] = frame  # the interrupted one, not this handler
+        for thread_frame in frames.values():
+            stack = []
+            f = thread_frame
+            while f is not None:
+                stack.append(f"{f.f_code.co_name} ({os.path.basename(f.f_code.co_filename)})")
+                f = f.f_back
+            self.stacks[';'.join(reversed(stack))] += 1
+
+    def start(self):
+        with self.lock:
+            if self.running:
+                return False
+            self.stacks = collections.Counter()
+            self.started = time.time()
+            self.running = True
+            signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+        return True
+
+    def stop(self):
+        """stop sampling, returns the folded stacks text"""
+        with self.lock:
+            signal.setitimer(signal.ITIMER_PROF, 0, 0)
+            self.running = False
+            stacks, self.stacks = self.stacks, collections.Counter()
+        return ''.join(f"{stack} {n}\n" for stack, n in stacks.most_common())
+
+    def toggle(self):
+        if self.start():
+            print(f"Profiler on, send signal {int(PROFILE_SIGNAL)} again to stop")
+            return
+        # the file is written from a thread, the signal handler only flips the timer
+        text = self.stop()
+        path = os.path.join(self.out_dir, f"profile_{self.name}_{os.getpid()}_{int(self.started)}.folded")
+        threading.Thread(target=self.save, args=(path, text), daemon=True).start()
+
+    def save(self, path, text):
+        with open(path, 'w') as f:
+            f.write(text)
+        print(f"Profiler off, wrote {path} ({sum(int(line.rsplit(' ', 1)[1]) for line in text.splitlines())} samples)")
+
+    def profile(self, seconds):
+        """sample for `seconds` (blocks the calling thread), returns the folded stacks"""
+        if not self.start():
+            return None
+        time.sleep(seconds)
+        return self.stop()
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, fmt, *args):
+        pass
+
+    def reply(self, status, text):
+        body = text.encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        exporter = self.server.exporter
+        if url.path == '/metrics':
+            self.reply(200, exporter.registry.render())
+        elif url.path == '/profile':
+            if exporter.profiler is None:
+                self.reply(404, "profiler not installed\n")
+                return
+            seconds = float(parse_qs(url.query).get('seconds', ['10'])[0])
+            text = exporter.profiler.profile(min(seconds, 300))
+            if text is None:
+                self.reply(409, "profiler already running\n")
+            else:
+                self.reply(200, text)
+        else:
+            self.reply(404, "try /metrics or /profile?seconds=10\n")
+
+
+class Exporter:
+    """writes the text file every interval and/or serves it over HTTP, close() writes it a last time"""
+    def __init__(self, path=None, port=None, interval=EXPORT_INTERVAL, registry=REGISTRY, profiler=None,
+                 host='127.0.0.1'):
+        self.path = path
+        self.interval = interval
+        self.registry = registry
+        self.profiler = profiler
+        self.stopping = threading.Event()
+        self.server = None
+        if port is not None:
+            self.server = ThreadingHTTPServer((host, port), MetricsHandler)
+            self.server.daemon_threads = True
+            self.server.exporter = self
+            threading.Thread(target=self.server.serve_forever, name='metrics-http', daemon=True).start()
+        self.thread = None
+        if path:
+            self.thread = threading.Thread(target=self.run, name='metrics', daemon=True)
+            self.thread.start()
+
+    def write(self):
+        try:
+            self.registry.write_textfile(self.path)
+        except OSError as e:
+            print(f"Metrics not written: {e}")
+
+    def run(self):
+        while not self.stopping.wait(self.interval):
+            self.write()
+
+    def close(self):
+        self.stopping.set()
+        if self.thread:
+            self.thread.join()
+            self.write()
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+
+
+def start(name, path=None, port=None, interval=EXPORT_INTERVAL, profile=True):
+    """the usual setup for a service: profiler on SIGUSR2 (main thread only), export thread"""
+    profiler = None
+    if profile and threading.current_thread() is threading.main_thread():
+        profiler = Profiler(name).install()
+    return Exporter(path, port, interval, profiler=profiler)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Print a running service's metrics")
+    parser.add_argument('--port', type=int, required=True, help="the service's --metrics-port")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--grep', help="only lines containing this")
+    args = parser.parse_args()
+
+    with urllib.request.urlopen(f"http://{args.host}:{args.port}/metrics", timeout=5) as resp:
+        for line in resp.read().decode().splitlines():
+            if not args.grep or args.grep in line:
+                print(line)
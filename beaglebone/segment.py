@@ -0,0 +1,162 @@
+"""
+Compressed segment files: many closed logger files packed into one S3 object
+
+Each rotated 15KB log file used to be its own PUT. A segment holds every file closed since the last
+upload run, each compressed on its own so any one of them can be pulled back out with a ranged GET.
+
+Layout:
+  8 bytes   b'SEG1', codec (u8: 0 = gzip, 1 = zstd), 3 reserved
+  members   each original file compressed independently, back to back
+  index     json {"codec": ..., "files": [{"name", "offset", "length", "size", "mtime"}, ...]}
+  12 bytes  u64 index length, b'SIDX'
+
+zstd is used when the zstandard package is installed, gzip otherwise.
+
+Usage:
+  python segment.py list logs/logs_1745973055_1745973355.seg
+  python segment.py extract logs/logs_1745973055_1745973355.seg log_1745973055.csv
+  python segment.py extract s3://bucket/logs_1745973055_1745973355.seg log_1745973055.csv -o out.csv
+"""
+
+import argparse
+import gzip
+import json
+import os
+import re
+import struct
+import sys
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+MAGIC = b'SEG1'
+INDEX_MAGIC = b'SIDX'
+HEADER = struct.Struct('<4sB3x')
+TRAILER = struct.Struct('<Q4s')
+GZIP, ZSTD = 0, 1
+EXT = '.seg'
+
+
+def compress(data, codec):
+    if codec == ZSTD:
+        return zstandard.ZstdCompressor(level=10).compress(data)
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+
+def decompress(data, codec):
+    if codec == ZSTD:
+        if zstandard is None:
+            raise RuntimeError("segment is zstd compressed, pip install zstandard")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return gzip.decompress(data)
+
+
+def file_ts(path):
+    """unix time the logger put in the file name (log_<ts>.csv), falls back to mtime"""
+    m = re.search(r'_(\d+)\.\w+$', path)
+    return int(m.group(1)) if m else int(os.path.getmtime(path))
+
+
+def segment_name(directory, files):
+    """<dir>_<first ts>_<last ts>.seg, so segments sort and can be looked up by time range"""
+    times = [file_ts(p) for p in files]
+    return f"{os.path.basename(os.path.normpath(directory))}_{min(times)}_{max(times)}{EXT}"
+
+
+def pack(files, out_path, codec=None):
+    """write a segment of files, returns the index. Written via a temp file and fsynced so the
+    originals can be deleted as soon as this returns."""
+    codec = (ZSTD if zstandard else GZIP) if codec is None else codec
+    tmp = out_path + '.tmp'
+    entries = []
+    with open(tmp, 'wb') as out:
+        out.write(HEADER.pack(MAGIC, codec))
+        for path in files:
+            with open(path, 'rb') as f:
+                raw = f.read()
+            blob = compress(raw, codec)
+            entries.append({'name': os.path.basename(path), 'offset': out.tell(), 'length': len(blob),
+                            'size': len(raw), 'mtime': os.path.getmtime(path)})
+            out.write(blob)
+        index = {'codec': codec, 'files': entries}
+        data = json.dumps(index, separators=(',', ':')).encode()
+        out.write(data)
+        out.write(TRAILER.pack(len(data), INDEX_MAGIC))
+        out.flush()
+        os.fsync(out.fileno())
+    os.replace(tmp, out_path)
+    return index
+
+
+class SegmentReader:
+    """
+    Reads a segment through a read_range(offset, length) callable so the same code works on a local
+    file and on an S3 object (ranged GETs, only the trailer, index and one member are downloaded).
+    """
+    def __init__(self, read_range, total_size):
+        self.read_range = read_range
+        trailer = read_range(total_size - TRAILER.size, TRAILER.size)
+        index_len, magic = TRAILER.unpack(trailer)
+        if magic != INDEX_MAGIC:
+            raise ValueError("not a segment file")
+        self.index = json.loads(read_range(total_size - TRAILER.size - index_len, index_len))
+        self.codec = self.index['codec']
+
+    @classmethod
+    def open_local(cls, path):
+        def read_range(offset, length):
+            with open(path, 'rb') as f:
+                f.seek(offset)
+                return f.read(length)
+        return cls(read_range, os.path.getsize(path))
+
+    @classmethod
+    def open_s3(cls, client, bucket, key):
+        def read_range(offset, length):
+            resp = client.get_object(Bucket=bucket, Key=key, Range=f"bytes={offset}-{offset + length - 1}")
+            return resp['Body'].read()
+        return cls(read_range, client.head_object(Bucket=bucket, Key=key)['ContentLength'])
+
+    def names(self):
+        return [e['name'] for e in self.index['files']]
+
+    def read(self, name):
+        for e in self.index['files']:
+            if e['name'] == name:
+                return decompress(self.read_range(e['offset'], e['length']), self.codec)
+        raise KeyError(name)
+
+
+def open_segment(location):
+    """local path or s3://bucket/key"""
+    if location.startswith('s3://'):
+        import boto3
+        bucket, key = location[5:].split('/', 1)
+        return SegmentReader.open_s3(boto3.client('s3', endpoint_url=os.getenv('S3_ENDPOINT_URL')), bucket, key)
+    return SegmentReader.open_local(location)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="List or extract files from an upload segment")
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    p_list = sub.add_parser('list')
+    p_list.add_argument('segment', help="local path or s3://bucket/key")
+    p_ext = sub.add_parser('extract')
+    p_ext.add_argument('segment', help="local path or s3://bucket/key")
+    p_ext.add_argument('name', help="original file name, eg log_1745973055.csv")
+    p_ext.add_argument('-o', '--output', help="output path (default: stdout)")
+    args = parser.parse_args()
+
+    seg = open_segment(args.segment)
+    if args.cmd == 'list':
+        for e in seg.index['files']:
+            print(f"{e['name']:32s} {e['size']:>10d} B -> {e['length']:>8d} B")
+    else:
+        data = seg.read(args.name)
+        if args.output:
+            with open(args.output, 'wb') as f:
+                f.write(data)
+        else:
+            sys.stdout.buffer.write(data)
@@ -0,0 +1,123 @@
+"""
+Reader (and Python writer) for the logger's status record
+
+bbb_logger keeps the latest row and its counters in the 168 byte file `status` (c_src/status.h),
+mmap'd and updated in place on every sample. Reading it is one memory copy, no text parsing and no
+file syscalls after the first open. live_data is now only the human view, rendered at 5Hz.
+
+Consistency is a seqlock: the writer makes `seq` odd, updates the fields, then makes it even
+again. A reader copies the record and retries if `seq` was odd or changed during the copy.
+
+Usage:
+  python3 status.py            # print the current record
+  python3 status.py --watch    # print it 5 times a second
+"""
+
+import argparse
+import mmap
+import os
+import struct
+import time
+
+# keep in sync with StatusRecord in c_src/status.h
+RECORD = struct.Struct('<IIIIQddddQQQQQdiiiiiiii32s')
+FIELDS = ['magic', 'version', 'seq', 'size', 'ts_us', 'melt_temp', 'inj_press', 'vib_amp', 'vib_freq',
+          'updated_us', 'rows_read', 'read_errors', 'lf_rows', 'hf_rows', 'read_hz', 'hi_rate_hz',
+          'lo_rate_hz', 'max_log_file_kb', 'max_log_dir_kb', 'max_train_dir_kb', 'capture', 'failure_label',
+          'reserved', 'stage']
+MAGIC = 0x31545342  # "BST1"
+VERSION = 1
+SEQ = struct.Struct('<I')
+SEQ_OFFSET = 8
+
+
+class StatusReader:
+    """consistent snapshots of the status record"""
+    def __init__(self, path='status'):
+        with open(path, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), RECORD.size, access=mmap.ACCESS_READ)
+
+    def read(self, retries=1000):
+        """dict of FIELDS (stage as str), None if the logger hasn't written a record yet"""
+        for _ in range(retries):
+            seq = SEQ.unpack_from(self.mm, SEQ_OFFSET)[0]
+            if seq & 1:
+                time.sleep(0) # writer is mid update
+                continue
+            data = self.mm[:RECORD.size]
+            if SEQ.unpack_from(self.mm, SEQ_OFFSET)[0] != seq:
+                continue
+            rec = dict(zip(FIELDS, RECORD.unpack(data)))
+            if rec['magic'] != MAGIC or rec['version'] != VERSION:
+                return None
+            rec['stage'] = rec['stage'].split(b'\0', 1)[0].decode(errors='replace')
+            return rec
+        raise TimeoutError("status record kept changing while being read")
+
+    def age(self, rec):
+        """seconds since the record was last updated"""
+        return time.time() - rec['updated_us'] / 1e6
+
+    def close(self):
+        self.mm.close()
+
+
+class StatusWriter:
+    """
+    same record from Python producers (collector), update() takes any FIELDS as keywords
+    - only one writer per file
+    """
+    def __init__(self, path='status'):
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            os.ftruncate(fd, RECORD.size)
+            self.mm = mmap.mmap(fd, RECORD.size)
+        finally:
+            os.close(fd)
+        self.values = dict.fromkeys(FIELDS, 0)
+        self.values.update(magic=MAGIC, version=VERSION, size=RECORD.size, stage=b'')
+        self.mm[:] = bytes(RECORD.size)
+        self.seq = 0
+
+    def update(self, **fields):
+        if 'stage' in fields:
+            fields['stage'] = fields['stage'].encode()[:31]
+        self.values.update(fields, updated_us=int(time.time() * 1e6))
+        self.seq += 1
+        SEQ.pack_into(self.mm, SEQ_OFFSET, self.seq) # odd, readers wait
+        self.values['seq'] = self.seq
+        RECORD.pack_into(self.mm, 0, *(self.values[k] for k in FIELDS))
+        self.seq += 1
+        SEQ.pack_into(self.mm, SEQ_OFFSET, self.seq)
+
+    def close(self):
+        self.mm.close()
+
+
+def open_status(path='status'):
+    """StatusReader, or None if there is no status file (logger not running or an older build)"""
+    try:
+        return StatusReader(path)
+    except (OSError, ValueError):
+        return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Print the logger's status record")
+    parser.add_argument('path', nargs='?', default='status')
+    parser.add_argument('--watch', action='store_true', help="keep printing at 5Hz")
+    args = parser.parse_args()
+
+    reader = StatusReader(args.path)
+    while True:
+        rec = reader.read()
+        if rec is None:
+            print("no status written yet")
+        else:
+            print(f"{rec['ts_us']},{rec['melt_temp']:.2f},{rec['inj_press']:.2f},{rec['vib_amp']:.2f},"
+                  f"{rec['vib_freq']:.2f},{rec['stage']},{rec['failure_label']}  "
+                  f"rows={rec['rows_read']} errors={rec['read_errors']} rate={rec['read_hz']:.1f}Hz "
+                  f"capture={rec['capture']} age={reader.age(rec):.2f}s")
+        if not args.watch:
+            break
+        time.sleep(0.2)
@@ -0,0 +1,278 @@
+"""
+Running index of the files in logs/ and train/, for dir usage and the maxLogDirKB/maxTrainDirKB caps
+
+bbb_logger and upload.py used to stat every file in a dir to get its usage, so the cost grew with the
+upload backlog. Here each dir keeps an append-only journal (.storage_index) of file events:
+  + <size> <name>   file added or its size changed
+  - <name>          file removed
+Replaying it gives {file: size} and the total, after that every add/remove is O(1) in memory plus
+one short append. Several processes (upload.py, collector) can share a dir, sync() reads the
+lines the others appended since the last call. The journal is compacted when it is loaded and has
+grown to a few times the number of live files.
+
+Eviction is oldest first by the unix time in the file name (a segment goes by its first file), so a
+file converted or packed late still goes at its real age. Files are grouped by name stem, a csv and the
+.hfb made from it (log_<ts>.csv -> log_<ts>.hfb) share a slot. The newest csv in a dir is never evicted,
+the logger may still be writing it (the same rule as upload.py's pending_files).
+
+Usage:
+  python3 storage.py                 # usage of logs/ and train/ against the config.txt caps
+  python3 storage.py --evict         # delete oldest files until both dirs are under their caps
+  python3 storage.py --rebuild       # rescan the dirs (after files were changed by hand)
+"""
+
+import argparse
+import os
+import re
+import threading
+from collections import OrderedDict
+
+from logger_config import read_config
+
+JOURNAL = '.storage_index'
+TRACKED_EXTS = ('.csv', '.hfb', '.seg')
+MANIFEST_SUFFIX = '.upload.json'  # same as upload.py, removed along with an evicted file
+CAP_KEYS = {'logs': 'maxLogDirKB', 'train': 'maxTrainDirKB'}
+
+
+def file_ts(name):
+    """unix time in the logger's file name (log_<ts>.csv), 0 if there isn't one"""
+    m = re.search(r'_(\d+)(?:_\d+)?\.\w+$', name)
+    return int(m.group(1)) if m else 0
+
+
+class StorageIndex:
+    """
+    {file: size} for one dir, backed by the journal
+    - thread safe, upload.py removes files from its worker threads
+    - names are basenames, paths passed in may include the dir
+    """
+    def __init__(self, directory, compact_factor=4):
+        self.directory = directory
+        self.path = os.path.join(directory, JOURNAL)
+        self.compact_factor = compact_factor
+        self.lock = threading.RLock()
+        self.load()
+
+    def _reset(self):
+        self.slots = OrderedDict()  # stem -> {name: size}, oldest first
+        self.total = 0
+        self.offset = 0
+        self.inode = None
+        self.lines = 0
+
+    def load(self):
+        with self.lock:
+            self._reset()
+            if not os.path.exists(self.path):
+                self.rebuild()
+                return
+            self.sync()
+            if self.lines > self.compact_factor * self.count() + 100:
+                self.compact()
+
+    def rebuild(self):
+        """scan the dir once and write a fresh journal"""
+        with self.lock:
+            self._reset()
+            entries = [e for e in os.scandir(self.directory) if e.is_file() and e.name.endswith(TRACKED_EXTS)]
+            for e in sorted(entries, key=lambda e: (file_ts(e.name), e.name)):
+                self._apply_add(e.name, e.stat().st_size)
+            self.compact()
+
+    def compact(self):
+        """rewrite the journal with only the live files (written via a temp file and renamed)"""
+        with self.lock:
+            tmp = self.path + '.tmp'
+            with open(tmp, 'w') as f:
+                for files in self.slots.values():
+                    for name, size in files.items():
+                        f.write(f"+ {size} {name}\n")
+            os.replace(tmp, self.path)
+            st = os.stat(self.path)
+            self.inode, self.offset, self.lines = st.st_ino, st.st_size, self.count()
+
+    def sync(self):
+        """apply journal lines appended by other processes, reloads if the journal was compacted"""
+        with self.lock:
+            try:
+                st = os.stat(self.path)
+            except FileNotFoundError:
+                return
+            if self.inode is not None and (st.st_ino != self.inode or st.st_size < self.offset):
+                self._reset()
+            self.inode = st.st_ino
+            if st.st_size == self.offset:
+                return
+            with open(self.path, 'rb') as f:
+                f.seek(self.offset)
+                data = f.read()
+            # a line another process is still writing is picked up next time
+            end = data.rfind(b'\n') + 1
+            for line in data[:end].decode().splitlines():
+                self._apply_line(line)
+            self.offset += end
+
+    def _apply_line(self, line):
+        self.lines += 1
+        if line.startswith('+ '):
+            size, name = line[2:].split(' ', 1)
+            self._apply_add(name, int(size))
+        elif line.startswith('- '):
+            self._apply_remove(line[2:])
+
+    def _apply_add(self, name, size):
+        files = self.slots.setdefault(os.path.splitext(name)[0], {})
+        self.total += size - files.get(name, 0)
+        files[name] = size
+
+    def _apply_remove(self, name):
+        stem = os.path.splitext(name)[0]
+        files = self.slots.get(stem)
+        if files is None or name not in files:
+            return False
+        self.total -= files.pop(name)
+        if not files:
+            del self.slots[stem]
+        return True
+
+    def _append(self, line):
+        # opened per event so a compaction by another process (new inode) is never written past
+        # the offset isn't moved, the next sync() reads this line back, replaying it is a no-op
+        with open(self.path, 'a') as f:
+            f.write(line + '\n')
+
+    def add(self, path, size=None):
+        """record a new or grown file (one stat if size isn't given)"""
+        name = os.path.basename(path)
+        if not name.endswith(TRACKED_EXTS):
+            return
+        if size is None:
+            try:
+                size = os.path.getsize(os.path.join(self.directory, name))
+            except OSError:
+                return
+        with self.lock:
+            self.sync()
+            if self.size_of(name) == size:
+                return
+            self._apply_add(name, size)
+            self._append(f"+ {size} {name}")
+
+    def remove(self, path):
+        """record that a file is gone (uploaded, converted, packed, deleted)"""
+        name = os.path.basename(path)
+        with self.lock:
+            self.sync()
+            if self._apply_remove(name):
+                self._append(f"- {name}")
+
+    def track(self, paths):
+        """add the files not in the index yet, only those are stat'ed"""
+        for p in paths:
+            if self.size_of(os.path.basename(p)) is None:
+                self.add(p)
+
+    def size_of(self, name):
+        files = self.slots.get(os.path.splitext(name)[0])
+        return None if files is None else files.get(name)
+
+    def count(self):
+        return sum(len(files) for files in self.slots.values())
+
+    def usage_kb(self):
+        self.sync()
+        return (self.total + 1023) // 1024
+
+    def by_age(self):
+        """slot stems oldest first, by the time in the file name (arrival order breaks ties)"""
+        with self.lock:
+            arrival = {stem: i for i, stem in enumerate(self.slots)}
+            return sorted(self.slots, key=lambda stem: (file_ts(next(iter(self.slots[stem]))), arrival[stem]))
+
+    def newest_csv(self):
+        """the csv the logger may still be writing, None if there is no csv"""
+        with self.lock:
+            csvs = [name for files in self.slots.values() for name in files if name.endswith('.csv')]
+            return max(csvs, key=file_ts, default=None)
+
+    def evict(self, cap_kb):
+        """
+        delete the oldest files until the dir is within cap_kb, returns the deleted paths
+        - the newest csv (the logger's open file) is never touched
+        """
+        removed = []
+        with self.lock:
+            self.sync()
+            open_csv = self.newest_csv()
+            for stem in self.by_age():
+                if self.total <= cap_kb * 1024:
+                    break
+                for name in list(self.slots.get(stem, {})):
+                    if name == open_csv:
+                        continue
+                    path = os.path.join(self.directory, name)
+                    for p in (path, path + MANIFEST_SUFFIX):
+                        try:
+                            os.remove(p)
+                        except FileNotFoundError:
+                            pass
+                        except OSError as e:
+                            print(f"  Could not evict {p}: {e}")
+                    self.remove(name)
+                    removed.append(path)
+        return removed
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_index(directory):
+    """one StorageIndex per dir per process"""
+    key = os.path.normpath(directory)
+    with _indexes_lock:
+        if key not in _indexes:
+            _indexes[key] = StorageIndex(directory)
+        return _indexes[key]
+
+
+def forget(path):
+    """the file at path is gone, for callers that only have the path"""
+    get_index(os.path.dirname(path) or '.').remove(path)
+
+
+def dir_cap_kb(directory, cfg):
+    return (cfg or {}).get(CAP_KEYS.get(os.path.basename(os.path.normpath(directory))))
+
+
+def enforce_cap(directory, cfg):
+    """evict from a dir past its config.txt cap, returns the deleted paths"""
+    cap = dir_cap_kb(directory, cfg)
+    if not cap:
+        return []
+    removed = get_index(directory).evict(cap)
+    if removed:
+        print(f"{directory} over its {cap}KB cap, deleted {len(removed)} oldest files")
+    return removed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Dir usage and cap eviction for logs/ and train/")
+    parser.add_argument('--evict', action='store_true', help="delete oldest files past the config.txt caps")
+    parser.add_argument('--rebuild', action='store_true', help="rescan the dirs instead of trusting the journal")
+    args = parser.parse_args()
+
+    cfg = read_config()
+    for d in ('logs', 'train'):
+        if not os.path.isdir(d):
+            continue
+        index = get_index(d)
+        if args.rebuild:
+            index.rebuild()
+        if args.evict:
+            enforce_cap(d, cfg)
+        cap = dir_cap_kb(d, cfg)
+        used = index.usage_kb()
+        pct = f" ({used * 100 // cap}% of {cap}KB cap)" if cap else ""
+        print(f"{d}: {index.count()} files, {used}KB{pct}")
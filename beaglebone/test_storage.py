@@ -0,0 +1,66 @@
+"""
+python -m pytest beaglebone/test_storage.py
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import storage
+import upload
+
+ROWS = "1745973055000000,200.0,50.0,0.3,10.0,Holding,0\n" * 200
+
+
+def write_capture(directory, ts):
+    path = os.path.join(directory, f"train_{ts}.csv")
+    with open(path, 'w') as f:
+        f.write(ROWS)
+    os.utime(path, (ts, ts))
+    storage.get_index(directory).add(path)
+    return path
+
+
+def test_convert_pack_then_cap_keeps_the_open_csv(tmp_path):
+    train = tmp_path / 'train'
+    train.mkdir()
+    directory = str(train)
+    index = storage.get_index(directory)
+
+    # two captures closed, converted and packed into a segment
+    write_capture(directory, 1745973000)
+    write_capture(directory, 1745973100)
+    write_capture(directory, 1745973200)
+    upload.convert_to_binary(directory)
+    assert sorted(os.listdir(directory)) == ['.storage_index', 'train_1745973000.hfb', 'train_1745973100.hfb',
+                                             'train_1745973200.csv']
+    # the .hfb took over its csv's slot instead of going to the end
+    assert list(index.slots) == ['train_1745973000', 'train_1745973100', 'train_1745973200']
+    upload.pack_segment(directory)
+    seg = 'train_1745973000_1745973100.seg'
+    assert index.size_of(seg) == os.path.getsize(train / seg)
+
+    # the logger moves on, the capture it closed is converted after the newer one was opened
+    write_capture(directory, 1745973300)
+    upload.convert_to_binary(directory)
+    assert index.by_age() == ['train_1745973000_1745973100', 'train_1745973200', 'train_1745973300']
+
+    # a cap below the newest csv alone: everything else goes, oldest first, the open csv stays
+    removed = storage.enforce_cap(directory, {'maxTrainDirKB': 1})
+    assert [os.path.basename(p) for p in removed] == [seg, 'train_1745973200.hfb']
+    assert sorted(os.listdir(directory)) == ['.storage_index', 'train_1745973300.csv']
+    assert index.count() == 1
+
+    # the journal replays to the same state in another process
+    assert storage.StorageIndex(directory).size_of('train_1745973300.csv') == len(ROWS)
+
+
+def test_cap_stops_once_under(tmp_path):
+    logs = tmp_path / 'logs'
+    logs.mkdir()
+    directory = str(logs)
+    for ts in (1745973300, 1745973000, 1745973200, 1745973100):  # added out of time order
+        write_capture(directory, ts)
+    cap_kb = (2 * len(ROWS) + 1023) // 1024 + 1  # room for two files
+    removed = storage.enforce_cap(directory, {'maxLogDirKB': cap_kb})
+    assert [os.path.basename(p) for p in removed] == ['train_1745973000.csv', 'train_1745973100.csv']
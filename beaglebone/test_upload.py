@@ -0,0 +1,133 @@
+"""
+python -m pytest beaglebone/test_upload.py
+"""
+
+import os
+import sys
+
+from botocore.exceptions import EndpointConnectionError
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import segment
+import storage
+import upload
+
+
+def test_pack_segment(tmp_path):
+    train = tmp_path / 'train'
+    train.mkdir()
+    rows = "1745973055000000,200.0,50.0,0.3,10.0,Holding\n" * 100
+    for ts in (1745973055, 1745973115, 1745973175):
+        (train / f"train_{ts}.csv").write_text(rows)
+        os.utime(train / f"train_{ts}.csv", (ts, ts))
+    directory = str(train)
+
+    upload.pack_segment(directory)
+
+    # the newest csv may still be open in the logger, the two closed ones are packed
+    segs = [p for p in os.listdir(directory) if p.endswith(segment.EXT)]
+    assert segs == ['train_1745973055_1745973115.seg']
+    assert sorted(p for p in os.listdir(directory) if p.endswith('.csv')) == ['train_1745973175.csv']
+    reader = segment.SegmentReader.open_local(os.path.join(directory, segs[0]))
+    assert reader.names() == ['train_1745973055.csv', 'train_1745973115.csv']
+    assert reader.read('train_1745973115.csv').decode() == rows
+    index = storage.get_index(directory)
+    assert index.size_of(segs[0]) == os.path.getsize(os.path.join(directory, segs[0]))
+    assert index.size_of('train_1745973055.csv') is None
+
+
+class StubS3:
+    """the multipart calls upload.py makes, the link drops after `fail_after` parts"""
+    def __init__(self, fail_after=None):
+        self.fail_after = fail_after
+        self.uploads = {}     # upload id -> {part number: bytes}
+        self.sent = []        # (upload id, part number) of every part received
+        self.completed = {}   # key -> object bytes
+        self.aborted = []
+        self.created = 0
+
+    def create_multipart_upload(self, Bucket, Key):
+        self.created += 1
+        upload_id = f"upload-{self.created}"
+        self.uploads[upload_id] = {}
+        return {'UploadId': upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        if self.fail_after is not None and len(self.sent) >= self.fail_after:
+            raise EndpointConnectionError(endpoint_url='https://s3.test')
+        data = Body.read()
+        self.uploads[UploadId][PartNumber] = data
+        self.sent.append((UploadId, PartNumber))
+        return {'ETag': f'"{UploadId}-{PartNumber}"'}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        parts = self.uploads.pop(UploadId)
+        numbers = [p['PartNumber'] for p in MultipartUpload['Parts']]
+        assert numbers == sorted(parts)
+        assert all(p['ETag'] == f'"{UploadId}-{p["PartNumber"]}"' for p in MultipartUpload['Parts'])
+        self.completed[Key] = b''.join(parts[n] for n in numbers)
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.aborted.append(UploadId)
+        self.uploads.pop(UploadId, None)
+
+
+PART = 1024
+
+
+def capture(tmp_path, size=5 * PART + 100):
+    path = tmp_path / 'train_1745973055.csv'
+    path.write_bytes(os.urandom(size))
+    return str(path)
+
+
+def interrupted(path, key, parts):
+    """an upload the link dropped after `parts` parts"""
+    client = StubS3(fail_after=parts)
+    try:
+        upload.multipart_upload(client, path, key, PART)
+    except EndpointConnectionError:
+        pass
+    else:
+        raise AssertionError("the upload should have been interrupted")
+    return client
+
+
+def test_multipart_resumes_after_interruption(tmp_path):
+    path = capture(tmp_path)
+    key = os.path.basename(path)
+    first = interrupted(path, key, 2)
+    manifest = upload.load_manifest(path)
+    assert manifest['upload_id'] == 'upload-1'
+    assert sorted(manifest['parts']) == ['1', '2']
+
+    # the rerun keeps the upload id and sends only the missing parts
+    client = StubS3()
+    client.uploads = first.uploads
+    resumed = upload.RESUMED.value
+    upload.multipart_upload(client, path, key, PART)
+    assert client.sent == [('upload-1', n) for n in (3, 4, 5, 6)]
+    assert upload.RESUMED.value == resumed + 1
+    with open(path, 'rb') as f:
+        assert client.completed[key] == f.read()
+    assert upload.load_manifest(path) is None
+    assert not os.path.exists(path + upload.MANIFEST_SUFFIX)
+
+
+def test_changed_file_starts_over(tmp_path):
+    path = capture(tmp_path)
+    key = os.path.basename(path)
+    first = interrupted(path, key, 3)
+
+    # the file is rewritten (a different size) before the next run
+    with open(path, 'ab') as f:
+        f.write(b'more rows\n')
+    client = StubS3()
+    client.uploads, client.created = first.uploads, first.created
+    upload.multipart_upload(client, path, key, PART)
+    assert client.aborted == ['upload-1']
+    assert [n for _, n in client.sent] == [1, 2, 3, 4, 5, 6]
+    assert {u for u, _ in client.sent} == {'upload-2'}
+    with open(path, 'rb') as f:
+        assert client.completed[key] == f.read()
+    assert upload.load_manifest(path) is None
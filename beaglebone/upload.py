@@ -1,59 +1,527 @@
 """
-This script is run in a cron job on beagle bone
+This script is run in a cron job on beagle bone, or as a long running service with --daemon
+
+- files are uploaded concurrently by a small thread pool sharing one pooled boto3 client
+- files over the multipart threshold (big HF captures) are sent in parts, the finished parts are
+  recorded in a <file>.upload.json manifest so an interrupted run resumes instead of starting over
+- with --segment every closed file of a run is packed into one compressed .seg object (segment.py)
+- uploads are ordered by priority (logs before train, a dir close to its config.txt cap first) and
+  can be held to a byte/s budget with --rate-limit so the cellular uplink stays usable for Tailscale
+- --daemon watches logs/ and train/ with inotify and uploads each file seconds after the logger
+  closes it, with a slow full rescan as a fallback (and as the only source where inotify is missing)
+- set S3_ENDPOINT_URL to point at a local S3 stand-in (moto_server, minio) for testing
+- bytes, per file times, retries, throttling and the backlog go to upload_metrics.prom (metrics.py)
 """
 
 import os
+import argparse
+import asyncio
 import glob
+import json
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import boto3
+from botocore.config import Config
 from botocore.exceptions import BotoCoreError, ClientError
 
-AWS_ACCESS_KEY_ID     = # fill in
-AWS_SECRET_ACCESS_KEY = # fill in 
+import dirwatch
+import metrics
+import storage
+from logger_config import read_config
+
+AWS_ACCESS_KEY_ID     = os.getenv('AWS_ACCESS_KEY_ID')      # or fill in
+AWS_SECRET_ACCESS_KEY = os.getenv('AWS_SECRET_ACCESS_KEY')  # or fill in
 AWS_REGION            = os.getenv('AWS_REGION', 'us-east-1')
-BUCKET_NAME           = # fill in
+BUCKET_NAME           = os.getenv('S3_BUCKET')              # or fill in
+S3_ENDPOINT_URL       = os.getenv('S3_ENDPOINT_URL')        # None = real AWS
+
+UPLOAD_WORKERS = 4
+MAX_RETRIES = 5                        # per request, botocore backs off between attempts
+MULTIPART_THRESHOLD = 8 * 1024 * 1024  # S3 minimum part size is 5MB
+PART_SIZE = 8 * 1024 * 1024
+MANIFEST_SUFFIX = '.upload.json'
+URGENT_CAP_PERCENT = 80                # a dir this full goes first, the logger deletes past its cap
+THROTTLE_CHUNK = 64 * 1024             # bytes charged to --rate-limit per body read
+STATS_FILE = 'upload_stats.csv'        # one line per run, for sizing the cron period from real numbers
+UPLOAD_EXTS = ('.csv', '.hfb', '.seg')
+RESCAN_INTERVAL = 300                  # daemon full rescan, same as the old cron period
+POLL_INTERVAL = 5                      # daemon rescan when inotify is not available
+METRICS_FILE = 'upload_metrics.prom'   # written at the end of a cron run, every 10s by the daemon
+
+SENT_BYTES = metrics.counter('upload_bytes_total', "bytes uploaded (multipart uploads count each part)")
+FILES = {r: metrics.counter('upload_files_total', "files by result", result=r) for r in ('ok', 'failed')}
+FILE_SECONDS = metrics.histogram('upload_file_seconds', "seconds to upload one file, failures included")
+RETRIES = metrics.counter('upload_request_retries_total', "S3 request attempts botocore had to repeat")
+RESUMED = metrics.counter('upload_resumed_total', "multipart uploads resumed from a manifest")
+THROTTLED = metrics.counter('upload_throttled_seconds_total', "seconds spent waiting on --rate-limit")
+QUEUE_DEPTH = metrics.gauge('upload_queue_depth', "files queued in the daemon")
+RUN_RATE = metrics.gauge('upload_last_run_bytes_per_second', "throughput of the last cron run")
+RUN_TIME = metrics.gauge('upload_last_run_timestamp_seconds', "unix time the last cron run finished")
+
+
+class TokenBucket:
+    """
+    byte/s rate limiter shared by the upload threads
+    - a take can go past the budget (tokens go negative), the caller just sleeps off the deficit
+    """
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.capacity = float(burst or rate)
+        self.tokens = self.capacity
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def consume(self, n):
+        """take n bytes of budget, sleeping off any deficit, returns the seconds slept"""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            self.tokens -= n
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+# set from --rate-limit, None = as fast as the link allows
+limiter = None
+
+
+def throttle(n):
+    if limiter:
+        THROTTLED.inc(limiter.consume(n))
+
+
+class ThrottledReader:
+    """
+    length bytes of an open file from offset, as the body of a put or part
+    - read() charges --rate-limit per THROTTLE_CHUNK, so the body goes out at the limited rate while it
+      is sent, instead of being charged up front and then sent in one burst that fills the uplink
+    - seek/tell/len so botocore can size it and rewind it for a retry (which is sent, and charged, again)
+    - over https that is the only read (the checksum is computed as it goes out). Over plain http (a local S3
+      stand-in) botocore reads the body twice more first, to checksum and sign it, and those reads are charged too
+    """
+    def __init__(self, f, offset, length):
+        self.f = f
+        self.offset = offset
+        self.length = length
+        self.pos = 0
+
+    def __len__(self):
+        return self.length
+
+    def read(self, size=-1):
+        left = self.length - self.pos
+        size = left if size is None or size < 0 else min(size, left)
+        chunks = []
+        while size > 0:
+            n = min(size, THROTTLE_CHUNK)
+            throttle(n)
+            self.f.seek(self.offset + self.pos)
+            data = self.f.read(n)
+            if not data:
+                break
+            chunks.append(data)
+            self.pos += len(data)
+            size -= len(data)
+        return b''.join(chunks)
+
+    def seek(self, pos, whence=os.SEEK_SET):
+        base = {os.SEEK_SET: 0, os.SEEK_CUR: self.pos, os.SEEK_END: self.length}[whence]
+        self.pos = min(max(base + pos, 0), self.length)
+        return self.pos
+
+    def tell(self):
+        return self.pos
+
+
+def count_retries(parsed=None, **kwargs):
+    """botocore after-call hook, fires for error responses too"""
+    n = (parsed or {}).get('ResponseMetadata', {}).get('RetryAttempts', 0)
+    if n:
+        RETRIES.inc(n)
+
+
+def make_client(workers=UPLOAD_WORKERS, retries=MAX_RETRIES):
+    """one client shared by every upload thread, with a connection per worker so they don't queue"""
+    client = boto3.client(
+        's3',
+        aws_access_key_id=AWS_ACCESS_KEY_ID,
+        aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
+        region_name=AWS_REGION,
+        endpoint_url=S3_ENDPOINT_URL,
+        config=Config(max_pool_connections=workers,
+                      retries={'max_attempts': retries, 'mode': 'standard'})
+    )
+    client.meta.events.register('after-call.s3', count_retries)
+    return client
 
 # Create S3 client
-s3 = boto3.client(
-    's3',
-    aws_access_key_id=AWS_ACCESS_KEY_ID,
-    aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
-    region_name=AWS_REGION
-)
+s3 = make_client()
 
 
-def upload_and_cleanup(directory):
-    """upload all csv files except for most recent one to the S3 bucket, in case most recent file is in use
-    - deletes files that are uploaded"""
-    pattern = os.path.join(directory, '*.csv')
-    files = sorted(glob.glob(pattern), key=os.path.getmtime)
-    if len(files) < 2:
-        return 
-
-    # skip the newest file (last in sorted list)
-    to_upload = files[:-1]
-    for filepath in to_upload:
-        key = os.path.basename(filepath)
+def pending_files(directory):
+    """closed files to upload, oldest first
+    - every csv except the newest one, in case it is in use by the logger
+    - every .hfb/.seg file (hfbin.py and segment.py only ever write complete files)"""
+    csv_files = sorted(glob.glob(os.path.join(directory, '*.csv')), key=os.path.getmtime)[:-1]
+    done_files = glob.glob(os.path.join(directory, '*.hfb')) + glob.glob(os.path.join(directory, '*.seg'))
+    return sorted(csv_files + done_files, key=os.path.getmtime)
+
+
+def convert_file(src):
+    """csv -> .hfb, the csv is removed once the hfb is written"""
+    import hfbin
+    try:
+        dst = hfbin.convert_csv(src)
+    except (OSError, ValueError) as e:
+        print(f"  Could not convert {src}: {e}")
+        return
+    # recorded before the csv is forgotten, so the .hfb takes over the csv's slot
+    storage.get_index(os.path.dirname(dst)).add(dst)
+    os.remove(src)
+    storage.forget(src)
+    print(f"  Converted {src} -> {dst}")
+
+
+def convert_to_binary(directory):
+    """convert closed csv files to .hfb before upload (about half the bytes, no parsing on load)"""
+    import hfbin # needs numpy, only imported when --binary is used
+    for src in hfbin.closed_csv_files(directory):
+        convert_file(src)
+
+
+def pack_segment(directory):
+    """pack every closed file into one compressed segment, the originals are removed once it is on disk"""
+    import segment
+    files = [f for f in pending_files(directory) if not f.endswith(segment.EXT)]
+    if not files:
+        return
+    out = os.path.join(directory, segment.segment_name(directory, files))
+    try:
+        seg = segment.pack(files, out)
+    except OSError as e:
+        print(f"  Could not pack {directory}: {e}")
+        return
+    store = storage.get_index(directory)
+    store.add(out)
+    for f in files:
+        os.remove(f)
+        store.remove(f)
+    raw = sum(e['size'] for e in seg['files'])
+    packed = os.path.getsize(out)
+    print(f"  Packed {len(files)} files ({raw} B) -> {out} ({packed} B)")
+
+
+def load_manifest(filepath):
+    try:
+        with open(filepath + MANIFEST_SUFFIX) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save_manifest(filepath, manifest):
+    """atomic so a run killed mid write never leaves a corrupt manifest"""
+    tmp = filepath + MANIFEST_SUFFIX + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f)
+    os.replace(tmp, filepath + MANIFEST_SUFFIX)
+
+
+def remove_manifest(filepath):
+    try:
+        os.remove(filepath + MANIFEST_SUFFIX)
+    except OSError:
+        pass
+
+
+def multipart_upload(client, filepath, key, part_size=PART_SIZE):
+    """upload in parts, resuming from the manifest of an earlier interrupted run if there is one"""
+    st = os.stat(filepath)
+    manifest = load_manifest(filepath)
+    if manifest and (manifest['key'] != key or manifest['size'] != st.st_size or manifest['mtime'] != st.st_mtime):
+        # file changed since the last attempt, the old parts are useless
         try:
+            client.abort_multipart_upload(Bucket=BUCKET_NAME, Key=manifest['key'], UploadId=manifest['upload_id'])
+        except (BotoCoreError, ClientError):
+            pass
+        manifest = None
+    if manifest is None:
+        resp = client.create_multipart_upload(Bucket=BUCKET_NAME, Key=key)
+        manifest = {'key': key, 'upload_id': resp['UploadId'], 'size': st.st_size,
+                    'mtime': st.st_mtime, 'part_size': part_size, 'parts': {}}
+        save_manifest(filepath, manifest)
+    else:
+        RESUMED.inc()
+        print(f"  Resuming {filepath}: {len(manifest['parts'])} parts already sent")
+
+    part_size = manifest['part_size']
+    n_parts = max(1, math.ceil(st.st_size / part_size))
+    try:
+        with open(filepath, 'rb') as f:
+            for n in range(1, n_parts + 1):
+                if str(n) in manifest['parts']:
+                    continue
+                offset = (n - 1) * part_size
+                length = min(part_size, st.st_size - offset)
+                resp = client.upload_part(Bucket=BUCKET_NAME, Key=key, UploadId=manifest['upload_id'],
+                                          PartNumber=n, Body=ThrottledReader(f, offset, length))
+                manifest['parts'][str(n)] = resp['ETag']
+                save_manifest(filepath, manifest)
+                SENT_BYTES.inc(length)
+        parts = [{'PartNumber': int(n), 'ETag': etag}
+                 for n, etag in sorted(manifest['parts'].items(), key=lambda p: int(p[0]))]
+        client.complete_multipart_upload(Bucket=BUCKET_NAME, Key=key, UploadId=manifest['upload_id'],
+                                         MultipartUpload={'Parts': parts})
+    except ClientError as e:
+        if e.response.get('Error', {}).get('Code') == 'NoSuchUpload':
+            # upload expired or was aborted on the bucket side, next run starts a fresh one
+            remove_manifest(filepath)
+        raise
+    remove_manifest(filepath)
+
+
+def upload_one(client, filepath, part_size=PART_SIZE):
+    """upload then delete one file, returns the bytes sent or None on failure"""
+    key = os.path.basename(filepath)
+    try:
+        with FILE_SECONDS.time():
+            size = os.path.getsize(filepath)
             print(f"Uploading {filepath} -> s3://{BUCKET_NAME}/{key}")
-            s3.upload_file(filepath, BUCKET_NAME, key)
-            print("  Success")
-        except (BotoCoreError, ClientError) as e:
-            print(f"  Upload failed: {e}")
-            continue
-
-        # safer delete
-        if os.path.exists(filepath):
+            if size >= MULTIPART_THRESHOLD:
+                multipart_upload(client, filepath, key, part_size)
+            else:
+                with open(filepath, 'rb') as f:
+                    client.put_object(Bucket=BUCKET_NAME, Key=key, Body=ThrottledReader(f, 0, size))
+                SENT_BYTES.inc(size)
+        print(f"  Success {key}")
+    except (BotoCoreError, ClientError, OSError) as e:
+        FILES['failed'].inc()
+        print(f"  Upload failed {key}: {e}")
+        return None
+    FILES['ok'].inc()
+
+    # safer delete
+    if os.path.exists(filepath):
+        try:
+            os.remove(filepath)
+            storage.forget(filepath)
+            print(f"  Deleted {filepath}")
+        except OSError as e:
+            print(f"  Could not delete {filepath}: {e}")
+    else:
+        print(f"  Already gone: {filepath}")
+    return size
+
+
+def upload_files(files, workers=UPLOAD_WORKERS, client=None, part_size=PART_SIZE):
+    """upload files concurrently in the given order, returns (uploaded, failed, bytes sent)"""
+    client = client or s3
+    uploaded = failed = sent = 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        # the pool starts jobs in submit order, so the list order is the send order
+        futures = [pool.submit(upload_one, client, fp, part_size) for fp in files]
+        for fut in as_completed(futures):
+            size = fut.result()
+            if size is None:
+                failed += 1
+            else:
+                uploaded += 1
+                sent += size
+    return uploaded, failed, sent
+
+
+def dir_priorities(dirs, cfg=None):
+    """
+    {dir: priority}, lower goes first
+    - a dir past URGENT_CAP_PERCENT of its cap goes first, it is about to lose data to local deletion
+    - then LF logs/ ahead of bulky HF train/
+    """
+    caps = {'logs': (cfg or {}).get('maxLogDirKB'), 'train': (cfg or {}).get('maxTrainDirKB')}
+    rank = {'logs': 1, 'train': 2}
+    prios = {}
+    for d in dirs:
+        name = os.path.basename(os.path.normpath(d))
+        prios[d] = rank.get(name, 3)
+        if caps.get(name):
+            used = storage.get_index(d).usage_kb()
+            if used * 100 >= caps[name] * URGENT_CAP_PERCENT:
+                print(f"{d} at {used}KB / {caps[name]}KB, sending it first")
+                prios[d] = 0
+    return prios
+
+
+def schedule(dirs, cfg=None):
+    """one upload queue over all dirs, by dir priority then oldest first"""
+    queue = []
+    for d, prio in dir_priorities(dirs, cfg).items():
+        files = pending_files(d)
+        storage.get_index(d).track(files)
+        for fp in files:
+            queue.append((prio, os.path.getmtime(fp), fp))
+    queue.sort()
+    return [fp for _, _, fp in queue]
+
+
+def report(uploaded, failed, sent, elapsed):
+    """print and record measured throughput"""
+    rate = sent / elapsed if elapsed > 0 else 0.0
+    RUN_RATE.set(rate)
+    RUN_TIME.set(time.time())
+    print(f"Uploaded {uploaded} files ({sent} B) in {elapsed:.1f}s = {rate / 1024:.1f}KB/s, {failed} failed")
+    if uploaded or failed:
+        new = not os.path.exists(STATS_FILE)
+        with open(STATS_FILE, 'a') as f:
+            if new:
+                f.write("time,files,failed,bytes,seconds,bytes_per_sec\n")
+            f.write(f"{int(time.time())},{uploaded},{failed},{sent},{elapsed:.3f},{rate:.0f}\n")
+
+
+@metrics.on_collect
+def backlog_metrics():
+    """files and bytes waiting in each dir, from the storage index (uploaded files are deleted)"""
+    for d in ('logs', 'train'):
+        if os.path.isdir(d):
+            index = storage.get_index(d)
+            index.sync()
+            metrics.gauge('upload_backlog_files', "files in the dir, not uploaded yet", dir=d).set(index.count())
+            metrics.gauge('upload_backlog_bytes', "bytes in the dir, not uploaded yet", dir=d).set(index.total)
+
+
+def upload_and_cleanup(directory, workers=UPLOAD_WORKERS, client=None):
+    """upload all closed csv/hfb files in one dir to the S3 bucket
+    - deletes files that are uploaded"""
+    uploaded, failed, _ = upload_files(pending_files(directory), workers, client)
+    if uploaded or failed:
+        print(f"{directory}: {uploaded} uploaded, {failed} failed")
+
+
+async def run_daemon(dirs, workers=UPLOAD_WORKERS, binary=False, rescan_interval=RESCAN_INTERVAL):
+    """
+    upload files as soon as they are finished instead of every 5 minutes
+    - inotify close-after-write / rename events put files straight on a priority queue
+    - a full rescan on start, on inotify queue overflow and every rescan_interval catches anything missed
+    - upload failures are left on disk and retried by the next rescan
+    """
+    loop = asyncio.get_running_loop()
+    pool = ThreadPoolExecutor(max_workers=workers)
+    queue = asyncio.PriorityQueue()
+    queued = set()
+    prios = {}
+
+    def enqueue(paths):
+        for fp in paths:
+            d = os.path.dirname(fp)
+            if fp in queued or not fp.endswith(UPLOAD_EXTS) or not os.path.exists(fp):
+                continue
+            queued.add(fp)
+            queue.put_nowait((prios.get(d, 3), os.path.getmtime(fp), fp))
+        QUEUE_DEPTH.set(queue.qsize())
+
+    def rescan():
+        cfg = read_config()
+        for d in dirs:
+            storage.get_index(d).track(pending_files(d))
+            # caps are enforced here too, so they hold while the link is down
+            storage.enforce_cap(d, cfg)
+        prios.update(dir_priorities(dirs, cfg))
+        enqueue([fp for d in dirs for fp in pending_files(d)])
+
+    watcher = dirwatch.open_watcher(dirs)
+    if watcher:
+        # events name files relative to the dir strings we watched, same as pending_files()
+        def on_events():
+            paths, overflowed = watcher.read_events()
+            if overflowed:
+                rescan()
+            cfg = read_config()
+            for fp in paths:
+                d = os.path.dirname(fp)
+                storage.get_index(d).add(fp)
+                storage.enforce_cap(d, cfg)
+            enqueue(paths)
+        loop.add_reader(watcher.fd, on_events)
+    else:
+        rescan_interval = min(rescan_interval, POLL_INTERVAL)
+
+    async def worker():
+        while True:
+            _, _, fp = await queue.get()
             try:
-                os.remove(filepath)
-                print(f"  Deleted {filepath}")
-            except OSError as e:
-                print(f"  Could not delete {filepath}: {e}")
-        else:
-            print(f"  Already gone: {filepath}")
+                if binary and fp.endswith('.csv'):
+                    # the .hfb appears via a rename event (or the next rescan) and is uploaded then
+                    await loop.run_in_executor(pool, convert_file, fp)
+                else:
+                    await loop.run_in_executor(pool, upload_one, s3, fp)
+            finally:
+                queued.discard(fp)
+                queue.task_done()
+                QUEUE_DEPTH.set(queue.qsize())
+
+    tasks = [asyncio.create_task(worker()) for _ in range(workers)]
+    print(f"Upload daemon watching {', '.join(dirs)} ({'inotify' if watcher else 'polling'})")
+    try:
+        while True:
+            rescan()
+            await asyncio.sleep(rescan_interval)
+    finally:
+        for t in tasks:
+            t.cancel()
+        if watcher:
+            loop.remove_reader(watcher.fd)
+            watcher.close()
+        pool.shutdown(wait=False)
+
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Upload closed logger files to S3")
+    parser.add_argument('--binary', action='store_true', help="convert closed csv files to .hfb first")
+    parser.add_argument('--segment', action='store_true',
+                        help="pack closed files into one compressed segment per dir before upload")
+    parser.add_argument('--workers', type=int, default=UPLOAD_WORKERS, help="concurrent uploads")
+    parser.add_argument('--retries', type=int, default=MAX_RETRIES, help="attempts per S3 request")
+    parser.add_argument('--rate-limit', type=float, default=0, help="max upload rate in KB/s (0 = no limit)")
+    parser.add_argument('--daemon', action='store_true',
+                        help="keep running and upload files as soon as the logger closes them")
+    parser.add_argument('--metrics-file', default=METRICS_FILE, help="Prometheus text file, '' for none")
+    parser.add_argument('--metrics-port', type=int, help="also serve /metrics and /profile on localhost:PORT")
+    args = parser.parse_args()
+
+    if args.workers != UPLOAD_WORKERS or args.retries != MAX_RETRIES:
+        s3 = make_client(args.workers, args.retries)
+    if args.rate_limit > 0:
+        limiter = TokenBucket(args.rate_limit * 1024)
+
+    dirs = []
     for dir_name in ('logs', 'train'):
         if os.path.isdir(dir_name):
-            upload_and_cleanup(dir_name)
+            if args.binary:
+                convert_to_binary(dir_name)
+            if args.segment and not args.daemon:
+                pack_segment(dir_name)
+            dirs.append(dir_name)
         else:
             print(f"Directory not found: {dir_name}")
+
+    exporter = metrics.start('upload', args.metrics_file, args.metrics_port)
+    try:
+        if args.daemon:
+            if args.segment:
+                print("--segment is cron mode only, the daemon uploads files one by one")
+            try:
+                asyncio.run(run_daemon(dirs, args.workers, args.binary))
+            except KeyboardInterrupt:
+                print("exiting")
+        else:
+            cfg = read_config()
+            for d in dirs:
+                storage.get_index(d).track(pending_files(d))
+                storage.enforce_cap(d, cfg)
+            start = time.monotonic()
+            uploaded, failed, sent = upload_files(schedule(dirs, cfg), args.workers)
+            report(uploaded, failed, sent, time.monotonic() - start)
+    finally:
+        exporter.close()
@@ -0,0 +1,477 @@
+"""
+End to end benchmark of the logging pipeline on one machine
+
+Runs the real programs, each as its own process in a scratch dir laid out like /home/debian:
+  injection_moulding.py   OPC-UA simulator at --rate
+  collector               subscribes and writes logs/ and train/ (python3 -m collector)
+  predictive_maintain.py  --stream, alerting to a local SMTP sink
+  upload.py               a cron pass every --upload-every seconds, to a local S3 stand-in
+The sinks are in standins.py (or pass --s3-endpoint for minio/moto_server).
+
+Measured over the run (after --warmup seconds):
+  - sustained rows/s written to train/ (HF) and logs/ (LF), and the collector's received samples/s
+  - dropped samples (gaps in the simulator's Sequence, and in train/ timestamps) and malformed rows
+  - sample to disk latency: row timestamp to the row being readable in its file (polled every 5ms)
+  - sample to alert latency: newest scored sample to the alert mail arriving at the SMTP sink.
+    By default the alarm is forced on with no cooldown (scoring.conf rise = 0) so every scored batch
+    raises an alert, use --scoring for a real alarm config
+  - upload MB/s from upload.py's own upload_stats.csv, checked against what the S3 stand-in got
+  - CPU seconds, CPU % and peak RSS of every process (from wait4, so exact, short processes included)
+
+Results go to a json file with the git version. --compare prints the change against an earlier one.
+
+Usage:
+  python3 bench/pipeline.py --duration 60
+  python3 bench/pipeline.py --rate 500 --publish-ms 50 --out bench_500hz.json --compare bench_main.json
+"""
+
+import argparse
+import glob
+import json
+import os
+import platform
+import re
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+
+from standins import S3Sink, SmtpSink
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SIMULATOR = os.path.join(REPO, 'data_simulator', 'injection_moulding.py')
+OFFLINE = os.path.join(REPO, 'data_simulator', 'offline.py')
+BEAGLEBONE = os.path.join(REPO, 'beaglebone')
+PREDICT = os.path.join(REPO, 'ML', 'predictive_maintain.py')
+TRAINER = os.path.join(REPO, 'ML', 'ML_trainer.py')
+UPLOAD = os.path.join(BEAGLEBONE, 'upload.py')
+sys.path.append(BEAGLEBONE)
+import status
+
+OPCUA_PORT = 4840
+TAIL_INTERVAL = 0.005
+FORCED_ALARM = "method = sample\nrise = 0\nfall = 0\n"
+ALERT_TIME = re.compile(r"sample at (\d{4}-\d\d-\d\d \d\d:\d\d:\d\d\.\d{3})")
+
+
+class Proc:
+    """a child process whose exact CPU time and peak RSS are collected when it exits"""
+    def __init__(self, name, cmd, cwd, env=None):
+        self.name = name
+        self.log = open(os.path.join(cwd, 'bench_logs', f'{name}.log'), 'a')
+        self.started = time.monotonic()
+        self.popen = subprocess.Popen(cmd, cwd=cwd, env=env, stdout=self.log, stderr=subprocess.STDOUT)
+        self.usage = None
+
+    def running(self):
+        return self.usage is None and self.reap(os.WNOHANG) is None
+
+    def reap(self, flags=0):
+        pid, code, ru = os.wait4(self.popen.pid, flags)
+        if pid == 0:
+            return None
+        self.popen.returncode = code # reaped here, Popen must not wait for it again
+        self.usage = {'wall_s': time.monotonic() - self.started, 'cpu_s': ru.ru_utime + ru.ru_stime,
+                      'max_rss_mb': ru.ru_maxrss / 1024, 'exit': os.waitstatus_to_exitcode(code)}
+        self.log.close()
+        return self.usage
+
+    def stop(self, timeout=15.0):
+        """SIGINT (the programs clean up on KeyboardInterrupt), SIGKILL if it is still there after timeout"""
+        if self.usage is None:
+            self.popen.send_signal(signal.SIGINT)
+            deadline = time.monotonic() + timeout
+            while self.reap(os.WNOHANG) is None:
+                if time.monotonic() > deadline:
+                    self.popen.kill()
+                    self.reap()
+                    break
+                time.sleep(0.05)
+        return self.usage
+
+    def wait(self):
+        return self.usage or self.reap()
+
+
+class DiskTail(threading.Thread):
+    """
+    follows every csv in logs/ and train/ as the collector writes them
+    - latency is wall time when a row is first readable minus its timestamp
+    - train/ rows are checked for timestamp gaps within a file (a new file is a new capture)
+    """
+    def __init__(self, workdir, hf_period_us, measure_from):
+        super().__init__(name='disktail', daemon=True)
+        self.workdir = workdir
+        self.hf_period_us = hf_period_us
+        self.measure_from = measure_from
+        self.files = {}  # path -> [fp, partial line, last ts, last stage]
+        self.latency = {'logs': [], 'train': []}
+        self.rows = {'logs': 0, 'train': 0}
+        self.gap_rows = self.malformed = self.repeated = 0
+        self.stopping = threading.Event()
+
+    def run(self):
+        while not self.stopping.is_set():
+            self.poll()
+            time.sleep(TAIL_INTERVAL)
+        self.poll()
+
+    def poll(self):
+        for d in ('logs', 'train'):
+            for path in sorted(glob.glob(os.path.join(self.workdir, d, '*.csv'))):
+                if path not in self.files:
+                    try:
+                        self.files[path] = [open(path), '', None, None]
+                    except FileNotFoundError:
+                        continue # uploaded already, its rows were read from the earlier handle
+                self.read(d, self.files[path])
+
+    def read(self, d, state):
+        fp = state[0]
+        now = time.time()
+        for line in fp.readlines():
+            if not line.endswith('\n'):
+                state[1] += line
+                break
+            line, state[1] = state[1] + line, ''
+            values = line.rstrip('\n').split(',')
+            try:
+                ts, stage = int(values[0]), values[5]
+                [float(v) for v in values[1:5]]
+                if len(values) != 7:
+                    raise ValueError
+            except (ValueError, IndexError):
+                self.malformed += 1
+                continue
+            if ts < self.measure_from:
+                state[2], state[3] = ts, stage
+                continue
+            self.rows[d] += 1
+            last_ts, last_stage = state[2], state[3]
+            if last_stage != 'PartReplacement' and stage != 'PartReplacement':
+                # a failure is one PartReplacement row then nothing for the 10s replacement, not a drop
+                self.latency[d].append((now - ts / 1e6) * 1e3)
+                if d == 'train' and last_ts is not None:
+                    if ts == last_ts:
+                        self.repeated += 1
+                    elif ts - last_ts > 1.5 * self.hf_period_us:
+                        self.gap_rows += round((ts - last_ts) / self.hf_period_us) - 1
+            state[2], state[3] = ts, stage
+
+    def stop(self):
+        self.stopping.set()
+        self.join()
+        for fp, *_ in self.files.values():
+            fp.close()
+
+
+class UploadCron(threading.Thread):
+    """upload.py every `every` seconds like the BBB's cron job, one last pass on stop"""
+    def __init__(self, workdir, env, every):
+        super().__init__(name='uploadcron', daemon=True)
+        self.workdir, self.env, self.every = workdir, env, every
+        self.runs = []
+        self.stopping = threading.Event()
+
+    def run(self):
+        while not self.stopping.wait(self.every):
+            self.upload()
+        self.upload()
+
+    def upload(self):
+        p = Proc('upload', [sys.executable, UPLOAD], self.workdir, self.env)
+        self.runs.append(p.wait())
+
+    def stop(self):
+        self.stopping.set()
+        self.join()
+
+    def usage(self):
+        return {'runs': len(self.runs), 'wall_s': sum(r['wall_s'] for r in self.runs),
+                'cpu_s': sum(r['cpu_s'] for r in self.runs),
+                'max_rss_mb': max((r['max_rss_mb'] for r in self.runs), default=0.0)}
+
+
+def percentiles(values):
+    if not values:
+        return {'n': 0}
+    v = np.asarray(values)
+    return {'n': len(v), 'p50': float(np.percentile(v, 50)), 'p90': float(np.percentile(v, 90)),
+            'p99': float(np.percentile(v, 99)), 'max': float(v.max())}
+
+
+def git_version():
+    try:
+        return subprocess.run(['git', '-C', REPO, 'describe', '--always', '--dirty'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def wait_for_port(port, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.5).close()
+            return True
+        except OSError:
+            time.sleep(0.2)
+    return False
+
+
+def prepare(workdir, args):
+    """config.txt, capture, scoring.conf and a model in the scratch dir"""
+    os.makedirs(os.path.join(workdir, 'bench_logs'), exist_ok=True)
+    with open(os.path.join(workdir, 'config.txt'), 'w') as f:
+        # hiRateHz, loRateHz, maxLogFileKB, maxLogDirKB, maxTrainDirKB, captureSeconds (logger_config.KEYS)
+        f.write(f"{args.hi_rate}\n{args.lo_rate}\n{args.max_log_file_kb}\n100000\n1000000\n900\n")
+    with open(os.path.join(workdir, 'capture'), 'w') as f:
+        f.write("1\n")
+    if args.scoring:
+        shutil.copy(args.scoring, os.path.join(workdir, 'scoring.conf'))
+    else:
+        with open(os.path.join(workdir, 'scoring.conf'), 'w') as f:
+            f.write(FORCED_ALARM)
+
+    model = os.path.join(workdir, 'failure_model.npz')
+    if os.path.exists(model):
+        return
+    for d in filter(None, [args.model_dir, os.path.join(REPO, 'ML'), REPO]):
+        if os.path.exists(os.path.join(d, 'failure_model.npz')):
+            shutil.copy(os.path.join(d, 'failure_model.npz'), model)
+            return
+    print("No failure_model.npz found, training a small one (kept in the workdir for the next run)")
+    # at the bench's HF rate, predictive_maintain.py only scores rows at the rate the model was trained on
+    subprocess.run([sys.executable, OFFLINE, '--hours', '0.25', '--rate', str(args.hi_rate),
+                    '--out', 'training_data.csv', '--seed', '1'],
+                   cwd=workdir, check=True, stdout=subprocess.DEVNULL)
+    subprocess.run([sys.executable, TRAINER, 'training_data.csv'], cwd=workdir, check=True,
+                   stdout=subprocess.DEVNULL)
+
+
+def run(args):
+    workdir = args.workdir or tempfile.mkdtemp(prefix='bench_pipeline_')
+    os.makedirs(workdir, exist_ok=True)
+    for d in ('logs', 'train'):
+        shutil.rmtree(os.path.join(workdir, d), ignore_errors=True)
+    for f in ('status', 'upload_stats.csv', 'alert_state.json', 'predict_history.bin', 'predict_result.txt'):
+        if os.path.exists(os.path.join(workdir, f)):
+            os.remove(os.path.join(workdir, f))
+    shutil.rmtree(os.path.join(workdir, 'bench_logs'), ignore_errors=True)
+    prepare(workdir, args)
+    if wait_for_port(OPCUA_PORT, 0):
+        raise SystemExit(f"port {OPCUA_PORT} is in use, stop the running simulator first")
+
+    smtp = SmtpSink()
+    s3 = None if args.s3_endpoint else S3Sink()
+    env = dict(os.environ, PYTHONPATH=BEAGLEBONE, PYTHONUNBUFFERED='1',
+               SMTP_SERVER=smtp.host, SMTP_PORT=str(smtp.port), SMTP_STARTTLS='0', SMTP_PASSWORD='',
+               ALERT_COOLDOWN=str(args.alert_cooldown),
+               S3_ENDPOINT_URL=args.s3_endpoint or s3.url, S3_BUCKET=args.bucket,
+               AWS_ACCESS_KEY_ID=os.getenv('AWS_ACCESS_KEY_ID', 'bench'),
+               AWS_SECRET_ACCESS_KEY=os.getenv('AWS_SECRET_ACCESS_KEY', 'bench'))
+    if args.s3_endpoint:
+        import boto3
+        client = boto3.client('s3', endpoint_url=args.s3_endpoint, region_name='us-east-1',
+                              aws_access_key_id=env['AWS_ACCESS_KEY_ID'],
+                              aws_secret_access_key=env['AWS_SECRET_ACCESS_KEY'])
+        try:
+            client.create_bucket(Bucket=args.bucket)
+        except client.exceptions.BucketAlreadyOwnedByYou:
+            pass
+
+    print(f"Workdir {workdir}")
+    procs = {}
+    tail = cron = None
+    try:
+        sim_cmd = [sys.executable, SIMULATOR, '--rate', str(args.rate), '--machines', str(args.machines)]
+        if args.replay:
+            sim_cmd += ['--replay', args.replay, '--loop']  # the same rows every run
+        elif args.seed is not None:
+            sim_cmd += ['--seed', str(args.seed)]
+        procs['simulator'] = Proc('simulator', sim_cmd, workdir, env)
+        if not wait_for_port(OPCUA_PORT, 30):
+            raise SystemExit("simulator did not start, see bench_logs/simulator.log")
+        start = time.time()
+        measure_from = int((start + args.warmup) * 1e6)
+        tail = DiskTail(workdir, 1e6 / args.hi_rate, measure_from)
+        tail.start()
+        procs['collector'] = Proc('collector', [sys.executable, '-m', 'collector', 'localhost',
+                                                '--publish-ms', str(args.publish_ms), '--report', '5'], workdir, env)
+        procs['predictive_maintain'] = Proc('predictive_maintain', [sys.executable, PREDICT, '--stream'], workdir, env)
+        cron = UploadCron(workdir, env, args.upload_every)
+        cron.start()
+
+        next_rotate = start + args.rotate_every
+        end = start + args.warmup + args.duration
+        while time.time() < end:
+            for name, p in procs.items():
+                if not p.running():
+                    raise SystemExit(f"{name} exited early, see {workdir}/bench_logs/{name}.log")
+            if args.rotate_every and time.time() >= next_rotate:
+                rotate_capture(workdir)
+                next_rotate += args.rotate_every
+            time.sleep(0.1)
+        measured = time.time() - start - args.warmup
+    finally:
+        # collector first so it closes its files, then what reads them
+        for name in ('collector', 'predictive_maintain', 'simulator'):
+            if name in procs:
+                procs[name].stop()
+        if tail:
+            tail.stop()
+        if cron:
+            cron.stop()
+        smtp.close()
+        if s3:
+            s3.close()
+
+    return collect(args, workdir, procs, tail, cron, smtp, s3, measured, measure_from)
+
+
+def rotate_capture(workdir):
+    """capture off and on, so the collector closes its train/ file and upload.py has it to send"""
+    path = os.path.join(workdir, 'capture')
+    for flag in ('0', '1'):
+        with open(path + '.tmp', 'w') as f:
+            f.write(flag + '\n')
+        os.replace(path + '.tmp', path)
+        time.sleep(0.3)
+
+
+def collect(args, workdir, procs, tail, cron, smtp, s3, measured, measure_from):
+    rec = status.StatusReader(os.path.join(workdir, 'status')).read() or {}
+    alert_latency = []
+    for received, message in smtp.events:
+        m = ALERT_TIME.search(message)
+        if m:
+            sample = datetime.strptime(m.group(1), '%Y-%m-%d %H:%M:%S.%f').timestamp()
+            if sample * 1e6 >= measure_from:
+                alert_latency.append((received - sample) * 1e3)
+
+    sent_bytes = sent_seconds = files = 0
+    stats = os.path.join(workdir, 'upload_stats.csv')
+    if os.path.exists(stats):
+        with open(stats) as f:
+            next(f)
+            for line in f:
+                _, n, _, nbytes, seconds, _ = line.strip().split(',')
+                files += int(n)
+                sent_bytes += int(nbytes)
+                sent_seconds += float(seconds)
+
+    processes = {name: p.usage for name, p in procs.items()}
+    processes['upload'] = cron.usage()
+    for u in processes.values():
+        u['cpu_percent'] = 100 * u['cpu_s'] / u['wall_s'] if u['wall_s'] else 0.0
+
+    return {
+        'version': git_version(),
+        'time': datetime.now().isoformat(timespec='seconds'),
+        'host': {'machine': platform.machine(), 'python': platform.python_version(), 'cpus': os.cpu_count()},
+        'params': {k: v for k, v in vars(args).items() if k not in ('out', 'compare', 'workdir')},
+        'measured_s': measured,
+        'samples': {
+            'target_per_s': args.rate,
+            'collector_received': rec.get('rows_read', 0),
+            'hf_rows_per_s': tail.rows['train'] / measured,
+            'lf_rows_per_s': tail.rows['logs'] / measured,
+            'dropped_sequence': rec.get('read_errors', 0),
+            'dropped_hf_gaps': tail.gap_rows,
+            'repeated_rows': tail.repeated,
+            'malformed_rows': tail.malformed,
+        },
+        'latency_ms': {
+            'sample_to_disk_hf': percentiles(tail.latency['train']),
+            'sample_to_disk_lf': percentiles(tail.latency['logs']),
+            'sample_to_alert': percentiles(alert_latency),
+        },
+        'alerts': len(smtp.events),
+        'upload': {
+            'files': files, 'bytes': sent_bytes, 'seconds': sent_seconds,
+            'mb_per_s': sent_bytes / sent_seconds / 1e6 if sent_seconds else 0.0,
+            'sink_objects': len(s3.events) if s3 else None,
+            'sink_bytes': sum(e[3] for e in s3.events) if s3 else None,
+        },
+        'processes': processes,
+    }
+
+
+def flatten(d, prefix=''):
+    out = {}
+    for k, v in d.items():
+        if isinstance(v, dict):
+            out.update(flatten(v, f"{prefix}{k}."))
+        elif isinstance(v, (int, float)) and not isinstance(v, bool):
+            out[f"{prefix}{k}"] = v
+    return out
+
+
+def compare(old, new):
+    """every numeric result that is in both, old -> new and the change"""
+    a, b = flatten(old), flatten(new)
+    print(f"\n{old['version']} -> {new['version']}")
+    for key in (k for k in b if k in a and not k.startswith(('params.', 'host.')) and not k.endswith('.exit')):
+        change = f"{(b[key] - a[key]) / a[key] * 100:+7.1f}%" if a[key] else ''
+        print(f"  {key:42s} {a[key]:12.3f} -> {b[key]:12.3f} {change}")
+
+
+def summary(r):
+    s, lat, up = r['samples'], r['latency_ms'], r['upload']
+    print(f"\n{r['version']}: {r['measured_s']:.0f}s at {s['target_per_s']:g}Hz")
+    print(f"  rows/s         hf {s['hf_rows_per_s']:.1f}  lf {s['lf_rows_per_s']:.1f}  "
+          f"(collector received {s['collector_received']})")
+    print(f"  dropped        {s['dropped_sequence']} by sequence, {s['dropped_hf_gaps']} by hf timestamps, "
+          f"{s['repeated_rows']} repeated, {s['malformed_rows']} malformed")
+    for name, p in lat.items():
+        if p['n']:
+            print(f"  {name:18s} p50 {p['p50']:7.1f}ms  p90 {p['p90']:7.1f}ms  p99 {p['p99']:7.1f}ms  "
+                  f"max {p['max']:7.1f}ms  (n={p['n']})")
+        else:
+            print(f"  {name:18s} no samples")
+    print(f"  upload         {up['files']} files, {up['bytes'] / 1e6:.2f}MB at {up['mb_per_s']:.2f}MB/s")
+    for name, p in r['processes'].items():
+        print(f"  {name:20s} cpu {p['cpu_s']:6.2f}s ({p['cpu_percent']:5.1f}%)  rss {p['max_rss_mb']:6.1f}MB")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark simulator -> collector -> disk -> S3 / alert")
+    parser.add_argument('--duration', type=float, default=60, help="measured seconds (after --warmup)")
+    parser.add_argument('--warmup', type=float, default=10, help="seconds ignored at the start")
+    parser.add_argument('--rate', type=float, default=100, help="simulator sample rate (Hz)")
+    parser.add_argument('--machines', type=int, default=1, help="simulated machines (only the first is logged)")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--replay', help="serve this recorded capture (file or dir, looped) instead of simulating")
+    parser.add_argument('--hi-rate', type=int, default=None, help="config.txt hiRateHz (default --rate)")
+    parser.add_argument('--lo-rate', type=int, default=4, help="config.txt loRateHz")
+    parser.add_argument('--max-log-file-kb', type=int, default=4, help="config.txt maxLogFileKB")
+    parser.add_argument('--publish-ms', type=float, default=100, help="collector publishing interval")
+    parser.add_argument('--upload-every', type=float, default=20, help="seconds between upload.py runs")
+    parser.add_argument('--rotate-every', type=float, default=20,
+                        help="toggle capture this often so train/ files get closed and uploaded (0 = never)")
+    parser.add_argument('--alert-cooldown', type=float, default=0, help="ALERT_COOLDOWN for predictive_maintain")
+    parser.add_argument('--scoring', help="scoring.conf to use instead of forcing the alarm on")
+    parser.add_argument('--model-dir', help="dir with failure_model.npz (default ML/, else one is trained)")
+    parser.add_argument('--s3-endpoint', help="external S3 stand-in (minio, moto_server) instead of the built in one")
+    parser.add_argument('--bucket', default='bench')
+    parser.add_argument('--workdir', help="scratch dir (default a new temp dir), a trained model there is reused")
+    parser.add_argument('--out', default='bench_results.json')
+    parser.add_argument('--compare', help="earlier results json to compare with")
+    args = parser.parse_args()
+    args.hi_rate = args.hi_rate or int(args.rate)
+
+    results = run(args)
+    with open(args.out, 'w') as f:
+        json.dump(results, f, indent=2)
+    summary(results)
+    print(f"\nwrote {args.out}")
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), results)
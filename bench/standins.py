@@ -0,0 +1,192 @@
+"""
+Local stand-ins for the pipeline's two network services, run as threads inside the benchmark
+
+- S3Sink: the part of the S3 REST API upload.py uses (put_object, multipart create/upload/complete/abort).
+  Bodies are read and counted, not stored
+- SmtpSink: plain SMTP (no TLS or auth), records every message
+
+Both keep an `events` list of (time received, ...) for the benchmark to measure against.
+"""
+
+import secrets
+import socketserver
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+
+class S3Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, boto3 pools its connections
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def read_body(self):
+        """request body size in bytes, the body itself is discarded"""
+        if 'chunked' in self.headers.get('Transfer-Encoding', ''):
+            size = 0
+            while True:
+                n = int(self.rfile.readline().split(b';')[0], 16)
+                self.rfile.read(n + 2)
+                size += n
+                if n == 0:
+                    while self.rfile.readline() not in (b'\r\n', b'\n', b''):
+                        pass # trailers
+                    break
+        else:
+            size = int(self.headers.get('Content-Length', 0))
+            remaining = size
+            while remaining:
+                remaining -= len(self.rfile.read(min(remaining, 1 << 20)))
+        # aws-chunked bodies carry their own framing, the object size is in a header
+        return int(self.headers.get('x-amz-decoded-content-length', size))
+
+    def reply(self, status=200, body=b'', headers=()):
+        self.send_response(status)
+        for k, v in headers:
+            self.send_header(k, v)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def target(self):
+        url = urlsplit(self.path)
+        bucket, _, key = url.path.lstrip('/').partition('/')
+        return bucket, key, parse_qs(url.query, keep_blank_values=True)
+
+    def do_PUT(self):
+        bucket, key, q = self.target()
+        size = self.read_body()
+        etag = f'"{secrets.token_hex(16)}"'
+        if 'uploadId' in q:
+            self.server.sink.part(q['uploadId'][0], int(q['partNumber'][0]), size)
+        elif key:
+            self.server.sink.put(bucket, key, size)
+        self.reply(headers=[('ETag', etag)])
+
+    def do_POST(self):
+        bucket, key, q = self.target()
+        self.read_body()
+        sink = self.server.sink
+        if 'uploads' in q:
+            upload_id = sink.create(bucket, key)
+            xml = (f'<?xml version="1.0" encoding="UTF-8"?><InitiateMultipartUploadResult><Bucket>{bucket}</Bucket>'
+                   f'<Key>{key}</Key><UploadId>{upload_id}</UploadId></InitiateMultipartUploadResult>')
+        elif 'uploadId' in q:
+            if not sink.complete(q['uploadId'][0]):
+                self.reply(404, b'<?xml version="1.0" encoding="UTF-8"?><Error><Code>NoSuchUpload</Code></Error>')
+                return
+            xml = (f'<?xml version="1.0" encoding="UTF-8"?><CompleteMultipartUploadResult><Bucket>{bucket}</Bucket>'
+                   f'<Key>{key}</Key><ETag>"{secrets.token_hex(16)}-1"</ETag></CompleteMultipartUploadResult>')
+        else:
+            self.reply(400)
+            return
+        self.reply(body=xml.encode(), headers=[('Content-Type', 'application/xml')])
+
+    def do_DELETE(self):
+        _, _, q = self.target()
+        if 'uploadId' in q:
+            self.server.sink.abort(q['uploadId'][0])
+        self.reply(204)
+
+    def do_HEAD(self):
+        self.reply()
+
+    def do_GET(self):
+        self.reply(body=b'<?xml version="1.0" encoding="UTF-8"?><ListBucketResult></ListBucketResult>',
+                   headers=[('Content-Type', 'application/xml')])
+
+
+class S3Sink:
+    """events: (time, bucket, key, bytes) per completed object"""
+    def __init__(self, host='127.0.0.1', port=0):
+        self.lock = threading.Lock()
+        self.events = []
+        self.uploads = {}
+        self.server = ThreadingHTTPServer((host, port), S3Handler)
+        self.server.daemon_threads = True
+        self.server.sink = self
+        self.url = f"http://{host}:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, name='s3sink', daemon=True).start()
+
+    def put(self, bucket, key, size):
+        with self.lock:
+            self.events.append((time.time(), bucket, key, size))
+
+    def create(self, bucket, key):
+        upload_id = secrets.token_hex(8)
+        with self.lock:
+            self.uploads[upload_id] = (bucket, key, {})
+        return upload_id
+
+    def part(self, upload_id, n, size):
+        with self.lock:
+            if upload_id in self.uploads:
+                self.uploads[upload_id][2][n] = size
+
+    def complete(self, upload_id):
+        with self.lock:
+            if upload_id not in self.uploads:
+                return False
+            bucket, key, parts = self.uploads.pop(upload_id)
+            self.events.append((time.time(), bucket, key, sum(parts.values())))
+        return True
+
+    def abort(self, upload_id):
+        with self.lock:
+            self.uploads.pop(upload_id, None)
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class SmtpHandler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(line.encode() + b'\r\n')
+
+    def handle(self):
+        self.reply('220 bench smtp sink')
+        data = None
+        for raw in self.rfile:
+            line = raw.decode(errors='replace').rstrip('\r\n')
+            if data is not None:
+                if line == '.':
+                    self.server.sink.received('\n'.join(data))
+                    data = None
+                    self.reply('250 OK')
+                else:
+                    data.append(line[1:] if line.startswith('..') else line)
+                continue
+            cmd = line[:4].upper()
+            if cmd in ('EHLO', 'HELO'):
+                self.reply('250 bench')
+            elif cmd == 'DATA':
+                data = []
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+            elif cmd == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('250 OK') # MAIL, RCPT, NOOP, RSET
+
+
+class SmtpSink:
+    """events: (time, message text) per message"""
+    def __init__(self, host='127.0.0.1', port=0):
+        self.lock = threading.Lock()
+        self.events = []
+        self.server = socketserver.ThreadingTCPServer((host, port), SmtpHandler)
+        self.server.daemon_threads = True
+        self.server.sink = self
+        self.host, self.port = host, self.server.server_address[1]
+        threading.Thread(target=self.server.serve_forever, name='smtpsink', daemon=True).start()
+
+    def received(self, message):
+        with self.lock:
+            self.events.append((time.time(), message))
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
@@ -1,4 +1,6 @@
+#define _DEFAULT_SOURCE // clock_gettime, usleep, PATH_MAX with -std=c11
 #include "opc.h"
+#include "status.h"
 #include <signal.h>
 #include <stdio.h>
 #include <stdlib.h>
@@ -24,6 +26,8 @@ typedef struct {
     int captureEnabled; // also unused at present
 } Config;
 
+#define LIVE_DATA_HZ 5 // live_data render and config.txt/capture re-read rate
+
 // volatile=signal safe
 static volatile sig_atomic_t g_keepRunning = 1;
 
@@ -47,6 +51,18 @@ void on_term(int sig) {
     (void)sig; g_keepRunning = 0;
 }
 
+static unsigned long long now_us(void) {
+    struct timespec ts;
+    clock_gettime(CLOCK_MONOTONIC, &ts);
+    return (unsigned long long)ts.tv_sec * 1000000ULL + ts.tv_nsec / 1000;
+}
+
+static unsigned long long wall_us(void) {
+    struct timespec ts;
+    clock_gettime(CLOCK_REALTIME, &ts);
+    return (unsigned long long)ts.tv_sec * 1000000ULL + ts.tv_nsec / 1000;
+}
+
 // open a NEW file with timestamp prefix
 static FILE* rotate_file(const char *dir, const char *prefix) {
     char fname[128];
@@ -55,6 +71,106 @@ static FILE* rotate_file(const char *dir, const char *prefix) {
     return fopen(fname, "w");
 }
 
+// human readable dashboard, rendered LIVE_DATA_HZ times a second rather than on every sample
+static void render_live_data(const LogRow *row, const Config *cfg, int cap, const StatusRecord *st) {
+    FILE *lf = fopen("live_data.tmp", "w");
+    if (lf) { // TODO: make formatting better and not just clone of csv
+
+        fprintf(lf,"raw csv most recent data:\n");
+        fprintf(lf, "%llu,%.2f,%.2f,%.2f,%.2f,%s,%d\n",
+            row->ts_us, row->melt_temp,
+            row->inj_press, row->vib_amp,
+            row->vib_freq, row->stage, row->failure_label);
+
+
+        FILE *mlf = fopen("/home/debian/predict_result.txt", "r");
+        if (mlf) {
+            char mlbuf[128];
+            if (fgets(mlbuf, sizeof(mlbuf), mlf)) {
+                fprintf(lf, "This is the most recent ML status of predictive maintenance:\n  *%s", mlbuf);
+            }
+            fclose(mlf);
+        } else {
+            fprintf(lf, "* No ML predictor running.\n");
+        }
+        
+
+        fprintf(lf, "\nTimestamp: %llu \tTemp=%.1f°C  \nPressure=%.1fpsi\tVib=%.2fg@%.1fHz\nStage=%s\n",
+            row->ts_us, row->melt_temp, row->inj_press,
+            row->vib_amp, row->vib_freq, row->stage);
+
+        fprintf(lf, "\nConfig: \n  HiHz\t\t%d\n  LoHz\t\t%d\n  maxLogFileKB\t%d\n  maxLogDirKB\t%d\n  maxTrainDirKB\t%d\n  CaptureSec\t%d (unused)\n  CaptureEnable\t%d (unused)\n", 
+            cfg->hiRateHz, cfg->loRateHz, cfg->maxLogFileKB, cfg->maxLogDirKB, 
+            cfg->maxTrainDirKB, cfg->captureSeconds, cfg->captureEnabled);
+        fprintf(lf, "Capture mode: %s\n", cap ? "Training Mode (HF) and LF logging" : "Logging only (No HF data)");
+        fprintf(lf, "Measured read rate: %.1fHz (%llu rows, %llu read errors)\n", st ? st->read_hz : 0.0,
+            st ? (unsigned long long)st->rows_read : 0ULL, st ? (unsigned long long)st->read_errors : 0ULL);
+
+        // calculate dir sizes
+        int totalLogKB = dir_usage_kb("logs");
+        int totalTrainKB = dir_usage_kb("train");
+
+        fprintf(lf,"Total Log dir usage:   %dKB / %dKB (%d%% of cap)\n", totalLogKB, cfg->maxLogDirKB, cfg->maxLogDirKB ? (totalLogKB * 100 / cfg->maxLogDirKB): 0);
+        fprintf(lf,"Total Train dir usage: %dKB / %dKB (%d%% of cap)\n", totalTrainKB, cfg->maxTrainDirKB, cfg->maxTrainDirKB ? (totalTrainKB * 100 / cfg->maxTrainDirKB): 0);
+
+        fprintf(lf, "Bytes/KBytes per second LF: %dB/s, %.2fKB/s\n", 
+            cfg->loRateHz * sizeof(LogRow),
+            (float)(cfg->loRateHz * sizeof(LogRow)) / 1024.0);
+        fprintf(lf, "Bytes/KBytes per second HF: %dB/s, %.2fKB/s\n", 
+            cfg->hiRateHz * sizeof(LogRow),
+            (float)(cfg->hiRateHz * sizeof(LogRow)) / 1024.0);
+
+        // not easy to calculate and not that useful
+        // would have to get the size of the most recent file in each dir
+        // fprintf(lf,"File rotation will take place in:\n");
+        // fprintf(lf, "  Log dir: %d seconds (most recent is X% full)\n", );
+        // fprintf(lf, "  Train dir: %d seconds (most recent is x% full)\n", );
+
+
+        fprintf(lf, "At current rates max cap will be full in:\n");
+        fprintf(lf, "  Log dir: %d seconds\n", (cfg->maxLogDirKB - totalLogKB) * 1024 / (cfg->loRateHz * sizeof(LogRow)));                
+        fprintf(lf, "  Train dir: %d seconds\n", (cfg->maxTrainDirKB - totalTrainKB) * 1024 / (cfg->hiRateHz * sizeof(LogRow)));
+
+        double bucketBytes = 5.0 * 1024 * 1024 * 1024;  // 5 GiB for AWS S3 free
+        double secsFor5GiB = bucketBytes / (sizeof(LogRow) * cfg->loRateHz);
+        fprintf(lf, "In order to fill the AWS S3 bucket (5GB), it will take %f seconds of LF data. (%f hours)\n", secsFor5GiB, secsFor5GiB / 3600.0);
+
+        fprintf(lf,"   The max time for the cron upload script should be: %d seconds to prevent reaching cap\n", (cfg->maxLogDirKB) * 1024 / (cfg->loRateHz * sizeof(LogRow)));
+
+
+
+        // This is for printing the amount of files stored in respective folders
+        // this is the "buffer" before the 5 minute cron job sends the data to the cloud
+        int logFileCnt = 0, trainDirCnt = 0;
+        {
+            DIR *d = opendir("logs");
+            struct dirent *de;
+            while (d && (de = readdir(d))) {
+                if (de->d_name[0] != '.') logFileCnt++;
+            }
+            if (d) closedir(d);
+        }
+        {
+            DIR *d = opendir("train");
+            struct dirent *de;
+            while (d && (de = readdir(d))) {
+                if (de->d_name[0] != '.') trainDirCnt++;
+            }
+            if (d) closedir(d);
+        }
+        fprintf(lf, "   Current bufferred files: logs=%d, train=%d\n", logFileCnt-1, trainDirCnt-1);
+
+        // cron is 5 minute locked so we can track in a basic basic way
+        time_t now = time(NULL);
+        int nextUpload = 300 - (now % 300);
+        fprintf(lf, "   Next upload in: %d seconds\n", nextUpload);
+        
+        fclose(lf);
+        // renamed into place so `watch cat live_data` never shows a half written file
+        rename("live_data.tmp", "live_data");
+    }
+}
+
 int main(int argc, char **argv) {
     if (argc < 2) { 
         fprintf(stderr, "Usage: %s <server-ip>\n", argv[0]);
@@ -82,6 +198,9 @@ int main(int argc, char **argv) {
     FILE *lf = fopen("live_data", "w");
     if (lf) fclose(lf);
 
+    // latest row and metrics for other processes (beaglebone/status.py), no text parsing needed
+    StatusRecord *st = status_open("status");
+
 
     // set up opcua client
     char url[256];
@@ -104,27 +223,35 @@ int main(int argc, char **argv) {
     FILE *train_fp = NULL;
     int prevCap = 0; // previous HF capture state (0=off, 1=on)
     unsigned long long tick = 0;
+    int cap = 0;
+    unsigned long long nextRefreshUs = 0; // config/capture/live_data refresh
+    unsigned long long rateStartUs = now_us(), rateStartRows = 0;
+    unsigned long long rowsRead = 0, readErrors = 0, lfRows = 0, hfRows = 0;
 
 
     // main loop
     while (g_keepRunning) {
-        // read primary config file
-        if (read_config("config.txt", &cfg) < 0) {
-            printf("config.txt missing, ending program.\n");
-            return -1;
-        } else {
-            // recalculate decimation in case rates changed
-            decimateN = cfg.hiRateHz / cfg.loRateHz;
-        }
+        // config files are re-read LIVE_DATA_HZ times a second, not on every sample
+        unsigned long long loopUs = now_us();
+        int refresh = loopUs >= nextRefreshUs;
+        if (refresh) {
+            nextRefreshUs = loopUs + 1000000ULL / LIVE_DATA_HZ;
+            // read primary config file
+            if (read_config("config.txt", &cfg) < 0) {
+                printf("config.txt missing, ending program.\n");
+                return -1;
+            } else {
+                // recalculate decimation in case rates changed
+                decimateN = cfg.hiRateHz / cfg.loRateHz;
+            }
 
-        // read capture config file
-        int cap = 0;
-        FILE *capf = fopen("capture", "r");
-        if (capf) { 
-            fscanf(capf, "%d", &cap); 
-            fclose(capf); 
-        
-        
+            // read capture config file
+            cap = 0;
+            FILE *capf = fopen("capture", "r");
+            if (capf) { 
+                fscanf(capf, "%d", &cap); 
+                fclose(capf); 
+            }
         }
         // On change, rotate train file
         if (cap && !prevCap) { // start capture
@@ -145,108 +272,55 @@ int main(int argc, char **argv) {
         // Read data from opcua server
         LogRow row;
         if (!opcua_read_row(client, &row)) {
+            readErrors++;
             continue;
 
         }
 
         // DATA READ SUCCESS HERE
-        
-        // live data write for watch current data
-        FILE *lf = fopen("live_data", "w");
-        if (lf) { // TODO: make formatting better and not just clone of csv
-
-            fprintf(lf,"raw csv most recent data:\n");
-            fprintf(lf, "%llu,%.2f,%.2f,%.2f,%.2f,%s,%d\n",
-                row.ts_us, row.melt_temp,
-                row.inj_press, row.vib_amp,
-                row.vib_freq, row.stage, row.failure_label);
-
-
-            FILE *mlf = fopen("/home/debian/predict_result.txt", "r");
-            if (mlf) {
-                char mlbuf[128];
-                if (fgets(mlbuf, sizeof(mlbuf), mlf)) {
-                    fprintf(lf, "This is the most recent ML status of predictive maintenance:\n  *%s", mlbuf);
-                }
-                fclose(mlf);
-            } else {
-                fprintf(lf, "* No ML predictor running.\n");
+        rowsRead++;
+        int logLF = tick % decimateN == 0;
+        int logHF = cap && train_fp;
+        lfRows += logLF;
+        hfRows += logHF;
+
+        // latest row into the status record, a few stores instead of rewriting live_data
+        if (st) {
+            status_begin(st);
+            st->ts_us = row.ts_us;
+            st->melt_temp = row.melt_temp;
+            st->inj_press = row.inj_press;
+            st->vib_amp = row.vib_amp;
+            st->vib_freq = row.vib_freq;
+            memcpy(st->stage, row.stage, sizeof(st->stage));
+            st->failure_label = row.failure_label;
+            st->updated_us = wall_us();
+            st->rows_read = rowsRead;
+            st->read_errors = readErrors;
+            st->lf_rows = lfRows;
+            st->hf_rows = hfRows;
+            st->capture = cap;
+            if (refresh) {
+                double secs = (loopUs - rateStartUs) / 1e6;
+                if (secs > 0) st->read_hz = (rowsRead - rateStartRows) / secs;
+                rateStartUs = loopUs;
+                rateStartRows = rowsRead;
+                st->hi_rate_hz = cfg.hiRateHz;
+                st->lo_rate_hz = cfg.loRateHz;
+                st->max_log_file_kb = cfg.maxLogFileKB;
+                st->max_log_dir_kb = cfg.maxLogDirKB;
+                st->max_train_dir_kb = cfg.maxTrainDirKB;
             }
-            
-
-            fprintf(lf, "\nTimestamp: %llu \tTemp=%.1f°C  \nPressure=%.1fpsi\tVib=%.2fg@%.1fHz\nStage=%s\n",
-                row.ts_us, row.melt_temp, row.inj_press,
-                row.vib_amp, row.vib_freq, row.stage);
-
-            fprintf(lf, "\nConfig: \n  HiHz\t\t%d\n  LoHz\t\t%d\n  maxLogFileKB\t%d\n  maxLogDirKB\t%d\n  maxTrainDirKB\t%d\n  CaptureSec\t%d (unused)\n  CaptureEnable\t%d (unused)\n", 
-                cfg.hiRateHz, cfg.loRateHz, cfg.maxLogFileKB, cfg.maxLogDirKB, 
-                cfg.maxTrainDirKB, cfg.captureSeconds, cfg.captureEnabled);
-            fprintf(lf, "Capture mode: %s\n", cap ? "Training Mode (HF) and LF logging" : "Logging only (No HF data)");
-
-            // calculate dir sizes
-            int totalLogKB = dir_usage_kb("logs");
-            int totalTrainKB = dir_usage_kb("train");
-
-            fprintf(lf,"Total Log dir usage:   %dKB / %dKB (%d%% of cap)\n", totalLogKB, cfg.maxLogDirKB, cfg.maxLogDirKB ? (totalLogKB * 100 / cfg.maxLogDirKB): 0);
-            fprintf(lf,"Total Train dir usage: %dKB / %dKB (%d%% of cap)\n", totalTrainKB, cfg.maxTrainDirKB, cfg.maxTrainDirKB ? (totalTrainKB * 100 / cfg.maxTrainDirKB): 0);
-
-            fprintf(lf, "Bytes/KBytes per second LF: %dB/s, %.2fKB/s\n", 
-                cfg.loRateHz * sizeof(LogRow),
-                (float)(cfg.loRateHz * sizeof(LogRow)) / 1024.0);
-            fprintf(lf, "Bytes/KBytes per second HF: %dB/s, %.2fKB/s\n", 
-                cfg.hiRateHz * sizeof(LogRow),
-                (float)(cfg.hiRateHz * sizeof(LogRow)) / 1024.0);
-
-            // not easy to calculate and not that useful
-            // would have to get the size of the most recent file in each dir
-            // fprintf(lf,"File rotation will take place in:\n");
-            // fprintf(lf, "  Log dir: %d seconds (most recent is X% full)\n", );
-            // fprintf(lf, "  Train dir: %d seconds (most recent is x% full)\n", );
-
-
-            fprintf(lf, "At current rates max cap will be full in:\n");
-            fprintf(lf, "  Log dir: %d seconds\n", (cfg.maxLogDirKB - totalLogKB) * 1024 / (cfg.loRateHz * sizeof(LogRow)));                
-            fprintf(lf, "  Train dir: %d seconds\n", (cfg.maxTrainDirKB - totalTrainKB) * 1024 / (cfg.hiRateHz * sizeof(LogRow)));
-
-            double bucketBytes = 5.0 * 1024 * 1024 * 1024;  // 5 GiB for AWS S3 free
-            double secsFor5GiB = bucketBytes / (sizeof(LogRow) * cfg.loRateHz);
-            fprintf(lf, "In order to fill the AWS S3 bucket (5GB), it will take %f seconds of LF data. (%f hours)\n", secsFor5GiB, secsFor5GiB / 3600.0);
-
-            fprintf(lf,"   The max time for the cron upload script should be: %d seconds to prevent reaching cap\n", (cfg.maxLogDirKB) * 1024 / (cfg.loRateHz * sizeof(LogRow)));
-
-
+            status_end(st);
+        }
 
-            // This is for printing the amount of files stored in respective folders
-            // this is the "buffer" before the 5 minute cron job sends the data to the cloud
-            int logFileCnt = 0, trainDirCnt = 0;
-            {
-                DIR *d = opendir("logs");
-                struct dirent *de;
-                while (d && (de = readdir(d))) {
-                    if (de->d_name[0] != '.') logFileCnt++;
-                }
-                if (d) closedir(d);
-            }
-            {
-                DIR *d = opendir("train");
-                struct dirent *de;
-                while (d && (de = readdir(d))) {
-                    if (de->d_name[0] != '.') trainDirCnt++;
-                }
-                if (d) closedir(d);
-            }
-            fprintf(lf, "   Current bufferred files: logs=%d, train=%d\n", logFileCnt-1, trainDirCnt-1);
-
-            // cron is 5 minute locked so we can track in a basic basic way
-            time_t now = time(NULL);
-            int nextUpload = 300 - (now % 300);
-            fprintf(lf, "   Next upload in: %d seconds\n", nextUpload);
-            
-            fclose(lf);
+        // live data write for watch current data
+        if (refresh) {
+            render_live_data(&row, &cfg, cap, st);
         }
 
         // Low-rate logging always always goes to log_fp
-        if (tick % decimateN == 0) {
+        if (logLF) {
             fprintf(log_fp, "%llu,%.2f,%.2f,%.2f,%.2f,%s,%u\n",
                     row.ts_us, row.melt_temp, row.inj_press,
                     row.vib_amp, row.vib_freq, row.stage, row.failure_label);
@@ -259,7 +333,7 @@ int main(int argc, char **argv) {
             }
         }
         // High-rate logging WHEN CAPTURING goes to train_fp
-        if (cap && train_fp) {
+        if (logHF) {
             fprintf(train_fp, "%llu,%.2f,%.2f,%.2f,%.2f,%s,%u\n",
                     row.ts_us, row.melt_temp, row.inj_press,
                     row.vib_amp, row.vib_freq, row.stage, row.failure_label);
@@ -274,6 +348,7 @@ int main(int argc, char **argv) {
     fclose(log_fp);
     if (train_fp) fclose(train_fp);
     opcua_disconnect(client);
+    status_close(st);
     return 0;
 }
 
@@ -0,0 +1,45 @@
+#define _DEFAULT_SOURCE // ftruncate with -std=c11
+#include "status.h"
+#include <fcntl.h>
+#include <stdio.h>
+#include <string.h>
+#include <sys/mman.h>
+#include <unistd.h>
+
+// create (or reuse) the status file and map it, NULL on failure (the logger runs without it)
+StatusRecord* status_open(const char *path) {
+    int fd = open(path, O_RDWR | O_CREAT, 0644);
+    if (fd < 0) {
+        perror("open status");
+        return NULL;
+    }
+    if (ftruncate(fd, sizeof(StatusRecord)) < 0) {
+        perror("ftruncate status");
+        close(fd);
+        return NULL;
+    }
+    StatusRecord *st = mmap(NULL, sizeof(StatusRecord), PROT_READ | PROT_WRITE, MAP_SHARED, fd, 0);
+    close(fd); // the mapping keeps the file open
+    if (st == MAP_FAILED) {
+        perror("mmap status");
+        return NULL;
+    }
+    memset(st, 0, sizeof(*st));
+    st->size = sizeof(StatusRecord);
+    st->version = STATUS_VERSION;
+    __atomic_store_n(&st->magic, STATUS_MAGIC, __ATOMIC_RELEASE); // readers ignore the file until this is set
+    return st;
+}
+
+void status_close(StatusRecord *st) {
+    if (st) munmap(st, sizeof(StatusRecord));
+}
+
+void status_begin(StatusRecord *st) {
+    __atomic_store_n(&st->seq, st->seq + 1, __ATOMIC_RELAXED); // odd = write in progress
+    __atomic_thread_fence(__ATOMIC_RELEASE);
+}
+
+void status_end(StatusRecord *st) {
+    __atomic_store_n(&st->seq, st->seq + 1, __ATOMIC_RELEASE);
+}
@@ -0,0 +1,48 @@
+// status.h
+// latest row and logger metrics in a small mmap'd file, read by beaglebone/status.py
+#ifndef STATUS_H
+#define STATUS_H
+
+#include <stdint.h>
+
+#define STATUS_MAGIC   0x31545342u // "BST1"
+#define STATUS_VERSION 1
+
+// fixed layout, little endian, every field naturally aligned (no compiler padding)
+// keep in sync with RECORD in beaglebone/status.py
+typedef struct {
+    uint32_t magic;
+    uint32_t version;
+    uint32_t seq;           // seqlock: odd while the logger is writing, readers retry
+    uint32_t size;          // sizeof(StatusRecord)
+    uint64_t ts_us;         // latest row
+    double   melt_temp;
+    double   inj_press;
+    double   vib_amp;
+    double   vib_freq;
+    uint64_t updated_us;    // wall clock of the last update
+    uint64_t rows_read;     // metrics since the logger started
+    uint64_t read_errors;
+    uint64_t lf_rows;
+    uint64_t hf_rows;
+    double   read_hz;       // measured sample rate
+    int32_t  hi_rate_hz;    // config
+    int32_t  lo_rate_hz;
+    int32_t  max_log_file_kb;
+    int32_t  max_log_dir_kb;
+    int32_t  max_train_dir_kb;
+    int32_t  capture;
+    int32_t  failure_label;
+    int32_t  reserved;
+    char     stage[32];
+} StatusRecord;
+
+_Static_assert(sizeof(StatusRecord) == 168, "StatusRecord layout changed, update status.py");
+
+StatusRecord* status_open(const char *path);
+void status_close(StatusRecord *st);
+// call around the field updates, readers see either the old or the new record
+void status_begin(StatusRecord *st);
+void status_end(StatusRecord *st);
+
+#endif // STATUS_H
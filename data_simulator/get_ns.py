@@ -18,4 +18,6 @@ for child in machine.get_children():
     name = child.get_display_name().Text
     nid  = child.nodeid.to_string()
     print(f"  {name:20s} - {nid}")
+    if name == "Snapshot":
+        print(f"  {'':20s}   {child.get_value()}")
 c.disconnect()
@@ -17,36 +17,122 @@ We simulate 6 data points per reading:
   - stage
   - timestamp
 
+Each reading is written as one batched write, along with a Snapshot array variable (ns=2;i=8 on the first
+machine) holding the whole row, see SNAPSHOT_FIELDS and decode_snapshot().
+
 Some sensor data ramps between states, some oscillate, and some remain constant.
-- runs at 100Hz
+- runs at 100Hz by default on a fixed step virtual clock (--rate, --speed for faster than real time)
 - may want to add many more random data points but these 6 are the core.
+
+  python injection_moulding.py --rate 1000 --seed 1          # 1kHz, reproducible
+  python injection_moulding.py --speed 10                    # 10x real time
+
+Fleet mode runs N independent machines in the one server (InjectionMouldingMachine, InjectionMouldingMachine_1, ...)
+for load testing the gateway, the first machine keeps the node ids the C logger expects:
+  python injection_moulding.py --machines 20 --extra-channels 4 --rate 100
+
+Offline mode (no server, see offline.py) writes labelled data as fast as numpy can make it:
+  python injection_moulding.py --offline 24 --out training_data.csv --seed 1
+
+Replay mode (see replay.py) serves recorded logger captures through the same nodes instead of simulating:
+  python injection_moulding.py --replay train/ --speed 10 --loop
 """
 
+import argparse
 import time
 import math
 import random
-from opcua import Server
-
-# Create and start OPC UA server
-server = Server()
-server.set_endpoint("opc.tcp://0.0.0.0:4840/freeopcua/server/")
-uri = "http://examples.freeopcua.github.io"
-idx = server.register_namespace(uri)
-objects = server.get_objects_node()
-machine = objects.add_object(idx, "InjectionMouldingMachine")
-melt_temp_var = machine.add_variable(idx, "MeltTemp", 0.0)
-injection_pressure_var = machine.add_variable(idx, "InjectionPressure", 0.0)
-vibration_amplitude_var = machine.add_variable(idx, "VibrationAmplitude", 0.0)
-vibration_frequency_var = machine.add_variable(idx, "VibrationFrequency", 0.0)
-stage_var = machine.add_variable(idx, "Stage", "")
-timestamp_var = machine.add_variable(idx, "Timestamp", 0.0)
-melt_temp_var.set_writable()
-injection_pressure_var.set_writable()
-vibration_amplitude_var.set_writable()
-vibration_frequency_var.set_writable()
-stage_var.set_writable()
-timestamp_var.set_writable()
-server.start()
+from datetime import datetime
+from opcua import Server, ua
+
+# OPC UA server, created by start_server()
+server = None
+
+VARIABLES = ["MeltTemp", "InjectionPressure", "VibrationAmplitude", "VibrationFrequency", "Stage", "Timestamp"]
+
+# Snapshot is a Double array holding the whole reading, written in the same batch as the individual
+# variables, so a client reading just this node always gets a consistent row in one round trip
+# (reading the 6 variables separately can mix two readings, eg a new Timestamp with the old Stage)
+# extra channels follow the core fields, Sequence goes up by 1 per reading so gaps/repeats are visible
+SNAPSHOT_FIELDS = ["Sequence", "Timestamp", "MeltTemp", "InjectionPressure", "VibrationAmplitude",
+                   "VibrationFrequency", "StageCode"]
+
+def add_machine(idx, objects, name):
+    """one machine object with the 6 core variables and Snapshot, returns {variable name: node}"""
+    machine = objects.add_object(idx, name)
+    nodes = {"object": machine}
+    for var in VARIABLES:
+        nodes[var] = machine.add_variable(idx, var, "" if var == "Stage" else 0.0)
+        nodes[var].set_writable()
+    nodes["Snapshot"] = machine.add_variable(idx, "Snapshot", [0.0] * len(SNAPSHOT_FIELDS), ua.VariantType.Double)
+    nodes["Snapshot"].set_writable()
+    return nodes
+
+def write_batch(session, updates):
+    """
+    write [(node, ua.Variant), ...] with one WriteParameters request instead of a set_value per node
+    - all values share one source timestamp
+    """
+    stamp = datetime.utcnow()
+    params = ua.WriteParameters()
+    for node, variant in updates:
+        dv = ua.DataValue(variant)
+        dv.SourceTimestamp = stamp
+        wv = ua.WriteValue()
+        wv.NodeId = node.nodeid
+        wv.AttributeId = ua.AttributeIds.Value
+        wv.Value = dv
+        params.NodesToWrite.append(wv)
+    for status in session.write(params):
+        status.check()
+
+def publish_reading(nodes, sequence, now, stage, core, extra=()):
+    """
+    one reading as one write_batch: the 4 core values, extra (name, value) channels, Stage, Timestamp
+    and the Snapshot array, used by Machine and replay.py
+    """
+    extra = list(extra)
+    double = ua.VariantType.Double
+    updates = [(nodes[var], ua.Variant(float(v), double)) for var, v in zip(VARIABLES[:4], core)]
+    updates += [(nodes[name], ua.Variant(v, double)) for name, v in extra]
+    updates.append((nodes["Stage"], ua.Variant(stage, ua.VariantType.String)))
+    updates.append((nodes["Timestamp"], ua.Variant(now, double)))
+    snapshot = [float(sequence), now] + [float(v) for v in core] + [float(SNAPSHOT_STAGES.index(stage))]
+    updates.append((nodes["Snapshot"], ua.Variant(snapshot + [v for _, v in extra], double)))
+    write_batch(nodes["object"].server, updates)
+
+def decode_snapshot(values, extra_channels=0):
+    """Snapshot array -> dict, Stage as the name (StageCode indexes STAGE_ORDER + PartReplacement)"""
+    row = dict(zip(SNAPSHOT_FIELDS, values))
+    row["Sequence"] = int(row["Sequence"])
+    row["Stage"] = SNAPSHOT_STAGES[int(row.pop("StageCode"))]
+    for i in range(extra_channels):
+        row[f"Extra{i}"] = values[len(SNAPSHOT_FIELDS) + i]
+    return row
+
+def start_server(endpoint="opc.tcp://0.0.0.0:4840/freeopcua/server/", machines=1, extra_channels=0):
+    """
+    Create and start OPC UA server, returns the node dict of every machine
+    - kept out of import so offline.py can reuse the sensor models without opening a port
+    - the first machine is created first so its variables keep ns=2;i=2..7, which the C logger hardcodes
+    - machines after the first are InjectionMouldingMachine_1, _2, ...
+    """
+    global server
+    server = Server()
+    server.set_endpoint(endpoint)
+    uri = "http://examples.freeopcua.github.io"
+    idx = server.register_namespace(uri)
+    objects = server.get_objects_node()
+    fleet = [add_machine(idx, objects, "InjectionMouldingMachine")]
+    for m in range(1, machines):
+        fleet.append(add_machine(idx, objects, f"InjectionMouldingMachine_{m}"))
+    # extra channels go last so they don't shift the core node ids
+    for nodes in fleet:
+        for i in range(extra_channels):
+            nodes[f"Extra{i}"] = nodes["object"].add_variable(idx, f"Extra{i}", 0.0)
+            nodes[f"Extra{i}"].set_writable()
+    server.start()
+    return fleet
 
 SENSOR_RANGES = {
     "PreInjection": {
@@ -92,23 +178,47 @@ STAGE_DURATIONS = {
 }
 
 # ML/predictive maintenance model info
-machinePartFailureImminent = False
-cycles_since_imminent = 0
-cycles_to_failure = 0
 CYCLES_TO_FAILURE_MIN = 2
 CYCLES_TO_FAILURE_MAX = 8
 IMMINENT_PROB_PER_CYCLE = 0.2 # 20% chance at start of each cycle
 
 DRIFT_PERCENT = 0.15 # 15% drift in vibration amplitude if machine part failure is imminent
+ANOMALY_PROB = 0.1
+REPLACEMENT_SECONDS = 10
+STAGE_ORDER = ["PreInjection", "Injection", "Holding", "Cooling", "Waiting"]
+SNAPSHOT_STAGES = STAGE_ORDER + ["PartReplacement"] # same codes as hfbin/offline.py
+
+# stage behaviour as tables, used by Machine and offline.py
+# how each stage drives each channel (vibration_frequency is always the periodic model)
+STAGE_MODELS = {
+    "PreInjection": {"melt_temp": "up", "injection_pressure": "constant", "vibration_amplitude": "constant"},
+    "Injection": {"melt_temp": "constant", "injection_pressure": "up", "vibration_amplitude": "constant"},
+    "Holding": {"melt_temp": "constant", "injection_pressure": "constant", "vibration_amplitude": "constant"},
+    "Cooling": {"melt_temp": "down", "injection_pressure": "constant", "vibration_amplitude": "constant"},
+    "Waiting": {"melt_temp": "constant", "injection_pressure": "constant", "vibration_amplitude": "constant"},
+}
+# channel that gets the exponential anomaly (10% of stages)
+STAGE_ANOMALY = {"PreInjection": "vibration_amplitude", "Injection": "injection_pressure", "Holding": "vibration_amplitude"}
+# ramp stages end on the first reading that crosses (channel, threshold, direction), the rest are fixed length
+STAGE_EXIT = {
+    "PreInjection": ("melt_temp", 250, "above"),
+    "Injection": ("injection_pressure", 2000, "above"),
+    "Cooling": ("melt_temp", 50, "below"),
+}
 
-def simulate_ramped_sensor_value(value_range, current_time, stage_start, base_duration, ramp_direction, anomaly=False):
+def simulate_ramped_sensor_value(value_range, current_time, stage_start, base_duration, ramp_direction, anomaly=False, rng=random, randomize_duration=True):
     """
     - base_duration: the typical duration of this state, randomized with +-20% of base
     - anomaly: if True, apply an exponential multiplier to simulate runaway
     - with gaussian noise (~5% of the range) 
+    - rng: anything with uniform/gauss (a random.Random per machine), defaults to the global random module
+    - randomize_duration: False uses base_duration as is
     """
     # this randomizes the duration of the state
-    effective_duration = random.uniform(0.8 * base_duration, 1.2 * base_duration)
+    if randomize_duration:
+        effective_duration = rng.uniform(0.8 * base_duration, 1.2 * base_duration)
+    else:
+        effective_duration = base_duration
     low, high = value_range
     elapsed = current_time - stage_start
     progress = min(max(elapsed / effective_duration, 0.0), 1.0) # clamp to [0, 1]
@@ -128,10 +238,10 @@ def simulate_ramped_sensor_value(value_range, current_time, stage_start, base_du
         anomaly_factor = math.exp(elapsed / 2.0)
         base_value *= anomaly_factor
 
-    noise = random.gauss(0, abs(high - low) * 0.05) # noise factor
+    noise = rng.gauss(0, abs(high - low) * 0.05) # noise factor
     return base_value + noise
 
-def simulate_periodic_sensor_value(value_range, current_time, stage_start, period=2.0, anomaly=False):
+def simulate_periodic_sensor_value(value_range, current_time, stage_start, period=2.0, anomaly=False, rng=random):
     """
     This is for sensor that is a sine wave, with same exponential anomaly as the normal ramp
     """
@@ -147,266 +257,223 @@ def simulate_periodic_sensor_value(value_range, current_time, stage_start, perio
         anomaly_factor = math.exp(elapsed / 2.0)
         base_value *= anomaly_factor
 
-    noise = random.gauss(0, abs(high - low) * 0.05)
+    noise = rng.gauss(0, abs(high - low) * 0.05)
     return base_value + noise
 
-def run_preinjection():
-    """
-    - Ramp melt_temp from 50 to 250 (noisy and variable)
-    - Transition when melt_temp >= 250
-    - Other sensors run as constant/noisy
-    - 10% chance an anomaly is applied to vibration_amplitude
-    """
-    global machinePartFailureImminent
-    state = "PreInjection"
-    base_duration = STAGE_DURATIONS[state]
-    stage_start = time.time()
-    anomaly_vib = (random.random() < 0.1)
-    while True:
-        current_time = time.time()
-        # ramp melt_temp upward 
-        melt_temp = simulate_ramped_sensor_value(SENSOR_RANGES[state]["melt_temp"], current_time, stage_start, base_duration, "up")
-        # other sensors are constant
-        injection_pressure = simulate_ramped_sensor_value(SENSOR_RANGES[state]["injection_pressure"], current_time, stage_start, base_duration, "constant")
-        vibration_amplitude = simulate_ramped_sensor_value(SENSOR_RANGES[state]["vibration_amplitude"], current_time, stage_start, base_duration, "constant", anomaly=anomaly_vib)
-        if machinePartFailureImminent:
-            drift = 1 + DRIFT_PERCENT * ((current_time - stage_start) / base_duration)
-            vibration_amplitude *= drift
-        vibration_frequency = simulate_periodic_sensor_value(SENSOR_RANGES[state]["vibration_frequency"], current_time, stage_start, period=2.0)
-        reading = {
-            "timestamp": current_time,
-            "stage": state,
-            "melt_temp": melt_temp,
-            "injection_pressure": injection_pressure,
-            "vibration_amplitude": vibration_amplitude,
-            "vibration_frequency": vibration_frequency
-        }
-        # update opc ua
-        melt_temp_var.set_value(melt_temp)
-        injection_pressure_var.set_value(injection_pressure)
-        vibration_amplitude_var.set_value(vibration_amplitude)
-        vibration_frequency_var.set_value(vibration_frequency)
-        stage_var.set_value(state)
-        timestamp_var.set_value(current_time)
-        # transition when melt_temp reaches or exceeds 250
-        if melt_temp >= 250:
-            print(f"Transitioning from {state} after {current_time - stage_start:.2f} s (melt_temp={melt_temp:.2f}°C).")
-            break
-        time.sleep(0.01)  # 100Hz
-    # print(f"Exiting {state} state.")
-
-def run_injection():
-    """
-    - ramp injection_pressure from 500 to 2000 psi
-    - transition when injection_pressure >= 2000 psi
-    - other sensors behave constant/oscillatory
-    - 10% chance an anomaly is applied to injection_pressure
-    """
-    global machinePartFailureImminent
-    state = "Injection"
-    base_duration = STAGE_DURATIONS[state]
-    stage_start = time.time()
-    anomaly_inj = (random.random() < 0.1)
-    while True:
-        current_time = time.time()
-        melt_temp = simulate_ramped_sensor_value(SENSOR_RANGES[state]["melt_temp"], current_time, stage_start, base_duration, "constant")
-        # ramp injection_pressure upward
-        injection_pressure = simulate_ramped_sensor_value(SENSOR_RANGES[state]["injection_pressure"], current_time, stage_start, base_duration, "up", anomaly=anomaly_inj)
-        vibration_amplitude = simulate_ramped_sensor_value(SENSOR_RANGES[state]["vibration_amplitude"], current_time, stage_start, base_duration, "constant")
-        if machinePartFailureImminent:
-            drift = 1 + DRIFT_PERCENT * ((current_time - stage_start) / base_duration)
-            vibration_amplitude *= drift
-        vibration_frequency = simulate_periodic_sensor_value(SENSOR_RANGES[state]["vibration_frequency"], current_time, stage_start, period=2.0)
-        reading = {
-            "timestamp": current_time,
-            "stage": state,
-            "melt_temp": melt_temp,
-            "injection_pressure": injection_pressure,
-            "vibration_amplitude": vibration_amplitude,
-            "vibration_frequency": vibration_frequency
-        }
-        melt_temp_var.set_value(melt_temp)
-        injection_pressure_var.set_value(injection_pressure)
-        vibration_amplitude_var.set_value(vibration_amplitude)
-        vibration_frequency_var.set_value(vibration_frequency)
-        stage_var.set_value(state)
-        timestamp_var.set_value(current_time)
-        if injection_pressure >= 2000:
-            print(f"Transitioning from {state} after {current_time - stage_start:.2f} s (injection_pressure={injection_pressure:.2f} psi).")
-            break
-        time.sleep(0.01)
-    # print(f"Exiting {state} state.")
-
-def run_holding():
+class Machine:
     """
-    - Fixed to 3 seconds
-    - Sensor values constant
-    - 10% chance an anomaly is applied to vibration_amplitude
+    One simulated press as a non blocking state machine, so many can share one process
+    - tick(now) makes one reading and moves on to the next stage when the current one is done
+    - each stage draws from its own random.Random (and the failure cycle from another), so a seeded run
+      gives the same readings for a stage no matter how the other stages used their randomness
     """
-    global machinePartFailureImminent
-    state = "Holding"
-    duration = STAGE_DURATIONS[state]
-    stage_start = time.time()
-    anomaly_hold = (random.random() < 0.1)
-    while time.time() - stage_start < duration:
-        current_time = time.time()
-        melt_temp = simulate_ramped_sensor_value(SENSOR_RANGES[state]["melt_temp"], current_time, stage_start, duration, "constant")
-        injection_pressure = simulate_ramped_sensor_value(SENSOR_RANGES[state]["injection_pressure"], current_time, stage_start, duration, "constant")
-        vibration_amplitude = simulate_ramped_sensor_value(SENSOR_RANGES[state]["vibration_amplitude"], current_time, stage_start, duration, "constant", anomaly=anomaly_hold)
-        if machinePartFailureImminent:
-            drift = 1 + DRIFT_PERCENT * ((current_time - stage_start) / duration)
-            vibration_amplitude *= drift
-        vibration_frequency = simulate_periodic_sensor_value(SENSOR_RANGES[state]["vibration_frequency"], current_time, stage_start, period=2.0)
-        reading = {
-            "timestamp": current_time,
-            "stage": state,
-            "melt_temp": melt_temp,
-            "injection_pressure": injection_pressure,
-            "vibration_amplitude": vibration_amplitude,
-            "vibration_frequency": vibration_frequency
-        }
-        melt_temp_var.set_value(melt_temp)
-        injection_pressure_var.set_value(injection_pressure)
-        vibration_amplitude_var.set_value(vibration_amplitude)
-        vibration_frequency_var.set_value(vibration_frequency)
-        stage_var.set_value(state)
-        timestamp_var.set_value(current_time)
-        time.sleep(0.01)
-    print(f"Exiting {state} state after {time.time() - stage_start:.2f} s.")
-
-def run_cooling():
+    def __init__(self, nodes, name="", seed=None):
+        self.nodes = nodes
+        self.name = name
+        self.extra = [k for k in nodes if k.startswith("Extra")]
+        # string seeds hash deterministically, None seeds each stream from the OS
+        key = lambda part: None if seed is None else f"{seed}:{name}:{part}"
+        self.cycle_rng = random.Random(key("cycle"))
+        self.stage_rngs = {stage: random.Random(key(stage)) for stage in STAGE_ORDER}
+        self.extra_rng = random.Random(key("extra"))
+        self.sequence = 0
+        self.rng = self.cycle_rng
+        self.failure_imminent = False
+        self.cycles_since_imminent = 0
+        self.cycles_to_failure = 0
+        self.stage = None
+        self.stage_index = 0
+        self.stage_start = 0.0
+        self.duration = 0.0
+        self.anomaly = False
+
+    def start_cycle(self, now):
+        # At beginning of each cycle, we check if a failure is imminent
+        if not self.failure_imminent and self.cycle_rng.random() < IMMINENT_PROB_PER_CYCLE:
+            self.failure_imminent = True
+            self.cycles_since_imminent = 0
+            self.cycles_to_failure = self.cycle_rng.randint(CYCLES_TO_FAILURE_MIN, CYCLES_TO_FAILURE_MAX)
+            print(f"{self.name}: part failure imminent, in {self.cycles_to_failure} cycles")
+        self.start_stage(0, now)
+
+    def start_stage(self, index, now):
+        self.stage_index = index
+        self.stage = STAGE_ORDER[index]
+        self.stage_start = now
+        self.rng = self.stage_rngs[self.stage]
+        base = STAGE_DURATIONS[self.stage]
+        # Cooling picks its ramp duration once per stage (so it can't get stuck), the others redraw it on every reading
+        self.duration = self.rng.uniform(0.8 * base, 1.2 * base) if self.stage == "Cooling" else base
+        self.anomaly = self.stage in STAGE_ANOMALY and self.rng.random() < ANOMALY_PROB
+
+    def end_cycle(self, now):
+        if self.failure_imminent:
+            self.cycles_since_imminent += 1
+            # trigger failure after a certain number of cycles (defined randomly in a range)
+            if self.cycles_since_imminent >= self.cycles_to_failure:
+                print(f"{self.name}: part has failed, stopping for replacement")
+                # the stage is PartReplacement since the part is broken
+                # this is used by the ML model to predict this stage happening
+                self.stage = "PartReplacement"
+                self.stage_start = now
+                self.failure_imminent = False
+                self.publish({"melt_temp": 0.0, "injection_pressure": 0.0, "vibration_amplitude": 0.0,
+                              "vibration_frequency": 0.0}, now)
+                return
+        self.start_cycle(now)
+
+    def reading(self, now):
+        state = self.stage
+        ranges = SENSOR_RANGES[state]
+        values = {}
+        for ch, direction in STAGE_MODELS[state].items():
+            values[ch] = simulate_ramped_sensor_value(ranges[ch], now, self.stage_start, self.duration, direction,
+                                                      anomaly=self.anomaly and STAGE_ANOMALY.get(state) == ch,
+                                                      rng=self.rng, randomize_duration=state != "Cooling")
+        if self.failure_imminent:
+            values["vibration_amplitude"] *= 1 + DRIFT_PERCENT * ((now - self.stage_start) / self.duration)
+        values["vibration_frequency"] = simulate_periodic_sensor_value(ranges["vibration_frequency"], now, self.stage_start, period=2.0, rng=self.rng)
+        return values
+
+    def tick(self, now):
+        """one reading, returns the values or None while the part is being replaced (values stay frozen)"""
+        if self.stage is None:
+            self.start_cycle(now)
+        if self.stage == "PartReplacement":
+            if now - self.stage_start < REPLACEMENT_SECONDS:
+                return None
+            self.start_cycle(now)
+
+        values = self.reading(now)
+        self.publish(values, now)
+
+        if self.stage in STAGE_EXIT:
+            ch, threshold, side = STAGE_EXIT[self.stage]
+            done = values[ch] >= threshold if side == "above" else values[ch] <= threshold
+        else:
+            done = now - self.stage_start >= self.duration
+        if done:
+            if self.stage_index + 1 < len(STAGE_ORDER):
+                self.start_stage(self.stage_index + 1, now)
+            else:
+                self.end_cycle(now)
+        return values
+
+    def publish(self, values, now):
+        """one batched write of every variable plus the Snapshot array"""
+        self.sequence += 1
+        core = [values["melt_temp"], values["injection_pressure"], values["vibration_amplitude"],
+                values["vibration_frequency"]]
+        # extra channels are just noisy slow sine waves, they exist to add load
+        extra = [math.sin(now / (2.0 + i)) + self.extra_rng.gauss(0, 0.05) for i in range(len(self.extra))]
+        publish_reading(self.nodes, self.sequence, now, self.stage, core, zip(self.extra, extra))
+
+class SimClock:
     """
-    - ramp melt_temp down from 100 to 50
-    - transition when melt_temp <= 50
-    - 10% chance an anomaly is applied to melt_temp
+    Fixed step virtual clock
+    - tick k is at exactly start + k / rate of simulated time, so readings never drift however long
+      each update takes (the old loops did time.time() + sleep(0.01) and fell well below 100Hz)
+    - wait() sleeps until tick k is due on the wall clock at `speed` x real time, sleeping to the deadline
+      compensates for the work done in between
+    - speed=0 runs as fast as possible (no sleeping at all)
     """
-    global machinePartFailureImminent
-    state = "Cooling"
-    base_duration = STAGE_DURATIONS[state]
-    effective_duration = random.uniform(0.8 * base_duration, 1.2 * base_duration) # some variation for fun
-
-    orig_uniform = random.uniform
-    random.uniform = lambda a, b: effective_duration # stupid fix to resolve sim getting stuck in cooling state
-
-    stage_start = time.time()
-    anomaly_cool = (random.random() < 0.1)
-    while True:
-        current_time = time.time()
-        # elapsed = current_time - stage_start
-        melt_temp = simulate_ramped_sensor_value(SENSOR_RANGES[state]["melt_temp"], current_time, stage_start, effective_duration, "down")
-        injection_pressure = simulate_ramped_sensor_value(SENSOR_RANGES[state]["injection_pressure"],current_time, stage_start, effective_duration,"constant")
-        vibration_amplitude = simulate_ramped_sensor_value(SENSOR_RANGES[state]["vibration_amplitude"],current_time, stage_start, effective_duration, "constant")
-        if machinePartFailureImminent:
-            drift = 1 + DRIFT_PERCENT * ((current_time - stage_start) / effective_duration)
-            vibration_amplitude *= drift
-        vibration_frequency = simulate_periodic_sensor_value(SENSOR_RANGES[state]["vibration_frequency"],current_time, stage_start, period=2.0)
-        reading = {
-            "timestamp": current_time,
-            "stage": state,
-            "melt_temp": melt_temp,
-            "injection_pressure": injection_pressure,
-            "vibration_amplitude": vibration_amplitude,
-            "vibration_frequency": vibration_frequency
-        }
-        melt_temp_var.set_value(melt_temp)
-        injection_pressure_var.set_value(injection_pressure)
-        vibration_amplitude_var.set_value(vibration_amplitude)
-        vibration_frequency_var.set_value(vibration_frequency)
-        stage_var.set_value(state)
-        timestamp_var.set_value(current_time)
-        if melt_temp <= 50:
-            print(f"Transitioning from {state} after {effective_duration:.2f} s (melt_temp={melt_temp:.2f}°C).")
-            break
-        time.sleep(0.01)
-    random.uniform = orig_uniform
-    # print(f"Exiting {state} state.")
-
-def run_waiting():
+    def __init__(self, rate, speed=1.0, start=None, max_lag=1.0):
+        self.rate = float(rate)
+        self.speed = float(speed)
+        self.start = time.time() if start is None else float(start)
+        self.max_lag = max_lag
+        self.tick = 0
+        self.wall_start = time.monotonic()
+        self.late_ticks = 0
+
+    def now(self):
+        """simulated unix time of the current tick"""
+        return self.start + self.tick / self.rate
+
+    def wait(self):
+        """advance to the next tick, sleeping until it is due"""
+        self.tick += 1
+        if self.speed <= 0:
+            return
+        due = self.wall_start + self.tick / (self.rate * self.speed)
+        delay = due - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        else:
+            self.late_ticks += 1
+            if -delay > self.max_lag:
+                # too far behind to catch up, move the schedule instead of bursting
+                # (simulated time is unaffected, it is always tick / rate)
+                self.wall_start += -delay
+
+    def achieved_rate(self, ticks, wall_seconds):
+        return ticks / wall_seconds if wall_seconds > 0 else 0.0
+
+def machine_name(i):
+    return "InjectionMouldingMachine" if i == 0 else f"InjectionMouldingMachine_{i}"
+
+def run_fleet(fleet, rate=100, seed=None, speed=1.0, start=None, duration=None, report_every=10.0):
     """
-    - fixed to 30 seconds
-    - sensor values constant
+    Tick every machine from one loop on a SimClock
+    - prints achieved vs target update rate (and how many ticks ran late) every report_every seconds
+    - duration: stop after this many simulated seconds (None = forever), returns the overall achieved rate
     """
-    global machinePartFailureImminent
-    state = "Waiting"
-    duration = STAGE_DURATIONS[state]
-    stage_start = time.time()
-    while time.time() - stage_start < duration:
-        current_time = time.time()
-        melt_temp = simulate_ramped_sensor_value(SENSOR_RANGES[state]["melt_temp"], current_time, stage_start, duration, "constant")
-        injection_pressure = simulate_ramped_sensor_value(SENSOR_RANGES[state]["injection_pressure"], current_time, stage_start, duration, "constant")
-        vibration_amplitude = simulate_ramped_sensor_value(SENSOR_RANGES[state]["vibration_amplitude"], current_time, stage_start, duration, "constant")
-        if machinePartFailureImminent:
-            drift = 1 + DRIFT_PERCENT * ((current_time - stage_start) / duration)
-            vibration_amplitude *= drift
-        vibration_frequency = simulate_periodic_sensor_value(SENSOR_RANGES[state]["vibration_frequency"], current_time, stage_start, period=2.0)
-        reading = {
-            "timestamp": current_time,
-            "stage": state,
-            "melt_temp": melt_temp,
-            "injection_pressure": injection_pressure,
-            "vibration_amplitude": vibration_amplitude,
-            "vibration_frequency": vibration_frequency
-        }
-        melt_temp_var.set_value(melt_temp)
-        injection_pressure_var.set_value(injection_pressure)
-        vibration_amplitude_var.set_value(vibration_amplitude)
-        vibration_frequency_var.set_value(vibration_frequency)
-        stage_var.set_value(state)
-        timestamp_var.set_value(current_time)
-        time.sleep(0.01)
-    print(f"Exiting {state} state after {time.time() - stage_start:.2f} s.")
-
-def run_cycle():
-    """
-    PreInjection -> Injection -> Holding -> Cooling -> Waiting.
-    """
-    cycle_data = []
-    for fn in (run_preinjection, run_injection, run_holding, run_cooling, run_waiting):
-        fn() # run each cycle
-    return cycle_data
+    machines = [Machine(nodes, machine_name(i), seed) for i, nodes in enumerate(fleet)]
+    clock = SimClock(rate, speed, start)
+    target = rate * speed if speed > 0 else float("inf")
+    print(f"Running {len(machines)} machines at {rate:g}Hz simulated, "
+          f"{'as fast as possible' if speed <= 0 else f'{speed:g}x real time'}")
+    began = window_start = time.monotonic()
+    window_ticks = 0
+    while duration is None or clock.tick < duration * rate:
+        now = clock.now()
+        for m in machines:
+            m.tick(now)
+        clock.wait()
+        window_ticks += 1
+        elapsed = time.monotonic() - window_start
+        if elapsed >= report_every:
+            print(f"achieved {clock.achieved_rate(window_ticks, elapsed):.1f} ticks/s per machine "
+                  f"(target {target:g}), {window_ticks * len(machines) / elapsed:.0f} updates/s, "
+                  f"{clock.late_ticks} late ticks")
+            window_start, window_ticks = time.monotonic(), 0
+    return clock.achieved_rate(clock.tick, time.monotonic() - began)
 
 def main():
-    global machinePartFailureImminent, cycles_since_imminent, cycles_to_failure
-
+    parser = argparse.ArgumentParser(description="Injection moulding machine OPC-UA simulator")
+    parser.add_argument('--rate', type=float, default=100, help="simulated sample rate (Hz), 1000+ is fine")
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help="simulated seconds per real second, 0 = as fast as possible")
+    parser.add_argument('--seed', type=int, default=None, help="RNG seed for a reproducible run")
+    parser.add_argument('--start', type=float, default=None, help="simulated unix time of the first reading (default now)")
+    parser.add_argument('--duration', type=float, default=None, help="stop after this many simulated seconds")
+    parser.add_argument('--machines', type=int, default=1, help="independent machines to serve from one loop")
+    parser.add_argument('--extra-channels', type=int, default=0, help="extra sensor variables per machine")
+    parser.add_argument('--offline', type=float, metavar='HOURS',
+                        help="don't serve, write HOURS of simulated data to --out as fast as possible")
+    parser.add_argument('--out', default='training_data.csv', help="offline output file (.csv or .hfb)")
+    parser.add_argument('--replay', nargs='+', metavar='CAPTURE',
+                        help="serve recorded captures (files or dirs) instead of simulating, see replay.py")
+    parser.add_argument('--loop', action='store_true', help="with --replay, start over at the end")
+    args = parser.parse_args()
+
+    if args.offline:
+        import offline
+        offline.generate_file(args.out, args.offline * 3600, args.rate, args.seed, args.start)
+        return
+    if args.replay:
+        import replay
+        argv = args.replay + ['--speed', str(args.speed)] + (['--loop'] if args.loop else [])
+        argv += ['--machines', str(args.machines)] if args.machines > 1 else []
+        argv += ['--start', str(args.start)] if args.start is not None else []
+        argv += ['--duration', str(args.duration)] if args.duration is not None else []
+        replay.main(argv)
+        return
+
+    fleet = start_server(machines=args.machines, extra_channels=args.extra_channels)
     try:
-        while True:
-            print("=== Starting new cycle ===")
-
-            # At beginning of each cycle, we check if a failure is imminent
-            if not machinePartFailureImminent and random.random() < IMMINENT_PROB_PER_CYCLE:
-                machinePartFailureImminent = True
-                cycles_since_imminent = 0
-                cycles_to_failure = 0
-                # choose a random failure span
-                cycles_to_failure = random.randint(CYCLES_TO_FAILURE_MIN, CYCLES_TO_FAILURE_MAX)
-                print(f"Part failure imminent — in {cycles_to_failure} cycles. this data not provided to ML model.")
-
-            # run a full cycle
-            cycle_data = run_cycle()
-
-            # label and plan to trigger actual failure
-            if machinePartFailureImminent:
-                cycles_since_imminent += 1 # track since imminent flag went high
-                
-                # trigger failure after a certain number of cycles (defined randomly in a range)
-                if cycles_since_imminent >= cycles_to_failure:
-                    print("Part has failed—stopping for replacement")
-
-                    # the stage is PartReplacement since the part is broken
-                    # this is used by the ML model to predict this stage happening
-                    stage_var.set_value("PartReplacement")
-                    melt_temp_var.set_value(0.0)
-                    injection_pressure_var.set_value(0.0)
-                    vibration_amplitude_var.set_value(0.0)
-                    vibration_frequency_var.set_value(0.0)
-                    timestamp_var.set_value(time.time())
-                    time.sleep(10)
-                    stage_var.set_value("PreInjection") # set back to restart
-                    machinePartFailureImminent = False
-                    cycles_since_imminent = 0
-                    cycles_to_failure = 0
-
-
+        achieved = run_fleet(fleet, args.rate, args.seed, args.speed, args.start, args.duration)
+        print(f"done, achieved {achieved:.1f} ticks/s per machine")
     except KeyboardInterrupt:
         print("exiting")
     finally:
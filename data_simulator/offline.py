@@ -0,0 +1,217 @@
+"""
+Offline (faster than real time) version of the injection moulding simulator
+
+Uses the same SENSOR_RANGES, STAGE_DURATIONS, drift and anomaly models as injection_moulding.py but
+builds whole stages for a batch of cycles at once as NumPy arrays instead of sleeping 10ms per
+reading, so a day of 100Hz data takes seconds. Output is in the logger's row format
+(timestamp_us,temp,pressure,amplitude,frequency,stage,0) as csv, or as .hfb (beaglebone/hfbin.py).
+
+Matches the live simulator's behaviour:
+- ramp stages end on the first reading past the threshold (PreInjection/Injection/Cooling)
+- Holding and Waiting are fixed length
+- each reading redraws the ramp duration (+-20%), except Cooling which fixes it per cycle
+- 20% chance per cycle that a failure becomes imminent, the part fails 2-8 cycles later
+- while imminent vibration_amplitude drifts up by DRIFT_PERCENT over each stage
+- a failed part gives PartReplacement rows of zeros for 10s, with the timestamp frozen at the
+  failure time, which is what the logger records from the live server
+
+Usage:
+  python offline.py --hours 24 --out training_data.csv --seed 1
+  python injection_moulding.py --offline 24 --out train_day.hfb
+"""
+
+import argparse
+import os
+import sys
+import time
+import numpy as np
+
+from injection_moulding import (SENSOR_RANGES, STAGE_DURATIONS, DRIFT_PERCENT, IMMINENT_PROB_PER_CYCLE,
+                                CYCLES_TO_FAILURE_MIN, CYCLES_TO_FAILURE_MAX, ANOMALY_PROB, REPLACEMENT_SECONDS,
+                                STAGE_ORDER, STAGE_MODELS, STAGE_ANOMALY, STAGE_EXIT)
+
+STAGES = STAGE_ORDER + ["PartReplacement"]  # code = index, same order as hfbin.STAGES
+CHANNELS = ["melt_temp", "injection_pressure", "vibration_amplitude", "vibration_frequency"]
+
+
+def plan_cycles(n_cycles, rng):
+    """per cycle (failure imminent during the cycle, part fails after the cycle), same state machine as Machine"""
+    imminent = np.zeros(n_cycles, dtype=bool)
+    fails = np.zeros(n_cycles, dtype=bool)
+    is_imminent = False
+    since = to_failure = 0
+    for c in range(n_cycles):
+        if not is_imminent and rng.random() < IMMINENT_PROB_PER_CYCLE:
+            is_imminent = True
+            since = 0
+            to_failure = rng.integers(CYCLES_TO_FAILURE_MIN, CYCLES_TO_FAILURE_MAX + 1)
+        imminent[c] = is_imminent
+        if is_imminent:
+            since += 1
+            if since >= to_failure:
+                fails[c] = True
+                is_imminent = False
+    return imminent, fails
+
+
+def ramped(rng, value_range, elapsed, duration, direction, shape, anomaly=None):
+    """vectorized simulate_ramped_sensor_value, duration is per reading or per cycle (n,1)"""
+    low, high = value_range
+    progress = np.clip(elapsed / duration, 0.0, 1.0)
+    if direction == "up":
+        base = low + progress * (high - low)
+    elif direction == "down":
+        base = high - progress * (high - low)
+    else:
+        base = np.full(shape, (low + high) / 2.0)
+    base = np.broadcast_to(base, shape)
+    if anomaly is not None:
+        base = np.where(anomaly[:, None], base * np.exp(elapsed / 2.0), base)
+    return base + rng.normal(0.0, abs(high - low) * 0.05, base.shape)
+
+
+def periodic(rng, value_range, elapsed, shape, period=2.0):
+    """vectorized simulate_periodic_sensor_value"""
+    low, high = value_range
+    base = (high + low) / 2.0 + (high - low) / 2.0 * np.sin(2 * np.pi * elapsed / period)
+    return np.broadcast_to(base, shape) + rng.normal(0.0, abs(high - low) * 0.05, shape)
+
+
+def simulate_stage(state, imminent, rate, rng):
+    """one stage for a batch of cycles -> ({channel: (n, L) array}, lengths (n,))"""
+    n = len(imminent)
+    ranges = SENSOR_RANGES[state]
+    base_duration = STAGE_DURATIONS[state]
+    if state in STAGE_EXIT:
+        max_len = int(np.ceil(2.0 * base_duration * rate)) # threshold is normally hit by 1.2x
+    else:
+        max_len = int(round(base_duration * rate))
+    elapsed = (np.arange(max_len) / rate)[None, :]
+    shape = (n, max_len)
+
+    if state == "Cooling":
+        # the live sim draws the Cooling ramp duration once per stage, so it is fixed per cycle
+        duration = rng.uniform(0.8 * base_duration, 1.2 * base_duration, (n, 1))
+        drift_duration = duration
+    elif state in STAGE_EXIT:
+        duration = rng.uniform(0.8 * base_duration, 1.2 * base_duration, shape)
+        drift_duration = base_duration
+    else:
+        duration = drift_duration = base_duration
+
+    anomaly_channel = STAGE_ANOMALY.get(state)
+    anomaly = rng.random(n) < ANOMALY_PROB if anomaly_channel else None
+    values = {}
+    for ch, direction in STAGE_MODELS[state].items():
+        values[ch] = ramped(rng, ranges[ch], elapsed, duration, direction, shape,
+                            anomaly if ch == anomaly_channel else None)
+    drift = 1 + DRIFT_PERCENT * (elapsed / drift_duration)
+    values["vibration_amplitude"] = np.where(imminent[:, None], values["vibration_amplitude"] * drift,
+                                             values["vibration_amplitude"])
+    values["vibration_frequency"] = periodic(rng, ranges["vibration_frequency"], elapsed, shape)
+
+    if state in STAGE_EXIT:
+        ch, threshold, side = STAGE_EXIT[state]
+        crossed = values[ch] >= threshold if side == "above" else values[ch] <= threshold
+        hit = crossed.any(axis=1)
+        lengths = np.where(hit, crossed.argmax(axis=1) + 1, max_len) # the crossing reading is still sent
+    else:
+        lengths = np.full(n, max_len)
+    return values, lengths
+
+
+def simulate_batch(imminent, fails, rate, rng):
+    """a batch of full cycles -> dict of flat arrays in time order (clock is seconds from batch start)"""
+    n = len(imminent)
+    blocks = []
+    for code, state in enumerate(STAGE_ORDER):
+        values, lengths = simulate_stage(state, imminent, rate, rng)
+        L = values["melt_temp"].shape[1]
+        valid = np.arange(L)[None, :] < lengths[:, None]
+        blocks.append((values, np.full((n, L), code, dtype=np.uint8), valid))
+    rep_len = int(round(REPLACEMENT_SECONDS * rate))
+    zeros = np.zeros((n, rep_len))
+    blocks.append(({ch: zeros for ch in CHANNELS}, np.full((n, rep_len), len(STAGE_ORDER), dtype=np.uint8),
+                   np.repeat(fails[:, None], rep_len, axis=1)))
+
+    # side by side stage blocks flattened row major = cycle by cycle, stage by stage
+    valid = np.concatenate([b[2] for b in blocks], axis=1).ravel()
+    out = {ch: np.concatenate([b[0][ch] for b in blocks], axis=1).ravel()[valid] for ch in CHANNELS}
+    out["stage"] = np.concatenate([b[1] for b in blocks], axis=1).ravel()[valid]
+    clock = np.arange(valid.sum()) / rate
+
+    # the live sim sets the timestamp once when the part fails, so every PartReplacement row repeats it
+    rep = out["stage"] == len(STAGE_ORDER)
+    starts = rep & ~np.concatenate([[False], rep[:-1]])
+    frozen = np.maximum.accumulate(np.where(starts, clock, 0.0))
+    out["clock"] = np.where(rep, frozen, clock)
+    out["duration"] = len(clock) / rate
+    return out
+
+
+def generate(seconds, rate=100, seed=None, start_time=None, batch_cycles=256):
+    """yields batches (dict of arrays with timestamp_us) until `seconds` of data have been made"""
+    rng = np.random.default_rng(seed)
+    t0 = time.time() if start_time is None else start_time
+    cycle_seconds = sum(STAGE_DURATIONS.values())
+    n_cycles = int(np.ceil(seconds / cycle_seconds * 1.1)) + 1 # cycles run a bit long, trimmed below
+    imminent, fails = plan_cycles(n_cycles, rng)
+    elapsed = 0.0
+    for i in range(0, n_cycles, batch_cycles):
+        batch = simulate_batch(imminent[i:i + batch_cycles], fails[i:i + batch_cycles], rate, rng)
+        keep = batch["clock"] + elapsed < seconds
+        batch = {k: v[keep] if isinstance(v, np.ndarray) else v for k, v in batch.items()}
+        batch["timestamp_us"] = ((t0 + elapsed + batch["clock"]) * 1e6).astype(np.int64)
+        yield batch
+        elapsed += batch["duration"]
+        if elapsed >= seconds:
+            return
+
+
+def write_csv_rows(f, batch):
+    fmt = "%d,%.2f,%.2f,%.2f,%.2f,%s,0\n"
+    names = np.array(STAGES)[batch["stage"]].tolist()
+    rows = zip(batch["timestamp_us"].tolist(), batch["melt_temp"].tolist(), batch["injection_pressure"].tolist(),
+               batch["vibration_amplitude"].tolist(), batch["vibration_frequency"].tolist(), names)
+    f.write("".join(map(fmt.__mod__, rows)))
+
+
+def generate_file(path, seconds, rate=100, seed=None, start_time=None):
+    """write `seconds` of simulated readings to a .csv or .hfb file, returns the row count"""
+    started = time.time()
+    rows = 0
+    if path.endswith(".hfb"):
+        # binary writer lives with the logger tools
+        sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "beaglebone"))
+        import hfbin
+        with open(path + ".tmp", "wb") as f:
+            f.write(hfbin.pack_header(STAGES))
+            for batch in generate(seconds, rate, seed, start_time):
+                rec = np.zeros(len(batch["stage"]), dtype=hfbin.RECORD_DTYPE)
+                rec["timestamp"] = batch["timestamp_us"]
+                rec["temp"] = batch["melt_temp"]
+                rec["pressure"] = batch["injection_pressure"]
+                rec["amplitude"] = batch["vibration_amplitude"]
+                rec["frequency"] = batch["vibration_frequency"]
+                rec["stage"] = batch["stage"]
+                rec.tofile(f)
+                rows += len(rec)
+        os.replace(path + ".tmp", path)
+    else:
+        with open(path, "w") as f:
+            for batch in generate(seconds, rate, seed, start_time):
+                write_csv_rows(f, batch)
+                rows += len(batch["stage"])
+    print(f"Wrote {rows} rows ({seconds / 3600:.1f} h at {rate:g}Hz) to {path} in {time.time() - started:.1f}s")
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate simulated machine data faster than real time")
+    parser.add_argument('--hours', type=float, default=1.0, help="hours of data to generate")
+    parser.add_argument('--rate', type=float, default=100, help="sample rate (Hz)")
+    parser.add_argument('--seed', type=int, default=None, help="RNG seed for reproducible datasets")
+    parser.add_argument('--start', type=float, default=None, help="unix time of the first reading (default now)")
+    parser.add_argument('--out', default='training_data.csv', help="output file (.csv or .hfb)")
+    args = parser.parse_args()
+    generate_file(args.out, args.hours * 3600, args.rate, args.seed, args.start)
@@ -0,0 +1,235 @@
+"""
+Replay recorded captures through the simulator's OPC-UA nodes
+
+The live simulator is random, so an incident seen on the floor can't be reproduced and two load tests
+never see the same data. This serves recorded logger files (train_<ts>.csv, log_<ts>.csv, .hfb, or a
+dir of them) through the same InjectionMouldingMachine nodes and Snapshot array as injection_moulding.py,
+so the C logger, collector and predictive_maintain.py can't tell the difference.
+
+- every row is loaded into NumPy arrays first (timestamps, values, stage codes, due time), the serve
+  loop only indexes them, so pacing holds at kHz rates
+- rows are served at their recorded timing (--speed 1), N x faster, or as fast as possible (--speed 0).
+  Gaps longer than --max-gap (capture off, files from different days) are shortened to it
+- a row that repeats the previous row's timestamp is the logger re-reading a server that hadn't changed
+  (all through a PartReplacement), it is served once like the live server did
+- timestamps are moved to start at --start (default now) and keep increasing across --loop passes,
+  --original-timestamps serves the recorded ones
+- with --machines N each machine replays a source (round robin), machines sharing a source start
+  evenly spaced through it so they are not in lockstep
+
+Usage:
+  python replay.py train/train_1745973055.csv
+  python replay.py train/ --speed 10 --loop
+  python replay.py logs/ train/ --speed 0 --machines 4
+  python injection_moulding.py --replay train/ --speed 10 --loop     # same thing
+"""
+
+import argparse
+import csv
+import glob
+import os
+import re
+import sys
+import time
+import numpy as np
+
+import injection_moulding
+from injection_moulding import SNAPSHOT_STAGES, publish_reading, start_server
+
+# hfbin.py lives with the logger tools in beaglebone/ (everything is flat in /home/debian on the BBB)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'beaglebone'))
+import hfbin
+
+MAX_GAP = 15.0  # seconds, longer than a PartReplacement (10s) so failures keep their real timing
+MAX_LAG = 1.0   # seconds behind schedule before the schedule is moved instead of bursting to catch up
+
+
+class Recording:
+    """one source's rows in time order, ts in us, values (n, 4), stage codes into SNAPSHOT_STAGES"""
+    def __init__(self, ts, values, stages, max_gap=MAX_GAP):
+        keep = np.ones(len(ts), dtype=bool)
+        keep[1:] = ts[1:] != ts[:-1]
+        self.repeats = int(len(ts) - keep.sum())
+        self.ts, self.values, self.stages = ts[keep], values[keep], stages[keep]
+        if len(self.ts) == 0:
+            raise ValueError("no rows to replay")
+        step = np.diff(self.ts) / 1e6
+        # due time of each row in recorded seconds from the first one, long gaps shortened
+        self.offsets = np.concatenate([[0.0], np.cumsum(np.clip(step, 0.0, max_gap))])
+        typical = float(np.median(step[step > 0])) if np.any(step > 0) else 1.0
+        self.period = self.offsets[-1] + typical  # one pass, the last row to the first again when looping
+
+    def __len__(self):
+        return len(self.ts)
+
+
+def list_captures(path):
+    """a file, or the capture files in a dir in time order (the unix time the logger puts in the name)"""
+    if not os.path.isdir(path):
+        return [path]
+    files = glob.glob(os.path.join(path, '*.csv')) + glob.glob(os.path.join(path, f'*{hfbin.EXT}'))
+
+    def file_ts(p):
+        m = re.search(r'_(\d+)\.\w+$', p)
+        return int(m.group(1)) if m else 0
+    return sorted(files, key=lambda p: (file_ts(p), p))
+
+
+def read_csv(path):
+    """logger csv -> (ts, values, stage codes), malformed rows (a torn last line) are skipped"""
+    ts, values, stages = [], [], []
+    with open(path, newline='') as f:
+        for row in csv.reader(f):
+            try:
+                code = SNAPSHOT_STAGES.index(row[5])
+                v = (float(row[1]), float(row[2]), float(row[3]), float(row[4]))
+                t = int(row[0])
+            except (ValueError, IndexError):
+                continue
+            ts.append(t)
+            values.append(v)
+            stages.append(code)
+    return (np.array(ts, dtype=np.int64), np.array(values, dtype=np.float64).reshape(-1, 4),
+            np.array(stages, dtype=np.uint8))
+
+
+def read_hfb(path):
+    records, names = hfbin.read(path, mmap=False)
+    lut = np.array([SNAPSHOT_STAGES.index(s) if s in SNAPSHOT_STAGES else 255 for s in names] or [255], dtype=np.uint8)
+    stages = lut[records['stage']]
+    ok = stages != 255
+    values = np.column_stack([records[c] for c in ('temp', 'pressure', 'amplitude', 'frequency')]).astype(np.float64)
+    return records['timestamp'].astype(np.int64)[ok], values[ok], stages[ok]
+
+
+def load(path, max_gap=MAX_GAP):
+    """every capture under path as one Recording"""
+    parts = [read_hfb(p) if p.endswith(hfbin.EXT) else read_csv(p) for p in list_captures(path)]
+    if not parts:
+        raise ValueError(f"{path}: no captures found")
+    ts, values, stages = (np.concatenate(cols) for cols in zip(*parts))
+    return Recording(ts, values, stages, max_gap)
+
+
+class ReplayMachine:
+    """
+    one machine's playback of a Recording, starting `shift` recorded seconds in
+    - due(i) is the i-th row's time on this machine's own timeline (recorded seconds from its start)
+    """
+    def __init__(self, nodes, rec, shift=0.0, loop=False, start=None, original_timestamps=False):
+        self.nodes = nodes
+        self.rec = rec
+        self.loop = loop
+        self.first = int(np.searchsorted(rec.offsets, shift, side='left')) % len(rec)
+        self.base = rec.offsets[self.first]
+        self.start = time.time() if start is None else start
+        self.original = original_timestamps
+        self.sequence = 0
+        self.served = 0
+
+    def due(self, n=None):
+        """timeline time of the n-th row served (default the next one), None when done"""
+        n = self.served if n is None else n
+        size = len(self.rec)
+        passes, i = divmod(self.first + n, size)
+        if passes and not self.loop and (passes > 1 or i >= self.first):
+            return None
+        return passes * self.rec.period + self.rec.offsets[i] - self.base
+
+    def serve_until(self, t):
+        """publish every row due by timeline time t, returns how many"""
+        size, count = len(self.rec), 0
+        while True:
+            due = self.due()
+            if due is None or due > t:
+                return count
+            i = (self.first + self.served) % size
+            self.sequence += 1
+            if self.original:
+                now = self.rec.ts[i] / 1e6
+            else:
+                now = self.start + due
+            publish_reading(self.nodes, self.sequence, now, SNAPSHOT_STAGES[self.rec.stages[i]], self.rec.values[i])
+            self.served += 1
+            count += 1
+
+
+def run_replay(fleet, recordings, speed=1.0, loop=False, start=None, original_timestamps=False,
+               duration=None, report_every=10.0):
+    """
+    serve the recordings through the fleet's nodes, machine i plays recordings[i % len(recordings)]
+    - returns (rows served, wall seconds)
+    """
+    start = time.time() if start is None else start
+    machines = []
+    for i, nodes in enumerate(fleet):
+        rec = recordings[i % len(recordings)]
+        sharing = len(range(i % len(recordings), len(fleet), len(recordings)))
+        shift = (i // len(recordings)) * rec.period / sharing
+        machines.append(ReplayMachine(nodes, rec, shift, loop, start, original_timestamps))
+    rows = sum(len(r) for r in recordings)
+    print(f"Replaying {rows} rows to {len(machines)} machines, "
+          f"{'as fast as possible' if speed <= 0 else f'{speed:g}x recorded timing'}{', looping' if loop else ''}")
+
+    wall_start = began = window_start = time.monotonic()
+    late = served = window_served = 0
+    while True:
+        pending = [d for d in (m.due() for m in machines) if d is not None]
+        if not pending or (duration is not None and min(pending) >= duration):
+            break
+        if speed > 0:
+            due = wall_start + min(pending) / speed
+            delay = due - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            elif -delay > MAX_LAG:
+                wall_start += -delay # too far behind, move the schedule instead of bursting
+                late += 1
+            elif delay < 0:
+                late += 1
+            t = (time.monotonic() - wall_start) * speed
+        else:
+            t = min(pending)
+        if duration is not None:
+            t = min(t, duration)
+        n = sum(m.serve_until(t) for m in machines)
+        served += n
+        window_served += n
+        elapsed = time.monotonic() - window_start
+        if elapsed >= report_every:
+            print(f"served {window_served / elapsed:.1f} rows/s, {late} late wakeups")
+            window_start, window_served = time.monotonic(), 0
+    return served, time.monotonic() - began
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve recorded captures through the simulator's OPC-UA nodes")
+    parser.add_argument('sources', nargs='+', help="capture files or dirs (train/, logs/), one per machine round robin")
+    parser.add_argument('--speed', type=float, default=1.0, help="recorded seconds per real second, 0 = as fast as possible")
+    parser.add_argument('--loop', action='store_true', help="start over at the end, forever")
+    parser.add_argument('--machines', type=int, default=None, help="machines to serve (default one per source)")
+    parser.add_argument('--max-gap', type=float, default=MAX_GAP, help="longest pause between rows, seconds")
+    parser.add_argument('--start', type=float, default=None, help="unix time of the first served row (default now)")
+    parser.add_argument('--original-timestamps', action='store_true', help="serve the recorded timestamps unchanged")
+    parser.add_argument('--duration', type=float, default=None, help="stop after this many recorded seconds")
+    args = parser.parse_args(argv)
+
+    recordings = []
+    for path in args.sources:
+        rec = load(path, args.max_gap)
+        print(f"{path}: {len(rec)} rows, {rec.period:.1f}s per pass ({rec.repeats} repeated rows dropped)")
+        recordings.append(rec)
+    machines = args.machines or len(recordings)
+    fleet = start_server(machines=machines)
+    try:
+        served, wall = run_replay(fleet, recordings, args.speed, args.loop, args.start,
+                                  args.original_timestamps, args.duration)
+        print(f"done, served {served} rows in {wall:.1f}s ({served / wall if wall else 0:.1f} rows/s)")
+    except KeyboardInterrupt:
+        print("exiting")
+    finally:
+        injection_moulding.server.stop()
+
+
+if __name__ == "__main__":
+    main()
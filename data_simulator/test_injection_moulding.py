@@ -0,0 +1,83 @@
+"""
+python -m pytest data_simulator/test_injection_moulding.py
+"""
+
+import os
+import socket
+import sys
+
+import pytest
+from opcua import Client
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import injection_moulding as im
+
+EXTRA = 2
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def opcua_server():
+    endpoint = f"opc.tcp://127.0.0.1:{free_port()}/freeopcua/server/"
+    fleet = im.start_server(endpoint, machines=2, extra_channels=EXTRA)
+    client = Client(endpoint)
+    client.connect()
+    try:
+        yield fleet, client
+    finally:
+        client.disconnect()
+        im.server.stop()
+
+
+def read(client, nodes, name):
+    return client.get_node(nodes[name].nodeid).get_value()
+
+
+def test_snapshot_round_trip(opcua_server):
+    fleet, client = opcua_server
+    nodes = fleet[1]
+    extra = [("Extra0", -0.25), ("Extra1", 3.5)]
+    for sequence, stage in enumerate(im.SNAPSHOT_STAGES, 1):
+        now = 1745973055.0 + sequence / 100
+        core = [200.0 + sequence, 1500.0, 0.3 * sequence, 10.0]
+        im.publish_reading(nodes, sequence, now, stage, core, extra)
+
+        row = im.decode_snapshot(read(client, nodes, "Snapshot"), EXTRA)
+        assert row == {"Sequence": sequence, "Timestamp": now, "MeltTemp": core[0], "InjectionPressure": core[1],
+                       "VibrationAmplitude": core[2], "VibrationFrequency": core[3], "Stage": stage,
+                       "Extra0": -0.25, "Extra1": 3.5}
+        # the individual variables hold the same reading
+        assert read(client, nodes, "Stage") == stage
+        assert read(client, nodes, "Timestamp") == now
+        assert [read(client, nodes, var) for var in im.VARIABLES[:4]] == core
+        assert [read(client, nodes, name) for name, _ in extra] == [v for _, v in extra]
+
+    # the other machine's Snapshot is untouched
+    assert read(client, fleet[0], "Snapshot") == [0.0] * len(im.SNAPSHOT_FIELDS)
+
+
+def test_machine_ticks_publish_consistent_snapshots(opcua_server):
+    fleet, client = opcua_server
+    nodes = fleet[0]
+    machine = im.Machine(nodes, im.machine_name(0), seed=1)
+    stages = set()
+    for tick in range(1, 2001):
+        now = 1745973055.0 + tick / 100
+        values = machine.tick(now)
+        if values is None:
+            continue
+        row = im.decode_snapshot(read(client, nodes, "Snapshot"), EXTRA)
+        assert row["Sequence"] == machine.sequence
+        assert row["Timestamp"] == now
+        assert row["Stage"] == read(client, nodes, "Stage")
+        assert [row[var] for var in im.VARIABLES[:4]] == pytest.approx(
+            [values["melt_temp"], values["injection_pressure"], values["vibration_amplitude"],
+             values["vibration_frequency"]])
+        assert [row[f"Extra{i}"] for i in range(EXTRA)] == [read(client, nodes, f"Extra{i}") for i in range(EXTRA)]
+        stages.add(row["Stage"])
+    assert stages == set(im.STAGE_ORDER)